@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Measure the cold startup time of BTyper3
+
+Each measurement runs in a fresh interpreter, so that no module is already
+imported. The script reports the median wall time of importing btyper3, of
+running `btyper3 --version`, and of importing the modules of each typing
+stage, along with the heavy dependencies that each of them loads.
+
+usage: python benchmarks/startup.py [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# dependencies whose import cost is tracked
+HEAVY_MODULES = ("pandas", "numpy", "pyfastani", "Bio")
+
+# snippets timed in a fresh interpreter
+SNIPPETS = {
+	"import btyper3": "import btyper3",
+	"btyper3 --version": "import sys; sys.argv = ['btyper3', '--version']; import btyper3\ntry:\n\tbtyper3.main()\nexcept SystemExit:\n\tpass",
+	"import btyper3.pipeline": "import btyper3.pipeline",
+	"import btyper3.mlst": "import btyper3.mlst",
+	"import btyper3.panc": "import btyper3.panc",
+	"import btyper3.ani": "import btyper3.ani",
+}
+
+# reports the modules loaded by a snippet, run after it in the same interpreter
+REPORT = "\nimport json, sys\nprint(json.dumps([m for m in {} if m in sys.modules]), file=sys.stderr)".format(list(HEAVY_MODULES))
+
+
+def run(snippet):
+	start = time.perf_counter()
+	proc = subprocess.run([sys.executable, "-c", snippet + REPORT], stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True, check = True)
+	elapsed = time.perf_counter() - start
+	loaded = json.loads(proc.stderr.strip().splitlines()[-1])
+	return elapsed, loaded
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "Measure the cold startup time of BTyper3")
+	parser.add_argument("--repeat", help = "number of runs of each measurement; default = 10", type = int, default = 10)
+	args = parser.parse_args()
+
+	# run against the source tree this script belongs to
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))
+
+	baseline = statistics.median(run("pass")[0] for _ in range(args.repeat))
+	print("{:<28}{:>10}{:>12}  {}".format("measurement", "median(s)", "overhead(s)", "heavy modules loaded"))
+	print("{:<28}{:>10.3f}{:>12}  {}".format("python -c pass", baseline, "", ""))
+	for name, snippet in SNIPPETS.items():
+		times = []
+		for _ in range(args.repeat):
+			elapsed, loaded = run(snippet)
+			times.append(elapsed)
+		median = statistics.median(times)
+		print("{:<28}{:>10.3f}{:>12.3f}  {}".format(name, median, median - baseline, ", ".join(loaded) or "-"))
+
+
+if __name__ == "__main__":
+	main()
@@ -1,37 +1,63 @@
 #!/usr/bin/env python3
 
 import argparse
-import contextlib
 import datetime
-import importlib.resources
+import importlib
 import logging
 import os
 import sys
-import shutil
-import tempfile
-import urllib.request
-import warnings
-import xml.etree.ElementTree as etree
-
-from Bio import SeqIO
-
-from .ani import Ani
-from .blast import Blast
-from .mlst import Mlst
-from .print_final_results import FinalResults
 
 __author__ = "Laura M. Carroll <lmc297@cornell.edu>"
 __version__ = "3.4.0"
 
-
-@contextlib.contextmanager
-def _forward_warnings():
-	_showwarning = warnings.showwarning
-	try:
-		warnings.showwarning = lambda message, category, filename, lineno, file=None, line=None: logging.warning(f"Warning: {message}")
-		yield
-	finally:
-		warnings.showwarning = _showwarning
+# the public classes are imported on first use, so that the command line
+# starts without loading pandas, Biopython or pyfastani until a typing stage
+# needs them
+_LAZY_ATTRIBUTES = {
+	"Ani": ".ani",
+	"Blast": ".blast",
+	"Mlst": ".mlst",
+	"Pipeline": ".pipeline",
+	"find_genomes": ".pipeline",
+	"genome_prefix": ".pipeline",
+	"FinalResults": ".print_final_results",
+	"TypingServer": ".server",
+	"Typer": ".typer",
+	"TypingResult": ".typer",
+}
+
+
+# library users configure the logging of BTyper3 as they see fit, while the
+# command line logs to a file and to the console (see _log_to_file)
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def __getattr__(name):
+	if name in _LAZY_ATTRIBUTES:
+		module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+		value = getattr(module, name)
+		globals()[name] = value
+		return value
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+	return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+def _log_to_file(log_file):
+	# log the messages of BTyper3 to a log file and to the console, without
+	# configuring the root logger of the process; warnings (e.g., of
+	# PyFastANI) are captured once for the whole process, rather than by
+	# patching warnings.showwarning around each stage, which isn't safe with
+	# concurrent worker threads
+	logging.captureWarnings(True)
+	for handler in (logging.FileHandler(log_file, mode = "a+"), logging.StreamHandler()):
+		handler.setFormatter(logging.Formatter("%(message)s"))
+		logger.addHandler(handler)
+		logging.getLogger("py.warnings").addHandler(handler)
+	logger.setLevel(logging.DEBUG)
 
 
 def run_pipeline(args):
@@ -39,14 +65,14 @@ def run_pipeline(args):
 	run btyper3
 	"""
 
-	# get path to btyper3 executable
-	btyper3_path = os.path.realpath(__file__)
-	btyper3_path = btyper3_path.rpartition("/")[0].strip() + "/"
+	from .pipeline import Pipeline, find_genomes, genome_prefix
+	from .manifest import Manifest
+	from .results import FORMATS, ResultsWriter
 
-	# get input and output arguments and prefix to use for output files
-	infile = args.input[0]
-	prefix = infile.split("/")[-1].strip()
-	prefix = ".".join(prefix.split(".")[0:-1])
+	# get the genomes to type: the input can be a single genome, a directory,
+	# a glob pattern or a manifest file listing genomes
+	genomes = find_genomes(args.input[0])
+	batch = len(genomes) > 1 or genomes[0] != args.input[0]
 	output = args.output[0]
 
 	# add a / to output directory name, if one is not already supplied
@@ -70,384 +96,235 @@ def run_pipeline(args):
 	final_results_directory = output + "btyper3_final_results/"
 
 	# initialize log file
-	logging.basicConfig(level = logging.DEBUG, filename = final_results_directory + "logs/" + prefix + ".log", filemode = "a+", format = "%(message)s")
-	logging.getLogger().addHandler(logging.StreamHandler())
-
-
-	# get arguments
-	# evalue is stored as a string because it gets passed to blast command as a string
-	ani_species = args.ani_species
-	ani_subspecies = args.ani_subspecies
-	ani_geneflow = args.ani_geneflow
-	ani_typestrains = args.ani_typestrains
-	virulence = args.virulence
-	bt = args.bt
-	mlst = args.mlst
-	panC = args.panC
-	vdb = args.virulence_db
-	vpthresh = int(args.virulence_identity)
-	vqthresh = int(args.virulence_coverage)
-	bpthresh = int(args.bt_identity)
-	bqthresh = int(args.bt_coverage)
-	overlap = float(args.bt_overlap)
-	evalue = str(args.evalue)
-	download_mlst_latest = args.download_mlst_latest
+	log_prefix = "btyper3_batch" if batch else genome_prefix(genomes[0])
+	_log_to_file(final_results_directory + "logs/" + log_prefix + ".log")
 
 	# log to file
 	now = datetime.datetime.now
-	logging.info("Welcome to BTyper3!")
-	logging.info("You are initializing this run at " + now().strftime("%Y-%m-%d %H:%M"))
-	logging.info("You ran the following command: ")
-	logging.info(" ".join([str(sa) for sa in sys.argv]))
-	logging.info("Report bugs/concerns to Laura M. Carroll <laura.carroll@embl.de>")
-
-
-	# perform species and/or supspecies assignment
-	if ani_species == "True" or ani_subspecies == "True" or ani_geneflow == "True" or ani_typestrains == "True":
-
-		with _forward_warnings():
-
-			if ani_species == "True":
-
-				get_species = Ani(
-					taxon = "species",
-					fasta = infile,
-					final_results_directory = final_results_directory,
-					prefix = prefix)
-
-				logging.info("Using PyFastANI to assign " + prefix + " to a species at " + now().strftime("%Y-%m-%d %H:%M"))
-				final_species = get_species.run_fastani("species", infile, final_results_directory, prefix)
-				logging.info("Finished species assignment of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-			else:
-
-				final_species = "(Species assignment not performed)"
-
-			if ani_subspecies == "True":
-
-				get_subspecies = Ani(
-					taxon = "subspecies",
-					fasta = infile,
-					final_results_directory = final_results_directory,
-					prefix = prefix)
-
-				logging.info("Using FastANI to assign " + prefix + " to a subspecies (if applicable) at " + now().strftime("%Y-%m-%d %H:%M"))
-				final_subspecies = get_subspecies.run_fastani("subspecies", infile, final_results_directory, prefix)
-				logging.info("Finished subspecies assignment of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-			else:
-
-				final_subspecies = "(Subspecies assignment not performed)"
-
-			if ani_geneflow == "True":
-
-				get_geneflow = Ani(
-					taxon = "geneflow",
-					fasta = infile,
-					final_results_directory = final_results_directory,
-					prefix = prefix)
-
-				logging.info("Using FastANI to assign " + prefix + " to a pseudo-gene flow unit at " + now().strftime("%Y-%m-%d %H:%M"))
-				final_geneflow = get_geneflow.run_fastani("geneflow", infile, final_results_directory, prefix)
-				logging.info("Finished pseudo-gene flow unit assignment of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-			else:
-
-				final_geneflow = "(Pseudo-gene flow unit assignment not performed)"
-
-			if ani_typestrains == "True":
-
-				get_typestrains = Ani(
-					taxon = "typestrains",
-					fasta = infile,
-					final_results_directory = final_results_directory,
-					prefix = prefix)
-
-				logging.info("Using FastANI to compare " + prefix + " to B. cereus s.l. species type strain genomes at " + now().strftime("%Y-%m-%d %H:%M"))
-				final_typestrains = get_typestrains.run_fastani("typestrains", infile, final_results_directory, prefix)
-				logging.info("Finished B. cereus s.l. species type strain comparison of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-			else:
-
-				final_typestrains = "(Type strain-based taxonomic assignment not performed)"
-
-	else:
-
-		final_species = "(Species assignment not performed)"
-		final_subspecies = "(Subspecies assignment not performed)"
-		final_geneflow = "(Pseudo-gene flow unit assignment not performed)"
-		final_typestrains = "(Type strain-based taxonomic assignment not performed)"
-
-
-
-	# perform virulence-associated biovar assignment
-	if virulence == "True":
-
-		if vdb == "aa":
-			vdb_name = "btyper3_virulence_sequences.faa"
-			vdb_task = "tblastn"
-
-		elif vdb == "nuc":
-			vdb_name = "btyper3_virulence_sequences.ffn"
-			vdb_task = "blastn"
-
-
-		with importlib.resources.path("btyper3.seq_virulence_db", vdb_name) as vdb_path:
-
-			get_virulence = Blast(
-				task = vdb_task,
-				dbseqs = infile,
-				fasta = vdb_path,
-				final_results_directory = final_results_directory,
-				prefix = prefix,
-				suffix = "virulence",
-				pthresh = vpthresh,
-				qthresh = vqthresh,
-				overlap = overlap,
-				evalue = evalue)
-
-			logging.info("Using " + vdb_task + " to identify potential virulence factors in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-			vir = get_virulence.run_blast(vdb_task, infile, vdb_path, final_results_directory, prefix, "virulence", evalue)
-			anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps = get_virulence.parse_virulence(vir, vpthresh, vqthresh)
-
-			logging.info("Finished virulence factor detection in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-
-	else:
-
-		anthracis = "(Virulence factor detection not performed)"
-		emetic = "(Virulence factor detection not performed)"
-		nhe = "(Virulence factor detection not performed)"
-		hbl = "(Virulence factor detection not performed)"
-		cytK = "(Virulence factor detection not performed)"
-		sph = "(Virulence factor detection not performed)"
-		cap = "(Virulence factor detection not performed)"
-		has = "(Virulence factor detection not performed)"
-		bps = "(Virulence factor detection not performed)"
-
-
-
-	# perform Thuringiensis biovar assignment
-	if bt == "True":
-
-		with importlib.resources.path("btyper3.seq_bt_db", "btyper3_bt_sequences.faa") as bt_path:
-
-			get_bt = Blast(
-				task = "tblastn",
-				dbseqs = infile,
-				fasta = bt_path,
-				final_results_directory = final_results_directory,
-				prefix = prefix,
-				suffix = "bt",
-				pthresh = bpthresh,
-				qthresh = bqthresh,
-				overlap = overlap,
-				evalue = evalue)
-
-			logging.info("Using tblastn to identify potential Bt genes in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-			bt_results = get_bt.run_blast("tblastn", infile, bt_path, final_results_directory, prefix, "bt", evalue)
-			bt_final = get_bt.parse_bt(bt_results, bpthresh, bqthresh, overlap)
-
-			logging.info("Finished Bt toxin gene detection for " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
-
-
-	else:
-
-		bt_final = "(Bt toxin gene detection not performed)"
-
+	logger.info("Welcome to BTyper3!")
+	logger.info("You are initializing this run at " + now().strftime("%Y-%m-%d %H:%M"))
+	logger.info("You ran the following command: ")
+	logger.info(" ".join([str(sa) for sa in sys.argv]))
+	logger.info("Report bugs/concerns to Laura M. Carroll <laura.carroll@embl.de>")
+	if batch:
+		logger.info("Typing " + str(len(genomes)) + " genomes")
+		prefixes = [genome_prefix(infile) for infile in genomes]
+		if len(set(prefixes)) < len(prefixes):
+			logger.warning("Warning: several input genomes share the same file name, their intermediate results will overwrite each other")
+
+	jobs = max(1, min(int(args.jobs), len(genomes)))
+
+	# load the databases once, and type every genome with them
+	with Pipeline(args, final_results_directory, jobs = jobs) as pipeline:
+
+		if batch:
+
+			# genomes are recorded in the manifest as soon as they are typed;
+			# when resuming, genomes already typed with the same databases and
+			# parameters are skipped
+			manifest = Manifest(final_results_directory + "btyper3_manifest.jsonl", pipeline.fingerprint())
+			completed = {}
+			if args.resume == "True":
+				completed = manifest.completed(genomes)
+				logger.info("Resuming batch: " + str(len(completed)) + "/" + str(len(genomes)) + " genomes were already typed")
+			typed = pipeline.map([infile for infile in genomes if infile not in completed], jobs)
+
+			# all genomes are written to a single aggregated results file
+			results_file = args.results_file or final_results_directory + "btyper3_final_results" + FORMATS[args.output_format]
+			with manifest, ResultsWriter(results_file, args.output_format) as writer:
+				for infile in genomes:
+					if infile in completed:
+						writer.write(completed[infile])
+					else:
+						get_final_results = next(typed)
+						manifest.record(infile, get_final_results)
+						writer.write(get_final_results)
+
+			pipeline.write_timings_summary()
+
+		elif args.results_file is not None or args.output_format != "tsv":
+
+			# write results to the requested results file
+			infile = genomes[0]
+			results_file = args.results_file or final_results_directory + genome_prefix(infile) + "_final_results" + FORMATS[args.output_format]
+			with ResultsWriter(results_file, args.output_format) as writer:
+				writer.write(pipeline.type_genome(infile))
+
+		else:
+
+			# print results to a final results file
+			infile = genomes[0]
+			get_final_results = pipeline.type_genome(infile)
+			get_final_results.print_final_results(final_results_directory, infile, get_final_results.prefix, get_final_results.species, get_final_results.subspecies, get_final_results.geneflow, get_final_results.typestrains, get_final_results.anthracis, get_final_results.emetic, get_final_results.nhe, get_final_results.hbl, get_final_results.cytK, get_final_results.sph, get_final_results.cap, get_final_results.has, get_final_results.bps, get_final_results.bt_final, get_final_results.mlst_final, get_final_results.panC_final, get_final_results.custom)
+
+	logger.info("")
+	logger.info("")
+	logger.info("")
+	logger.info("BTyper3 finished at " + now().strftime("%Y-%m-%d %H:%M"))
+	logger.info("Report bugs/concerns to Laura M. Carroll, laura.carroll@embl.de\n")
+	logger.info("Have a nice day!")
+
+
+def run_server(args):
+	"""
+	run the btyper3 typing server
+	"""
 
+	import signal
+	import threading
 
+	from .pipeline import Pipeline
+	from .server import TypingServer
 
-	# perform multi-locus sequence typing (MLST) using PubMLST's seven-gene scheme for Bacillus cereus
-	if mlst == "True":
+	# make the final results and logs directories, where the intermediate
+	# results of each genome are written as in a typing run
+	final_results_directory = os.path.join(args.output[0].strip(), "btyper3_final_results", "")
+	os.makedirs(final_results_directory + "logs", exist_ok = True)
 
-		with contextlib.ExitStack() as ctx:
+	# initialize log file
+	_log_to_file(final_results_directory + "logs/btyper3_serve.log")
 
-			if download_mlst_latest == "True":
+	now = datetime.datetime.now
+	logger.info("Welcome to BTyper3!")
+	logger.info("You are starting a typing server at " + now().strftime("%Y-%m-%d %H:%M"))
+	logger.info("You ran the following command: ")
+	logger.info(" ".join([str(sa) for sa in sys.argv]))
 
-				logging.info("Downloading most recent PubMLST datbase at " + now().strftime("%Y-%m-%d %H:%M"))
-				with urllib.request.urlopen("https://pubmlst.org/data/dbases.xml") as req:
-					tree = etree.parse(req)
-					parent = next(e for e in tree.iter("species") if e.text.strip() == "Bacillus cereus")
-					urls = (e.text for e in parent.iter("url"))
+	# load the databases once, and type every request with them
+	jobs = max(1, int(args.jobs))
+	with Pipeline(args, final_results_directory, jobs = jobs) as pipeline:
+		server = TypingServer(pipeline, workers = jobs, queue_size = args.queue_size)
 
-				mlst_file = ctx.enter_context(tempfile.NamedTemporaryFile(suffix=".fas", mode="wb", buffering=0))
-				bcereus_file = ctx.enter_context(tempfile.NamedTemporaryFile(suffix=".txt", mode="wb", buffering=0))
-				mlst_path = mlst_file.name
-				bcereus_path = bcereus_file.name
+		# stop accepting requests on SIGTERM, as on Ctrl-C; the shutdown must
+		# be requested from another thread than the one serving requests
+		signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target = server.shutdown).start())
+		try:
+			server.serve(args.host, args.port, args.socket)
+		except KeyboardInterrupt:
+			pass
 
-				for url in urls:
-					if "alleles_fasta" in url:
-						with urllib.request.urlopen(url) as req:
-							shutil.copyfileobj(req, mlst_file)
-					elif "profiles_csv" in url:
-						with urllib.request.urlopen(url) as req:
-							shutil.copyfileobj(req, bcereus_file)
+	logger.info("BTyper3 server stopped at " + now().strftime("%Y-%m-%d %H:%M"))
 
-				logging.info("Finished downloading most recent PubMLST datbase at " + now().strftime("%Y-%m-%d %H:%M"))
 
-			else:
 
-				db_time = importlib.resources.read_text("btyper3.seq_mlst_db", "timestamp.txt").strip()
-				logging.info("Using local PubMLST database (downloaded at {})".format(db_time))
+def add_typing_arguments(parser):
+	"""
+	add the typing options shared by typing runs and the typing server to a command line parser
+	"""
 
-				mlst_path = ctx.enter_context(importlib.resources.path("btyper3.seq_mlst_db", "mlst.fas"))
-				bcereus_path = ctx.enter_context(importlib.resources.path("btyper3.seq_mlst_db", "bcereus.txt"))
+	parser.add_argument("--ani_species", help = "Optional argument; True or False; assign genome to a species using FastANI; default = True", nargs = "?", default = "True")
 
+	parser.add_argument("--ani_subspecies", help = "Optional argument; True or False; assign genome to a subspecies, if relevant, using FastANI; default = True", nargs = "?", default = "True")
 
-			get_mlst = Blast(
-				task = "blastn",
-				dbseqs = infile,
-				fasta = mlst_path,
-				final_results_directory = final_results_directory,
-				prefix = prefix,
-				suffix = "mlst",
-				pthresh = 0,
-				qthresh = 0,
-				overlap = overlap,
-				evalue = evalue)
+	parser.add_argument("--ani_geneflow", help = "Optional argument; True or False; assign genome to a pseudo-gene flow unit using the method described by Carroll, et al. using FastANI; default = False", nargs = "?", default = "False")
 
-			logging.info("Using blastn to identify potential seven-gene MLST genes in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+	parser.add_argument("--ani_typestrains", help = "Optional argument; True or False; calculate ANI values between the query genome relative to all B. cereus s.l. species type strain genomes using FastANI, and report the closest species type strain/highest ANI value; default = True", nargs = "?", default = "True")
 
-			mlst_results = get_mlst.run_blast("blastn", infile, mlst_path, final_results_directory, prefix, "mlst", evalue)
-			mlst_alleles, perfect_matches = get_mlst.parse_mlst(mlst_results)
+	parser.add_argument("--ani_prescreen", help = "Optional argument for use with --ani_species, --ani_subspecies, --ani_geneflow, and/or --ani_typestrains True, and/or --ani_custom; integer; number of reference genomes of each ANI database (including the custom ANI database, which is then not indexed in shards) to shortlist by MinHash (Mash) distance to the query genome before calculating ANI values with FastANI, which speeds up large ANI databases; a value of at least 5 is recommended with --ani_geneflow True; specify 0 to calculate ANI values relative to all reference genomes; default = 0", nargs = "?", default = 0)
 
-			logging.info("Finished seven-gene MLST gene detection for " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+	parser.add_argument("--ani_custom", help = "Optional argument; path to a user-supplied ANI database, i.e., a tab-separated file with one reference genome per row and (i) an id column containing the path to the reference genome in FASTA format (optionally gzipped; relative paths are relative to the database file), (ii) a threshold column containing the ANI threshold for the reference, and (iii) an optional name column containing the name to report for the reference; the query genome is assigned to the reference producing the highest ANI value using FastANI (an asterisk is added if the ANI value is below the threshold of the reference), which is reported in an additional Custom_Database(ANI) column; default = None", nargs = "?", default = None)
 
-			get_st = Mlst(
-				alleles = mlst_alleles,
-				profiles = bcereus_path,
-				perfect_matches = perfect_matches,
-				final_results_directory = final_results_directory,
-				prefix = prefix)
+	parser.add_argument("--ani_custom_memory", help = "Optional argument for use with --ani_custom; approximate maximum memory used to index the custom ANI database (e.g., 500M, 8G); larger databases are indexed in several shards, which are stored in the cache directory (see --cache_dir) and searched one at a time; shards that don't fit in this amount of memory together are loaded from disk again for each genome, so a limit large enough for a single shard makes batches faster; with --jobs, each worker process can use up to this amount of memory; default = 4G", nargs = "?", default = "4G")
 
+	parser.add_argument("--virulence", help = "Optional argument; True or False; perform virulence gene detection (required if one wants to assign genomes to biovars Anthracis or Emeticus); default = True", nargs = "?", default = "True")
 
-			mlst_final = get_st.at2st(mlst_alleles, bcereus_path, perfect_matches, final_results_directory, prefix)
+	parser.add_argument("--bt", help = "Optional argument; True or False; perform Bt toxin gene detection for cry, cyt, and vip genes (required if one wants to assign genomes to biovar Thuringiensis); default = True", nargs = "?", default = "True")
 
+	parser.add_argument("--mlst", help = "Optional argument; True or False; assign genome to a sequence type (ST) using the seven-gene multi-locus sequence typing (MLST) scheme available in PubMLST; default = True", nargs = "?", default = "True")
 
-	else:
+	parser.add_argument("--panC", help = "Optional argument; True or False; assign genome to a phylogenetic group (Group I-VIII) using an adjusted, eight-group panC group assignment scheme; default = True", nargs = "?", default = "True")
 
-		mlst_final = "(Seven-gene MLST not performed)"
+	parser.add_argument("--virulence_db", help = "Optional argument for use with --virulence True; aa or nuc; database to use for virulence factor detection: aa for the amino acid sequence database, or nuc for the nucleotide sequence database; option aa uses translated nucleotide blast and allows for the detection of more remote homologs, but is slower than nuc, which uses blastn; default = aa", nargs = "?", default = "aa")
 
+	parser.add_argument("--virulence_identity", help = "Optional argument for use with --virulence True; integer from 0 to 100; minimum percent amino acid/nucleotide identity threshold for a virulence gene to be considered present, depending on choice of --virulence_db aa or nuc, respectively; default = 70", nargs = "?", default = 70)
 
+	parser.add_argument("--virulence_coverage", help = "Optional argument for use with --virulence True; integer from 0 to 100; minimum percent coverage threshold for a virulence gene to be considered present; default = 80", nargs = "?", default = 80)
 
-	# perform panC phylogenetic group assignment using the adjusted, eight-group panC group assignment scheme
-	if panC == "True":
+	parser.add_argument("--bt_identity", help = "Optional argument for use with --bt True; integer from 0 to 100; minimum percent amino acid identity threshold for a Bt toxin gene to be considered present; default = 50", nargs = "?", default = 50)
 
-		with importlib.resources.path("btyper3.seq_panC_db", "panC.fna") as panC_path:
+	parser.add_argument("--bt_coverage", help = "Optional argument for use with --bt True; integer from 0 to 100; minimum percent coverage threshold for a Bt toxin gene to be considered present; default = 70", nargs = "?", default = 70)
 
-			get_panC = Blast(
-				task = "blastn",
-				dbseqs = infile,
-				fasta = panC_path,
-				final_results_directory = final_results_directory,
-				prefix = prefix,
-				suffix = "panC",
-				pthresh = 0,
-				qthresh = 0,
-				overlap = overlap,
-				evalue = evalue)
+	parser.add_argument("--bt_overlap", help = "Optional argument for use with --bt True; float from 0 to 1; specify maximum proportion of overlap for overlapping Bt toxin genes to be considered separate genes; Bt toxin genes below this threshold will be considered separate, while those above it will be considered overlapping, and only the top hit will be reported; default=0.7", nargs = "?", default = 0.7)
 
-			logging.info("Using blastn to identify panC in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+	parser.add_argument("--evalue", help = "Optional argument for use with --virulence True and/or --bt True; float >= 0; maximum blast e-value for a hit to be saved; note that if both --virulence True and --bt True, this e-value threshold will be applied to both analyses; default = 1e-5", nargs = "?", default = 1e-5)
 
-			panC_results = get_panC.run_blast("blastn", infile, panC_path, final_results_directory, prefix, "panC", evalue)
-			panC_final = get_panC.parse_panC(panC_results)
-			logging.info("Finished panC gene detection for " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+	parser.add_argument("--download_mlst_latest", help = "Optional argument for use with --mlst True; True or False; download the latest version of the seven-gene multi-locus sequence typing (MLST) scheme available in PubMLST; if this is False, BTyper3 will search for the appropriate files in the seq_mlst_db directory; default = False", nargs = "?", default = "False")
 
 
-	else:
+	parser.add_argument("--threads", help = "Optional argument; integer >= 1; total number of threads to use; the typing stages of a genome (ANI, virulence, Bt, MLST, and panC) run concurrently and share these threads, which are also split between worker processes when using --jobs; default = number of CPUs", nargs = "?", default = None)
 
-		panC_final = "(panC group assignment not performed)"
+	parser.add_argument("--blast_output", help = "Optional argument for use with --virulence, --bt, --mlst, and/or --panC True; plain, gzip, or off; how to save the raw blast results of each genome: as plain text files, as gzip-compressed text files, or not at all; default = plain", nargs = "?", default = "plain", choices = ["plain", "gzip", "off"])
 
+	parser.add_argument("--tmpdir", help = "Optional argument; path to a directory where BTyper3 can write temporary files, such as the blast database of each genome (e.g., a local SSD or tmpfs); temporary files are removed when BTyper3 exits; default = the system temporary directory ($TMPDIR or /tmp)", nargs = "?", default = None)
 
+	parser.add_argument("--blastdb_cache", help = "Optional argument; path to a directory where BTyper3 keeps the blast database of each genome, so that genomes with identical sequences are not indexed again in later runs; default = blast databases are not kept", nargs = "?", default = None)
 
-	# print results to a final results file
-	get_final_results = FinalResults(
-		final_results_directory = final_results_directory,
-		infile = infile,
-		prefix = prefix,
-		species = final_species,
-		subspecies = final_subspecies,
-		geneflow = final_geneflow,
-		typestrains = final_typestrains,
-		anthracis = anthracis,
-		emetic = emetic,
-		nhe = nhe,
-		hbl = hbl,
-		cytK = cytK,
-		sph = sph,
-		cap = cap,
-		has = has,
-		bps = bps,
-		bt_final = bt_final,
-		mlst_final = mlst_final,
-		panC_final = panC_final)
+	parser.add_argument("--blastdb_cache_size", help = "Optional argument for use with --blastdb_cache; maximum size of the blast database cache (e.g., 500M, 20G); the least recently used databases are removed when the cache grows larger; default = 10G", nargs = "?", default = "10G")
 
-	get_final_results.print_final_results(final_results_directory, infile, prefix, final_species, final_subspecies, final_geneflow, final_typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final)
+	parser.add_argument("--cache_dir", help = "Optional argument for use with --ani_species, --ani_subspecies, --ani_geneflow, and/or --ani_typestrains True; path to a directory where BTyper3 can store ANI reference indexes so that they are only built once; indexes are rebuilt automatically when the ANI databases change; specify False to disable caching; default = $XDG_CACHE_HOME/btyper3 (usually ~/.cache/btyper3)", nargs = "?", default = None)
 
-	for blastdb_ext in ("nsq", "nin", "nhr", "ndb", "not", "ntf", "nto"):
-		blastdb_file = "{}.{}".format(infile, blastdb_ext)
-		if os.path.isfile(blastdb_file):
-			os.remove(blastdb_file)
+	parser.add_argument("--result_cache", help = "Optional argument; True or False; store the final results of each genome in the cache directory (see --cache_dir), keyed by the sequences of the genome, the checksums of the databases, and the typing options, so that genomes typed again, even under another file name, get their results back without running ANI or blast (their intermediate results are then not written again); identical genomes in one run are only typed once; default = False", nargs = "?", default = "False")
 
-	logging.info("")
-	logging.info("")
-	logging.info("")
-	logging.info("BTyper3 finished at " + now().strftime("%Y-%m-%d %H:%M"))
-	logging.info("Report bugs/concerns to Laura M. Carroll, laura.carroll@embl.de\n")
-	logging.info("Have a nice day!")
+	parser.add_argument("--timings", help = "Optional argument; True or False; record the wall time, CPU time, peak memory, and child process (e.g., blast) resource usage of each typing stage (ANI sketching, indexing and querying, makeblastdb, each blast search, and each parser), and write them as JSON to btyper3_final_results/timings/<prefix>_timings.json for each genome, btyper3_load_timings.json for the loading of the databases, and btyper3_batch_timings.json with a per-stage summary for several input genomes; default = False", nargs = "?", default = "False")
 
+	parser.add_argument("--profile", help = "Optional argument; True or False; record stage timings (see --timings) and profile the Python code of each stage with cProfile, writing one dump per genome and stage to btyper3_final_results/timings/profiles/<prefix>_<stage>.prof (to be read with pstats or snakeviz); default = False", nargs = "?", default = "False")
 
 
 def main():
 
+	# the typing server has its own command line
+	if sys.argv[1:2] == ["serve"]:
+		return serve_main(sys.argv[2:])
+
 	# BTyper3 arguments
 
 	parser = argparse.ArgumentParser(prog = "btyper3", usage = "btyper3 -i </path/to/genome.fasta> -o </path/to/output/directory/> [other options]")
 
-	parser.add_argument("-i", "--input", help = "Path to input genome in fasta format", nargs = 1, required = True)
+	parser.add_argument("-i", "--input", help = "Path to input genome in fasta format; can also be a directory of fasta files, a quoted glob pattern matching fasta files, or a text file listing the paths to fasta files (one per line), in which case all genomes are typed in a single run and written to one aggregated final results file", nargs = 1, required = True)
 
 	parser.add_argument("-o", "--output", help = "Path to desired output directory", nargs = 1, required = True)
 
-	parser.add_argument("--ani_species", help = "Optional argument; True or False; assign genome to a species using FastANI; default = True", nargs = "?", default = "True")
+	parser.add_argument("--output_format", help = "Optional argument; tsv, jsonl, or parquet; format of the final results file: tsv for the tab-separated final results columns, jsonl for one JSON object per genome with typed values (e.g., ANI values, gene counts, and ST as numbers), or parquet for typed columns (requires pyarrow, see pip install btyper3[parquet]); default = tsv", nargs = "?", default = "tsv", choices = ["tsv", "jsonl", "parquet"])
 
-	parser.add_argument("--ani_subspecies", help = "Optional argument; True or False; assign genome to a subspecies, if relevant, using FastANI; default = True", nargs = "?", default = "True")
+	parser.add_argument("--results_file", help = "Optional argument; path to the final results file, or - to stream the results to the standard output (tsv and jsonl only); default = btyper3_final_results/btyper3_final_results.txt (.jsonl or .parquet) in the output directory for several input genomes, or btyper3_final_results/<prefix>_final_results.txt (.jsonl or .parquet) for a single genome, to which the results of later runs are appended in tsv format", nargs = "?", default = None)
 
-	parser.add_argument("--ani_geneflow", help = "Optional argument; True or False; assign genome to a pseudo-gene flow unit using the method described by Carroll, et al. using FastANI; default = False", nargs = "?", default = "False")
+	add_typing_arguments(parser)
 
-	parser.add_argument("--ani_typestrains", help = "Optional argument; True or False; calculate ANI values between the query genome relative to all B. cereus s.l. species type strain genomes using FastANI, and report the closest species type strain/highest ANI value; default = True", nargs = "?", default = "True")
+	parser.add_argument("--jobs", help = "Optional argument for use with several input genomes; integer >= 1; number of genomes to type in parallel worker processes; the databases are loaded once and shared by all workers, and results are written in input order; default = 1", nargs = "?", default = 1)
 
-	parser.add_argument("--virulence", help = "Optional argument; True or False; perform virulence gene detection (required if one wants to assign genomes to biovars Anthracis or Emeticus); default = True", nargs = "?", default = "True")
+	parser.add_argument("--resume", help = "Optional argument for use with several input genomes; True or False; skip the genomes already typed by a previous run into the same output directory with the same BTyper3 version, databases and typing options, as recorded in btyper3_final_results/btyper3_manifest.jsonl, and only type the remaining genomes; the results of all genomes are written to the final results file; default = False", nargs = "?", default = "False")
 
-	parser.add_argument("--bt", help = "Optional argument; True or False; perform Bt toxin gene detection for cry, cyt, and vip genes (required if one wants to assign genomes to biovar Thuringiensis); default = True", nargs = "?", default = "True")
+	parser.add_argument("--version", action="version", version='%(prog)s {}'.format(__version__), help="Print version")
 
-	parser.add_argument("--mlst", help = "Optional argument; True or False; assign genome to a sequence type (ST) using the seven-gene multi-locus sequence typing (MLST) scheme available in PubMLST; default = True", nargs = "?", default = "True")
+	args = parser.parse_args()
 
-	parser.add_argument("--panC", help = "Optional argument; True or False; assign genome to a phylogenetic group (Group I-VIII) using an adjusted, eight-group panC group assignment scheme; default = True", nargs = "?", default = "True")
+	run_pipeline(args)
 
-	parser.add_argument("--virulence_db", help = "Optional argument for use with --virulence True; aa or nuc; database to use for virulence factor detection: aa for the amino acid sequence database, or nuc for the nucleotide sequence database; option aa uses translated nucleotide blast and allows for the detection of more remote homologs, but is slower than nuc, which uses blastn; default = aa", nargs = "?", default = "aa")
 
-	parser.add_argument("--virulence_identity", help = "Optional argument for use with --virulence True; integer from 0 to 100; minimum percent amino acid/nucleotide identity threshold for a virulence gene to be considered present, depending on choice of --virulence_db aa or nuc, respectively; default = 70", nargs = "?", default = 70)
+def serve_main(argv):
 
-	parser.add_argument("--virulence_coverage", help = "Optional argument for use with --virulence True; integer from 0 to 100; minimum percent coverage threshold for a virulence gene to be considered present; default = 80", nargs = "?", default = 80)
+	# BTyper3 typing server arguments
 
-	parser.add_argument("--bt_identity", help = "Optional argument for use with --bt True; integer from 0 to 100; minimum percent amino acid identity threshold for a Bt toxin gene to be considered present; default = 50", nargs = "?", default = 50)
+	parser = argparse.ArgumentParser(prog = "btyper3 serve", usage = "btyper3 serve -o </path/to/output/directory/> [--host <host>] [--port <port>] [--socket </path/to/socket>] [other options]", description = "Keep the BTyper3 databases loaded and type genomes sent over HTTP: POST /type with a JSON body {\"path\": \"/path/to/genome.fasta\"} or with a FASTA body (optionally with ?name=<file name>) returns the final results of the genome as JSON; GET /status returns the state of the job queue")
 
-	parser.add_argument("--bt_coverage", help = "Optional argument for use with --bt True; integer from 0 to 100; minimum percent coverage threshold for a Bt toxin gene to be considered present; default = 70", nargs = "?", default = 70)
+	parser.add_argument("-o", "--output", help = "Path to desired output directory, where the intermediate results and the log of each genome are written; the output files of each request are named after the file name of the genome and a unique request id, returned in the prefix column of the results", nargs = 1, required = True)
 
-	parser.add_argument("--bt_overlap", help = "Optional argument for use with --bt True; float from 0 to 1; specify maximum proportion of overlap for overlapping Bt toxin genes to be considered separate genes; Bt toxin genes below this threshold will be considered separate, while those above it will be considered overlapping, and only the top hit will be reported; default=0.7", nargs = "?", default = 0.7)
+	parser.add_argument("--host", help = "Optional argument; address to listen on; only listen on a public address on a trusted network, since requests are not authenticated; default = 127.0.0.1", nargs = "?", default = "127.0.0.1")
 
-	parser.add_argument("--evalue", help = "Optional argument for use with --virulence True and/or --bt True; float >= 0; maximum blast e-value for a hit to be saved; note that if both --virulence True and --bt True, this e-value threshold will be applied to both analyses; default = 1e-5", nargs = "?", default = 1e-5)
+	parser.add_argument("--port", help = "Optional argument; integer; TCP port to listen on; default = 8765", nargs = "?", default = 8765)
 
-	parser.add_argument("--download_mlst_latest", help = "Optional argument for use with --mlst True; True or False; download the latest version of the seven-gene multi-locus sequence typing (MLST) scheme available in PubMLST; if this is False, BTyper3 will search for the appropriate files in the seq_mlst_db directory; default = False", nargs = "?", default = "False")
+	parser.add_argument("--socket", help = "Optional argument; path to a Unix socket to listen on instead of a TCP port; default = None", nargs = "?", default = None)
 
-	parser.add_argument("--version", action="version", version='%(prog)s {}'.format(__version__), help="Print version")
+	parser.add_argument("--jobs", help = "Optional argument; integer >= 1; number of genomes typed concurrently, in worker threads sharing the loaded databases; default = 1", nargs = "?", default = 1)
 
-	args = parser.parse_args()
+	parser.add_argument("--queue_size", help = "Optional argument; integer >= 1; maximum number of typing requests waiting for a worker; further requests are rejected with HTTP status 503 until the queue drains; default = 16", nargs = "?", default = 16)
+
+	add_typing_arguments(parser)
+
+	args = parser.parse_args(argv)
+
+	run_server(args)
 
-	run_pipeline(args)
 
 if __name__ == "__main__":
 
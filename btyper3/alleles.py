@@ -0,0 +1,84 @@
+import numpy as np
+
+from .outfmt import QUERY_TAG
+from .fasta import Genome, read_fasta
+from .kmers import KMER_LENGTH, blastn_bits, kmer, kmers, reverse_complement
+
+
+class AlleleIndex:
+	"""
+	Find exact, full-length matches of PubMLST alleles in a genome without blast
+
+	The longest alleles of each locus are indexed by sequence on both strands,
+	and anchored by their first k-mer. A genome is scanned once: positions where
+	an anchor occurs are looked up in the sequence index. Only a full-length
+	match of one of the longest alleles of a locus is guaranteed to be the best
+	blastn hit of the locus, so loci without such a match are left to blastn.
+
+	find_alleles
+	purpose: find the exact allele matches of a genome
+	input:
+		fasta = path to the genome in FASTA format, or Genome returned by read_fasta
+	output:
+		dictionary mapping each locus with an exact match to its hits, formatted as tagged blast output lines (see Blast.split_blast)
+
+	write_alleles
+	purpose: write the alleles of some loci to a FASTA file, to search them with blastn
+	input:
+		loci = loci to write
+		fasta = path to the output FASTA file
+
+	"""
+
+	def __init__(self, alleles):
+
+		self.alleles = dict(read_fasta(alleles))
+
+		self.loci = {}
+		for allele in self.alleles:
+			self.loci.setdefault(self.locus(allele), []).append(allele)
+
+		# index the longest alleles of each locus on both strands
+		self.sequences = {}
+		self.anchors = {}
+		for alleles in self.loci.values():
+			length = max(len(self.alleles[allele]) for allele in alleles)
+			for allele in alleles:
+				seq = self.alleles[allele]
+				if len(seq) != length or len(seq) < KMER_LENGTH or seq.strip(b"ACGT"):
+					continue
+				for strand, strand_seq in (("plus", seq), ("minus", reverse_complement(seq))):
+					self.sequences.setdefault(strand_seq, []).append((allele, strand))
+					self.anchors.setdefault(kmer(strand_seq), set()).add(length)
+		self.anchor_array = np.array(sorted(self.anchors), dtype = np.uint32)
+
+	@staticmethod
+	def locus(allele):
+		return allele.split("_")[0]
+
+	def find_alleles(self, fasta):
+
+		genome = fasta if isinstance(fasta, Genome) else read_fasta(fasta)
+		hits = {}
+		for contig, seq in genome:
+			contig_kmers = kmers(seq)
+			for pos in np.flatnonzero(np.isin(contig_kmers, self.anchor_array)).tolist():
+				for length in self.anchors[int(contig_kmers[pos])]:
+					for allele, strand in self.sequences.get(seq[pos:pos + length], ()):
+						if strand == "plus":
+							sstart, send = pos + 1, pos + length
+						else:
+							sstart, send = pos + length, pos + 1
+						hits.setdefault(self.locus(allele), []).append("\t".join([
+							"mlst" + QUERY_TAG + allele, contig, "100.000", str(length), "0", "0",
+							"1", str(length), str(sstart), str(send), "0.0", str(round(blastn_bits(length))),
+							str(length), str(len(seq)), "100", "100",
+						]) + "\n")
+		return hits
+
+	def write_alleles(self, loci, fasta):
+
+		with open(fasta, "w") as outfile:
+			for locus in loci:
+				for allele in self.loci[locus]:
+					outfile.write(">" + allele + "\n" + self.alleles[allele].decode("ascii") + "\n")
@@ -1,23 +1,516 @@
 import csv
 import io
 import os
-import gzip
 import contextlib
+import hashlib
 import importlib.resources
 import itertools
+import logging
+import shutil
 import subprocess
 import tempfile
+import threading
 import warnings
 
-import Bio.SeqIO
 import pandas
 import pyfastani
 from pandas.errors import EmptyDataError
 
+from .cache import Cache
+from .fasta import read_fasta
+from .kmers import mash_distance, minhash
+from .pack import PACK_NAME, ReferencePack, file_sha256
+from .timings import timed
+
+logger = logging.getLogger(__name__)
+
+# parameters of the MinHash sketches used to pre-screen the reference genomes
+SKETCH_K = 21
+SKETCH_SIZE = 1000
+
+# version of the MinHash sketches, part of the key of cached sketches so that
+# sketches computed by earlier versions are not reused
+SKETCH_VERSION = 2
+
+class AniIndex:
+	"""
+	Combined PyFastANI index over the reference genomes of one or more ANI databases
+
+	input:
+		taxa = list of "species", "subspecies", "geneflow", and/or "typestrains"; corresponds to directories of genomes to index
+		cache_dir = directory used to cache the built index between runs (None to disable caching)
+		prescreen = number of reference genomes of each taxon shortlisted with MinHash for each query, or 0 to map queries against all reference genomes
+		timer = StageTimer recording the sketching and indexing of the references (see timings.StageTimer; optional)
+
+	attributes:
+		databases = dictionary mapping each taxon to its table of reference genomes
+		packs = dictionary mapping each database package to its packed reference file (see pack.ReferencePack), if it was built
+		mapper = pyfastani.Mapper indexing the deduplicated union of the reference genomes of all taxa (None when pre-screening)
+		sketches = dictionary mapping each reference genome to its MinHash sketch (when pre-screening)
+
+	build_mapper
+	purpose: index the reference genomes of all taxa, reusing a previously cached index if the databases are unchanged
+	input:
+		genome_ids = reference genomes to index (all reference genomes by default)
+		timer = StageTimer recording the sketching and indexing (optional)
+	output:
+		pyfastani.Mapper indexing the reference genomes; genomes shared by several databases are only indexed once
+
+	build_sketches
+	purpose: compute the MinHash sketches of the reference genomes of all taxa, reusing previously cached sketches if the databases are unchanged
+	output:
+		dictionary mapping each reference genome to its MinHash sketch
+
+	shortlist
+	purpose: rank the reference genomes of each taxon by Mash distance to a query genome, and get the mapper of the closest ones
+	input:
+		genome = Genome of the query (see fasta.read_fasta)
+		timer = StageTimer recording the pre-screening, and the indexing of the closest references (optional)
+	output:
+		pyfastani.Mapper indexing the prescreen closest reference genomes of each taxon
+
+	close
+	purpose: release the packed reference files
+
+	"""
+
+	# number of shortlist mappers kept in memory, reused by queries with the
+	# same closest reference genomes
+	max_shortlists = 8
+
+	# package holding one data module with the TSV and the reference genomes
+	# of each ANI database
+	data_package = "btyper3.seq_ani_db"
+
+	def __init__(self, taxa, cache_dir = None, prescreen = 0, timer = None):
+		self.taxa = list(taxa)
+		self.cache_dir = cache_dir
+		self.prescreen = int(prescreen)
+
+		# get the ANI databases using `importlib.resources`: note that since
+		# files may not be available on the local filesystem (e.g. they could
+		# be zipped), we use `importlib.resources.open_binary` to read each
+		# of them.
+		self.tsvs = {}
+		self.databases = {}
+		for taxon in self.taxa:
+			data_module = "{}.{}".format(self.data_package, taxon)
+			self.tsvs[taxon] = importlib.resources.read_binary(data_module, "{}.tsv".format(taxon))
+			self.databases[taxon] = pandas.read_table(io.BytesIO(self.tsvs[taxon]), comment="#")
+
+		# reference genomes are identified by their file name, so genomes
+		# used by several databases are only read from the first one
+		self.references = {}
+		for taxon in self.taxa:
+			for genome_id in self.databases[taxon]["id"]:
+				self.references.setdefault(genome_id, "{}.{}".format(self.data_package, taxon))
+
+		# open the packed reference file of each database, built by `setup.py`
+		# from the downloaded genomes; genomes missing from the pack (e.g., in
+		# a development checkout) are read from their FASTA file instead
+		self._resources = contextlib.ExitStack()
+		self.packs = {}
+		for data_module in set(self.references.values()):
+			if importlib.resources.is_resource(data_module, PACK_NAME):
+				path = self._resources.enter_context(importlib.resources.path(data_module, PACK_NAME))
+				self.packs[data_module] = self._resources.enter_context(ReferencePack(path))
+
+		# index the references, or load the index from the cache; when
+		# pre-screening, only the sketches of the references are loaded, and
+		# each query is mapped against a small index of its closest references
+		self.mapper = None
+		self.sketches = None
+		self.shortlists = {}
+		self.shortlists_lock = threading.Lock()
+		if self.prescreen > 0:
+			with timed(timer, "ani_minhash_sketch", references = len(self.references)):
+				self.sketches = self.build_sketches()
+		else:
+			self.mapper = self.build_mapper(timer = timer)
+
+	def cache_key(self, *params):
+		# cached data are only valid for identical parameters, database
+		# contents and reference genomes
+		parts = list(params)
+		for taxon in sorted(self.taxa):
+			parts.extend([taxon, self.tsvs[taxon]])
+		for genome_id, data_module in self.references.items():
+			# packs store the SHA-256 of the original genome files, so keys do
+			# not change when the references are packed
+			pack = self.packs.get(data_module)
+			if pack is not None and genome_id in pack:
+				digest = bytes.fromhex(pack.sha256(genome_id))
+			else:
+				with importlib.resources.open_binary(data_module, genome_id) as handle:
+					h = hashlib.sha256()
+					for block in iter(lambda: handle.read(1 << 20), b""):
+						h.update(block)
+				digest = h.digest()
+			parts.extend([genome_id, digest])
+		return Cache.digest(*parts)
+
+	def read_reference(self, genome_id):
+		data_module = self.references[genome_id]
+		pack = self.packs.get(data_module)
+		if pack is not None and genome_id in pack:
+			return pack.read(genome_id)
+		with importlib.resources.open_binary(data_module, genome_id) as handle:
+			return read_fasta(handle)
+
+	def close(self):
+		self.packs = {}
+		self._resources.close()
+
+	def build_mapper(self, genome_ids = None, timer = None):
+		# create the FastANI sketch
+		sketch = pyfastani.Sketch()
+
+		# only the index of all references is cached
+		cache = None
+		if self.cache_dir is not None and genome_ids is None:
+			cache = Cache(self.cache_dir)
+			name = "_".join(sorted(self.taxa))
+			key = self.cache_key(
+				pyfastani.__version__,
+				repr((sketch.k, sketch.fragment_length, sketch.minimum_fraction, sketch.p_value, sketch.percentage_identity, sketch.window_size)),
+			)
+			with timed(timer, "ani_index_cache_load"):
+				mapper = cache.load("ani", name, key)
+			if mapper is not None:
+				logger.info("Using cached ANI index for " + ", ".join(self.taxa) + " database(s)")
+				return mapper
+
+		# extract the reference genomes
+		genome_ids = list(self.references if genome_ids is None else genome_ids)
+		with timed(timer, "ani_sketch", references = len(genome_ids)):
+			for genome_id in genome_ids:
+				sketch.add_draft(genome_id, self.read_reference(genome_id).views())
+
+		# index the references
+		with timed(timer, "ani_index", references = len(genome_ids)):
+			mapper = sketch.index()
+
+		if cache is not None:
+			cache.dump(mapper, "ani", name, key)
+
+		return mapper
+
+	def build_sketches(self):
+		if self.cache_dir is not None:
+			cache = Cache(self.cache_dir)
+			name = "_".join(sorted(self.taxa))
+			key = self.cache_key("minhash", repr((SKETCH_VERSION, SKETCH_K, SKETCH_SIZE)))
+			sketches = cache.load("minhash", name, key)
+			if sketches is not None:
+				logger.info("Using cached MinHash sketches for " + ", ".join(self.taxa) + " database(s)")
+				return sketches
+
+		sketches = {
+			genome_id: minhash(self.read_reference(genome_id).sequences, SKETCH_SIZE, SKETCH_K)
+			for genome_id in self.references
+		}
+
+		if self.cache_dir is not None:
+			cache.dump(sketches, "minhash", name, key)
+
+		return sketches
+
+	def shortlist(self, genome, timer = None):
+		with timed(timer, "ani_prescreen"):
+			query = minhash(genome.sequences, SKETCH_SIZE, SKETCH_K)
+			distances = {
+				genome_id: mash_distance(query, sketch, SKETCH_SIZE, SKETCH_K)
+				for genome_id, sketch in self.sketches.items()
+			}
+
+		# keep the closest references of each taxon, so that the thresholds
+		# of every database are still applied to its own best hits
+		genome_ids = set()
+		for taxon in self.taxa:
+			ranked = sorted(self.databases[taxon]["id"], key = lambda genome_id: (distances[genome_id], genome_id))
+			genome_ids.update(ranked[:self.prescreen])
+		genome_ids = tuple(sorted(genome_ids))
+
+		# the shortlist mappers are shared by the worker threads of the typing
+		# server; a mapper is built once, by the first query that needs it
+		with self.shortlists_lock:
+			mapper = self.shortlists.pop(genome_ids, None)
+			if mapper is None:
+				mapper = self.build_mapper(genome_ids, timer)
+				if len(self.shortlists) >= self.max_shortlists:
+					self.shortlists.pop(next(iter(self.shortlists)))
+			self.shortlists[genome_ids] = mapper
+		return mapper
+
+
+class AniShards:
+	"""
+	Sharded PyFastANI index over a user-supplied ANI database
+
+	The reference genomes are split into shards whose index fits in a memory
+	budget, and each shard is stored on disk once indexed. Shards are written
+	to the scratch directory of the run instead when they can't be written to
+	the cache directory (e.g., a read-only or full disk). When there is a
+	single shard, or the indexes of all shards fit in the memory budget
+	together, they are kept in memory and reused by every query; otherwise, queries are
+	mapped against one shard at a time, so that only one shard is loaded in
+	memory, and every shard is loaded from disk again for each query genome.
+	Shards are reused between runs as long as the database TSV and the
+	content (SHA-256) of the reference genome files are unchanged.
+
+	When pre-screening, no shards are built: the MinHash sketches of the
+	reference genomes are stored instead, and each query is mapped against a
+	small index of its closest references (see shortlist).
+
+	input:
+		database = TSV file with one reference genome per row, in the same format as the built-in ANI databases: an "id" column with the path to the genome FASTA file (optionally gzipped, relative to the TSV file), a "threshold" column with the ANI threshold of the reference, and an optional "name" column with the name reported for the reference
+		max_memory = approximate maximum memory used by the index of a shard, in bytes
+		directory = directory where the shards are stored (e.g., the BTyper3 cache directory)
+		prescreen = number of reference genomes shortlisted with MinHash for each query, or 0 to map queries against all reference genomes
+		scratch = directory where the shards are stored if they can't be written to directory (e.g., the scratch directory of the run), or None to raise the error
+
+	build_shards
+	purpose: index the reference genomes into shards, reusing previously built shards if the database is unchanged
+	output:
+		list of the reference genomes of each shard
+
+	build_sketches
+	purpose: compute the MinHash sketches of the reference genomes, reusing previously stored sketches if the database is unchanged
+	output:
+		dictionary mapping each reference genome to its MinHash sketch
+
+	shortlist
+	purpose: rank the reference genomes by Mash distance to a query genome, and get the mapper of the closest ones
+	input:
+		genome = Genome of the query (see fasta.read_fasta)
+		timer = StageTimer recording the pre-screening, and the indexing of the closest references (optional)
+	output:
+		pyfastani.Mapper indexing the prescreen closest reference genomes
+
+	query
+	purpose: map a query genome against every shard
+	input:
+		sequences = sequences of the query genome
+		threads = number of threads used by PyFastANI (0 to use all CPUs)
+	output:
+		list of the PyFastANI hits of the query against all shards
+
+	"""
+
+	# estimated peak memory used to index one base of a reference genome
+	bytes_per_base = 10
+
+	# number of shortlist mappers kept in memory (see AniIndex)
+	max_shortlists = 8
+
+	def __init__(self, database, max_memory, directory, prescreen = 0, scratch = None):
+		self.database_path = os.path.abspath(database)
+		self.max_memory = max_memory
+		self.directory = directory
+		self.prescreen = int(prescreen)
+		self.scratch = scratch
+
+		with open(self.database_path, "rb") as handle:
+			self.tsv = handle.read()
+		self.database = pandas.read_table(io.BytesIO(self.tsv), comment="#")
+		for column in ("id", "threshold"):
+			if column not in self.database.columns:
+				raise ValueError("ANI database {!r} has no {!r} column".format(database, column))
+		self.database["id"] = self.database["id"].astype(str)
+
+		root = os.path.dirname(self.database_path)
+		self.paths = {genome_id: os.path.join(root, genome_id) for genome_id in self.database["id"]}
+
+		self.cache = Cache(directory)
+		# cache the shards are stored in (see store_shard)
+		self.store = self.cache
+		base = os.path.splitext(os.path.basename(self.database_path))[0]
+		self.name = "{}_{}".format("".join(c if c.isalnum() or c in "-." else "_" for c in base), Cache.digest(self.database_path)[:12])
+		sketch = pyfastani.Sketch()
+		self.fragment_length = sketch.fragment_length
+
+		# the database is identified by its TSV and the SHA-256 of its
+		# reference genome files, and shards are only valid for the same
+		# database, sketch parameters and memory budget
+		parts = [self.tsv]
+		for genome_id, checksum in self.checksums().items():
+			parts.extend([genome_id, checksum])
+		self.digest = Cache.digest(*parts)
+		self.key = Cache.digest(
+			pyfastani.__version__,
+			repr((sketch.k, sketch.fragment_length, sketch.minimum_fraction, sketch.p_value, sketch.percentage_identity, sketch.window_size)),
+			str(self.max_memory),
+			self.digest,
+		)
+
+		self.mappers = None
+		self.sketches = None
+		self.shortlists = {}
+		self.shortlists_lock = threading.Lock()
+		self.shards = []
+		if self.prescreen > 0:
+			self.sketches = self.build_sketches()
+			return
+
+		self.shards = self.build_shards()
+
+		# the shards are kept in memory rather than reloaded for each query
+		# when there is only one, or their indexes fit in the memory budget
+		# together
+		if self.mappers is None:
+			size = sum(os.path.getsize(self.store.path("custom", self.shard_name(i), self.key)) for i in range(len(self.shards)))
+			if len(self.shards) == 1 or size <= self.max_memory:
+				self.mappers = [self.load_shard(i) for i in range(len(self.shards))]
+
+	def checksums(self):
+		# checksums are stored in the cache directory, and only computed again
+		# for files whose size, modification time or status change time
+		# changed; unlike the modification time, the status change time can't
+		# be restored (e.g., by tar or rsync -t)
+		key = Cache.digest("sha256")
+		stored = self.cache.load("custom", self.name + "_checksums", key) or {}
+		checksums = {}
+		updated = {}
+		for genome_id, path in self.paths.items():
+			stat = os.stat(path)
+			state = (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+			entry = stored.get(path)
+			if entry is None or entry[0] != state:
+				entry = (state, file_sha256(path))
+			updated[path] = entry
+			checksums[genome_id] = entry[1]
+		if updated != stored:
+			self.cache.dump(updated, "custom", self.name + "_checksums", key)
+		return checksums
+
+	def shard_name(self, i):
+		return "{}_{}".format(self.name, i)
+
+	def load_shard(self, i):
+		mapper = self.store.load("custom", self.shard_name(i), self.key)
+		if mapper is None:
+			raise RuntimeError("Could not load shard {} of ANI database {!r} from {!r}".format(i, self.database_path, self.store.cache_dir))
+		return mapper
+
+	def store_shard(self, mapper, i):
+		# shards are only stored on disk, so failing to write one is an error,
+		# unless it can be written to the scratch directory instead
+		try:
+			self.store.dump(mapper, "custom", self.shard_name(i), self.key, required=True)
+			return
+		except Exception as err:
+			if self.scratch is None or self.store is not self.cache or os.path.abspath(self.scratch) == os.path.abspath(self.directory):
+				raise
+			logger.warning("Warning: could not write shard {} of ANI database {} to {} ({}), storing its shards in {} for this run".format(i, self.database_path, self.directory, err, self.scratch))
+
+		self.store = Cache(self.scratch)
+		os.makedirs(os.path.join(self.scratch, "custom"), exist_ok=True)
+		for j in range(i):
+			shutil.copyfile(self.cache.path("custom", self.shard_name(j), self.key), self.store.path("custom", self.shard_name(j), self.key))
+		self.store.dump(mapper, "custom", self.shard_name(i), self.key, required=True)
+
+	def build_shards(self):
+		shards = self.cache.load("custom", self.name, self.key)
+		if shards is not None and all(os.path.exists(self.cache.path("custom", self.shard_name(i), self.key)) for i in range(len(shards))):
+			logger.info("Using " + str(len(shards)) + " cached shard(s) of ANI database " + self.database_path)
+			return shards
+
+		logger.info("Indexing ANI database " + self.database_path)
+		shards = []
+		sketch = None
+		genome_ids = []
+		bases = 0
+		for genome_id in self.paths:
+			genome = read_fasta(self.paths[genome_id])
+			length = sum(genome.lengths())
+			# start a new shard when the genome would not fit in the current one
+			if genome_ids and (bases + length) * self.bytes_per_base > self.max_memory:
+				self.store_shard(sketch.index(), len(shards))
+				shards.append(genome_ids)
+				sketch, genome_ids, bases = None, [], 0
+			if sketch is None:
+				sketch = pyfastani.Sketch()
+			sketch.add_draft(genome_id, genome.views())
+			genome_ids.append(genome_id)
+			bases += length
+		if genome_ids:
+			mapper = sketch.index()
+			self.store_shard(mapper, len(shards))
+			# a single shard is used as built rather than loaded back
+			if not shards:
+				self.mappers = [mapper]
+			shards.append(genome_ids)
+		del sketch
+
+		self.store.dump(shards, "custom", self.name, self.key)
+		logger.info("Indexed ANI database " + self.database_path + " in " + str(len(shards)) + " shard(s)")
+
+		# remove the shards of previous versions of the database
+		directory = os.path.join(self.store.cache_dir, "custom")
+		current = {os.path.basename(self.store.path("custom", self.shard_name(i), self.key)) for i in range(len(shards))}
+		for entry in os.listdir(directory):
+			shard = entry.startswith(self.name + "_") and entry[len(self.name) + 1:].split("-")[0].isdigit()
+			if shard and entry.endswith(".pkl") and entry not in current:
+				with contextlib.suppress(OSError):
+					os.remove(os.path.join(directory, entry))
+
+		return shards
+
+	def build_sketches(self):
+		key = Cache.digest(self.key, "minhash", repr((SKETCH_VERSION, SKETCH_K, SKETCH_SIZE)))
+		sketches = self.cache.load("custom_minhash", self.name, key)
+		if sketches is not None:
+			logger.info("Using cached MinHash sketches of ANI database " + self.database_path)
+			return sketches
+
+		logger.info("Sketching ANI database " + self.database_path)
+		sketches = {
+			genome_id: minhash(read_fasta(path).sequences, SKETCH_SIZE, SKETCH_K)
+			for genome_id, path in self.paths.items()
+		}
+		self.cache.dump(sketches, "custom_minhash", self.name, key)
+		return sketches
+
+	def shortlist(self, genome, timer = None):
+		with timed(timer, "custom_ani_prescreen"):
+			query = minhash(genome.sequences, SKETCH_SIZE, SKETCH_K)
+			ranked = sorted(self.sketches, key = lambda genome_id: (mash_distance(query, self.sketches[genome_id], SKETCH_SIZE, SKETCH_K), genome_id))
+			genome_ids = tuple(sorted(ranked[:self.prescreen]))
+
+		# shared by the worker threads of the typing server (see AniIndex.shortlist)
+		with self.shortlists_lock:
+			mapper = self.shortlists.pop(genome_ids, None)
+			if mapper is None:
+				sketch = pyfastani.Sketch()
+				with timed(timer, "custom_ani_sketch", references = len(genome_ids)):
+					for genome_id in genome_ids:
+						sketch.add_draft(genome_id, read_fasta(self.paths[genome_id]).views())
+				with timed(timer, "custom_ani_index", references = len(genome_ids)):
+					mapper = sketch.index()
+				if len(self.shortlists) >= self.max_shortlists:
+					self.shortlists.pop(next(iter(self.shortlists)))
+			self.shortlists[genome_ids] = mapper
+		return mapper
+
+	def query(self, sequences, threads = 0):
+		if self.mappers is not None:
+			return [hit for mapper in self.mappers for hit in mapper.query_draft(sequences, threads=threads)]
+		hits = []
+		for i in range(len(self.shards)):
+			mapper = self.load_shard(i)
+			hits.extend(mapper.query_draft(sequences, threads=threads))
+			del mapper
+		return hits
+
+
 class Ani:
 	"""
 	Use ANI to assign genome to genospecies and/or subspecies
 
+	The mapping of the query genome and the assignments of query_fastani and
+	query_custom are recorded with the StageTimer given as timer, if any (see
+	timings.StageTimer).
+
 	run_fastani
 	purpose: runs fastANI for species/subspecies assignment and selects match with highest ANI
 	input:
@@ -28,47 +521,123 @@ class Ani:
 	output:
 		species or subspecies producing highest ANI value
 
+	query_fastani
+	purpose: runs fastANI once against the combined index of several taxa and assigns the query genome for each of them
+	input:
+		taxa = list of "species", "subspecies", "geneflow", and/or "typestrains"
+		fasta = query genome for fastANI
+		final_results_directory = path to BTyper3 final results directory, or None to not write the raw FastANI results
+		prefix = genome prefix to use for output files
+		genome = query genome already loaded with fasta.read_fasta (optional; read from fasta otherwise)
+	output:
+		dictionary mapping each taxon to the assignment produced by run_fastani
+
+	query_custom
+	purpose: runs fastANI against a user-supplied ANI database and selects the match with highest ANI
+	input:
+		shards = AniShards indexing the database
+		fasta = query genome for fastANI
+		final_results_directory = path to BTyper3 final results directory, or None to not write the raw FastANI results
+		prefix = genome prefix to use for output files
+		genome = query genome already loaded with fasta.read_fasta (optional; read from fasta otherwise)
+	output:
+		name of the reference producing the highest ANI value, followed by a * if the ANI value is below the threshold of the reference
+
+	assign
+	purpose: selects the match with highest ANI among the hits against the reference genomes of a taxon
+	input:
+		taxon = "species", "subspecies", "geneflow", "typestrains", or "custom"
+		results = table of hits against the reference genomes of the taxon, joined with the taxon database
+	output:
+		assignment string for the taxon
+
 	"""
 
-	def __init__(self, taxon, fasta, final_results_directory, prefix):
+	def __init__(self, taxon, fasta, final_results_directory, prefix, cache_dir = None, index = None, threads = 0, prescreen = 0, timer = None):
 		self.taxon = taxon
 		self.fasta = fasta
 		self.final_results_directory = final_results_directory
 		self.prefix = prefix
+		self.cache_dir = cache_dir
+		self.index = index
+		self.threads = threads
+		self.prescreen = prescreen
+		self.timer = timer
 
 	def run_fastani(self, taxon, fasta, final_results_directory, prefix):
-		# create output folder if it doesn't exist
-		ani_results_dir = os.path.join(final_results_directory, taxon)
-		os.makedirs(ani_results_dir, exist_ok=True)
+		return self.query_fastani([taxon], fasta, final_results_directory, prefix)[taxon]
 
-		# create the FastANI sketch
-		sketch = pyfastani.Sketch()
+	def query_fastani(self, taxa, fasta, final_results_directory, prefix, genome = None):
+		# use the shared index if one was given, and build one otherwise
+		index = self.index
+		if index is None or any(taxon not in index.databases for taxon in taxa):
+			index = AniIndex(taxa, cache_dir = self.cache_dir, prescreen = self.prescreen)
 
-		# get the ANI database using `importlib.resources`: note that since
-		# files may not be available on the local filesystem (e.g. they could
-		# be zipped), we use `importlib.resources.path` to get a system path
-		# for each of them than can be passed to `fastANI`.
-		data_module = "btyper3.seq_ani_db.{}".format(taxon)
-		with importlib.resources.open_text(data_module, "{}.tsv".format(taxon)) as f:
-			database = pandas.read_table(f, comment="#")
-		# extract all the reference genomes
-		for genome_id in database["id"]:
-			with importlib.resources.open_binary(data_module, genome_id) as handle:
-				reader = io.TextIOWrapper(gzip.GzipFile(fileobj=handle, mode="rb"))
-				records = Bio.SeqIO.parse(reader, "fasta")
-				sketch.add_draft(genome_id, (str(record.seq) for record in records))
+		# query mapper with the input file, unless it was already loaded
+		try:
+			if genome is None:
+				genome = read_fasta(fasta)
+			mapper = index.mapper
+			if mapper is None:
+				mapper = index.shortlist(genome, self.timer)
+			self.check_fragmentation(genome.sequences, mapper.fragment_length)
+			with timed(self.timer, "ani_query", threads = self.threads):
+				hits = mapper.query_draft(genome.views(), threads=self.threads)
+		finally:
+			# release the packed references of an index built for this query
+			# only; its database tables are still used for the assignments
+			if index is not self.index:
+				index.close()
 
-		# index the references
-		mapper = sketch.index()
+		# make a table from the hits
+		hits = pandas.DataFrame(
+			data=[
+				[fasta, hit.name, hit.identity, hit.matches, hit.fragments]
+				for hit in hits
+			],
+			columns=[
+				"query",
+				"hit",
+				"ani",
+				"matches",
+				"fragments",
+			],
+		)
 
-		# query mapper with the input file
-		with open(fasta) as handle:
-			records = Bio.SeqIO.parse(handle, "fasta")
-			sequences = [str(record.seq) for record in records]
-			self.check_fragmentation(sequences, mapper.fragment_length)
-			hits = mapper.query_draft(sequences)
+		# split the hits back to the database of each taxon
+		with timed(self.timer, "ani_assign", taxa = len(taxa)):
+			final = {}
+			for taxon in taxa:
+				database = index.databases[taxon]
+				results = hits[hits["hit"].isin(database["id"])]
 
-		# make a table from the hits
+				# write raw FastANI results, unless file outputs are disabled
+				if final_results_directory is not None:
+					ani_results_dir = os.path.join(final_results_directory, taxon)
+					os.makedirs(ani_results_dir, exist_ok=True)
+					result_file = os.path.join(ani_results_dir, "{}_{}_fastani.txt".format(prefix, taxon))
+					results.to_csv(result_file, index=False, header=False, sep="\t")
+
+				# left join with database to get associated metadata for each hit
+				results = pandas.merge( results, database, how="left", left_on="hit", right_on="id")
+				final[taxon] = self.assign(taxon, results)
+
+		return final
+
+	def query_custom(self, shards, fasta, final_results_directory, prefix, genome = None):
+		# query every shard with the input file, unless it was already loaded
+		if genome is None:
+			genome = read_fasta(fasta)
+		self.check_fragmentation(genome.sequences, shards.fragment_length)
+		if shards.sketches is not None:
+			mapper = shards.shortlist(genome, self.timer)
+			with timed(self.timer, "custom_ani_query", threads = self.threads):
+				hits = mapper.query_draft(genome.views(), threads=self.threads)
+		else:
+			with timed(self.timer, "custom_ani_query", shards = len(shards.shards), threads = self.threads):
+				hits = shards.query(genome.views(), threads=self.threads)
+
+		# make a table from the hits of all shards
 		results = pandas.DataFrame(
 			data=[
 				[fasta, hit.name, hit.identity, hit.matches, hit.fragments]
@@ -83,13 +652,19 @@ class Ani:
 			],
 		)
 
-		# write raw FastANI results
-		result_file = os.path.join(ani_results_dir, "{}_{}_fastani.txt".format(prefix, taxon))
-		results.to_csv(result_file, index=False, header=False, sep="\t")
+		# write raw FastANI results, unless file outputs are disabled
+		if final_results_directory is not None:
+			ani_results_dir = os.path.join(final_results_directory, "custom")
+			os.makedirs(ani_results_dir, exist_ok=True)
+			result_file = os.path.join(ani_results_dir, "{}_custom_fastani.txt".format(prefix))
+			results.to_csv(result_file, index=False, header=False, sep="\t")
 
 		# left join with database to get associated metadata for each hit
-		results = pandas.merge( results, database, how="left", left_on="hit", right_on="id")
+		with timed(self.timer, "custom_ani_assign"):
+			results = pandas.merge(results, shards.database, how="left", left_on="hit", right_on="id")
+			return self.assign("custom", results)
 
+	def assign(self, taxon, results):
 		if not results.empty:
 			# sort values by decreasing ANI and get best hit
 			results.sort_values("ani", ascending = False, inplace = True)
@@ -121,6 +696,13 @@ class Ani:
 			elif taxon == "typestrains":
 				return f"{best.typestrain}({best.ani})"
 
+			elif taxon == "custom":
+				name = best["name"] if "name" in results.columns else best["id"]
+				if best.ani < best.threshold:
+					return f"{name}*({best.ani})"
+				else:
+					return f"{name}({best.ani})"
+
 		else:
 			if taxon == "species":
 				return "(Species unknown)"
@@ -130,6 +712,8 @@ class Ani:
 				return "(Pseudo-gene flow unit unknown)"
 			elif taxon == "typestrains":
 				return "(Type strain unknown)"
+			elif taxon == "custom":
+				return "(Custom database match unknown)"
 
 	def check_fragmentation(self, sequences, fragment_length):
 		length_total = 0
@@ -1,8 +1,13 @@
+import gzip
+import logging
 import os
 import subprocess
 
-import pandas as pd
-from pandas.errors import EmptyDataError
+from .outfmt import COLUMN_TYPES, OUTFMT, QUERY_TAG
+
+logger = logging.getLogger(__name__)
+
+# pandas is only imported when blast results are parsed
 
 class Blast:
 	"""
@@ -23,9 +28,63 @@ class Blast:
 		overlap = maximum proportion of overlap for overlapping blast hits to be considered separate (hits overlapping below this threshold will be considered separate hits)
 		evalue = maximum blast e-value for blast hits
 
+		threads = number of threads used by the blast task (-num_threads)
+		blastdb = path of the blast database built from dbseqs (defaults to dbseqs, i.e. next to the fasta file)
+
 	output:
 		path to blast output file of results
 
+	make_blast_db
+	purpose:
+		build the blast nucleotide database of a genome, if it doesn't exist yet
+	input:
+		dbseqs = blast database fasta file
+		blastdb = path of the blast database to build (defaults to dbseqs)
+
+	merge_queries
+	purpose:
+		concatenate the query fasta files of several BTyper3 tasks, so that they can be searched with a single blast call
+	input:
+		queries = list of (suffix, fasta) pairs, where suffix is the BTyper3 task of the queries in fasta (e.g., bt, virulence)
+		merged = path to the merged fasta file to write; the id of each query is tagged with its suffix
+
+	stream_blast
+	purpose:
+		blast a query against a reference without writing the results to a file
+	input:
+		same as run_blast, without final_results_directory, prefix and suffix
+	output:
+		iterator over the lines of blast output, read from the blast process as they are produced
+
+	split_blast
+	purpose:
+		split the results of a search with merged queries between the BTyper3 tasks
+	input:
+		blast_results = lines of blast output of the merged search (e.g., from stream_blast)
+		final_results_directory = BTyper3 final results directory, or None to not save the raw blast results
+		prefix = genome prefix for output files
+		suffixes = suffixes of the merged BTyper3 tasks
+		output = how to save the raw blast results of each task: "plain" text file, "gzip" compressed text file, or "off"
+	output:
+		dictionary mapping each suffix to a table of its blast results, with the original query ids
+
+	best_hits
+	purpose:
+		select the best hit of each query with a single grouped pass over the blast results
+	input:
+		blast_results_file = table of blast results (see read_blast)
+		genes = optional labels grouping the queries (e.g., MLST locus of each allele); defaults to the query ids
+	output:
+		table with the hit with the highest bitscore for each query or group, sorted by query or group
+
+	read_blast
+	purpose:
+		load blast results for the parse_* methods
+	input:
+		blastfile = path to a blast output file (plain or gzip compressed), or a table of blast results from split_blast
+	output:
+		table of blast results, with one column per field of the blast output; raises EmptyDataError if there are no results
+
 	parse_virulence
 	purpose:
 		assign query genome to virulence-associated biovars, using blast results from run_blast
@@ -57,7 +116,7 @@ class Blast:
 		list of top hits for each allele
 	"""
 
-	def __init__(self, task, dbseqs, fasta, final_results_directory, prefix, suffix, pthresh, qthresh, overlap, evalue):
+	def __init__(self, task, dbseqs, fasta, final_results_directory, prefix, suffix, pthresh, qthresh, overlap, evalue, threads = 1, blastdb = None):
 
 		self.task = task
 		self.dbseqs = dbseqs
@@ -69,6 +128,8 @@ class Blast:
 		self.qthresh = qthresh
 		self.overlap = overlap
 		self.evalue = evalue
+		self.threads = threads
+		self.blastdb = blastdb if blastdb is not None else dbseqs
 
 	def run_blast(self, task, dbseqs, fasta, final_results_directory, prefix, suffix, evalue):
 		# create output folder if it doesn't exist
@@ -76,33 +137,132 @@ class Blast:
 		os.makedirs(blast_results_dir, exist_ok=True)
 
 		# build a BLAST database if it doesn't exist yet
-		if not os.path.exists(dbseqs + ".nsq"):
-			proc = subprocess.run(["makeblastdb", "-in", dbseqs, "-dbtype", "nucl"])
-			proc.check_returncode()
+		self.make_blast_db(dbseqs, self.blastdb)
 
 		# run the BLAST task
 		blast_results = os.path.join(blast_results_dir, "{}_{}.txt".format(prefix, suffix))
 		proc = subprocess.run([
 			task,
 			"-query", fasta,
-			"-db", dbseqs,
+			"-db", self.blastdb,
 			"-out", blast_results,
 			"-max_target_seqs", "1000000000",
 			"-evalue", evalue,
-			"-outfmt", "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen qcovs qcovhsp",
-		])
+			"-num_threads", str(self.threads),
+			"-outfmt", OUTFMT,
+		], stdout=subprocess.DEVNULL)
 		proc.check_returncode()
 
 		# return path to results
 		return blast_results
 
+	@staticmethod
+	def make_blast_db(dbseqs, blastdb = None):
+		if blastdb is None:
+			blastdb = dbseqs
+		if not os.path.exists(blastdb + ".nsq"):
+			# makeblastdb reports its progress on the standard output, which
+			# may be where the final results are streamed
+			proc = subprocess.run(["makeblastdb", "-in", dbseqs, "-dbtype", "nucl", "-out", blastdb], stdout=subprocess.PIPE, universal_newlines=True)
+			for line in proc.stdout.splitlines():
+				if line.strip():
+					logger.debug("makeblastdb: " + line)
+			proc.check_returncode()
+
+	@staticmethod
+	def merge_queries(queries, merged):
+		with open(merged, "w") as outfile:
+			for suffix, fasta in queries:
+				with open(fasta) as infile:
+					for line in infile:
+						if line.startswith(">"):
+							line = ">" + suffix + QUERY_TAG + line[1:].lstrip()
+						outfile.write(line)
+				outfile.write("\n")
+
+	def stream_blast(self, task, dbseqs, fasta, evalue):
+		# build a BLAST database if it doesn't exist yet
+		self.make_blast_db(dbseqs, self.blastdb)
+
+		# run the BLAST task, reading hits from its standard output
+		command = [
+			task,
+			"-query", fasta,
+			"-db", self.blastdb,
+			"-max_target_seqs", "1000000000",
+			"-evalue", evalue,
+			"-num_threads", str(self.threads),
+			"-outfmt", OUTFMT,
+		]
+		proc = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+		completed = False
+		try:
+			yield from proc.stdout
+			completed = True
+		finally:
+			proc.stdout.close()
+			# don't leave BLAST running if the results were not consumed
+			if not completed:
+				proc.kill()
+			returncode = proc.wait()
+		if returncode != 0:
+			raise subprocess.CalledProcessError(returncode, command)
+
+	def split_blast(self, blast_results, final_results_directory, prefix, suffixes, output = "plain"):
+		rows = {suffix: [] for suffix in suffixes}
+		outfiles = {}
+		try:
+			if output != "off" and final_results_directory is not None:
+				for suffix in suffixes:
+					blast_results_dir = os.path.join(final_results_directory, suffix)
+					os.makedirs(blast_results_dir, exist_ok=True)
+					blast_file = os.path.join(blast_results_dir, "{}_{}.txt".format(prefix, suffix))
+					if output == "gzip":
+						outfiles[suffix] = gzip.open(blast_file + ".gz", "wt")
+					else:
+						outfiles[suffix] = open(blast_file, "w")
+			for line in blast_results:
+				if not line.strip():
+					continue
+				suffix, _, line = line.partition(QUERY_TAG)
+				if outfiles:
+					outfiles[suffix].write(line)
+				fields = line.rstrip("\n").split("\t")
+				rows[suffix].append([convert(field) for convert, field in zip(COLUMN_TYPES, fields)])
+		finally:
+			for outfile in outfiles.values():
+				outfile.close()
+		import pandas as pd
+
+		return {
+			suffix: pd.DataFrame(suffix_rows, columns=range(len(COLUMN_TYPES)))
+			for suffix, suffix_rows in rows.items()
+		}
+
+	def read_blast(self, blastfile):
+		import pandas as pd
+		from pandas.errors import EmptyDataError
+
+		if isinstance(blastfile, pd.DataFrame):
+			if blastfile.empty:
+				raise EmptyDataError("No BLAST results")
+			return blastfile
+		return pd.read_csv(blastfile, sep = "\t", header = None)
+
+	def best_hits(self, blast_results_file, genes = None):
+		# select the hit with the highest bitscore for each query (or each
+		# group of queries), ties are broken by blast output order
+		if genes is None:
+			genes = blast_results_file[0]
+		return blast_results_file.loc[blast_results_file.groupby(genes, sort = True)[11].idxmax()]
+
 	def parse_virulence(self, virfile, pthresh, qthresh):
+		from pandas.errors import EmptyDataError
 
 		try:
 
-			blast_results_file = pd.read_csv(virfile, sep = "\s+", header = None)
-			blast_results_file = blast_results_file.sort_values(by = [0], ascending = True) # genome as query and mlst db as db
-			genes = blast_results_file.iloc[:,0] # genome as db and mlst db as query
+			blast_results_file = self.read_blast(virfile)
+			best_hits = self.best_hits(blast_results_file)
 
 			emetic = []
 			anthracis = []
@@ -114,14 +274,10 @@ class Blast:
 			has = []
 			bps = []
 			max_cyt = 0
-			genes = genes.unique()
-			for gene in genes:
-				gene_subset = blast_results_file[blast_results_file[0].str.match(gene)] # genome as query and mlst db as db
-				gene_subset = gene_subset.sort_values(by = [11], ascending = False)
-				max_gene = gene_subset.iloc[0,0]
-				pid = float(gene_subset.iloc[0,2])
-				qid = float(gene_subset.iloc[0,14])
-				#qid = 100*(float(gene_subset.iloc[0,3])/float(gene_subset.iloc[0,12])) # original BTyper query coverage value; genome as db and mlst db as query
+			for max_gene, pid, qid, max_bits in zip(best_hits[0], best_hits[2], best_hits[14], best_hits[11]):
+				pid = float(pid)
+				qid = float(qid)
+				#qid = 100*(float(length)/float(qlen)) # original BTyper query coverage value; genome as db and mlst db as query
 				if pid >= pthresh and qid >= qthresh:
 					if max_gene == "cesA" or max_gene == "cesB" or max_gene == "cesC" or max_gene == "cesD":
 						emetic.append(max_gene)
@@ -132,7 +288,7 @@ class Blast:
 					if max_gene == "hblA" or max_gene == "hblB" or max_gene == "hblC" or max_gene == "hblD":
 						hbl.append(max_gene)
 					if max_gene == "cytK-1" or max_gene == "cytK-2":
-						cyt_bits = gene_subset.iloc[0,11]
+						cyt_bits = max_bits
 						if cyt_bits > max_cyt:
 							max_cyt = cyt_bits
 							cytK = []
@@ -163,61 +319,46 @@ class Blast:
 
 
 	def parse_bt(self, btfile, pthresh, qthresh, overlap):
+		from pandas.errors import EmptyDataError
 
 		try:
 
-			blast_results_file = pd.read_csv(btfile, sep = "\s+", header = None)
-			blast_results_file = blast_results_file.sort_values(by = [0], ascending = True) # genome as query and mlst db as db
-			genes = blast_results_file.iloc[:,0] # genome as db and mlst db as query
-
-			rangedict = {}
-			bitdict = {}
-			genes = genes.unique()
-			for gene in genes:
-				gene_subset = blast_results_file[blast_results_file[0].str.match(gene)] # genome as query and mlst db as db
-				gene_subset = gene_subset.sort_values(by = [11], ascending = False)
-				max_gene = gene_subset.iloc[0,0]
-				pid = float(gene_subset.iloc[0,2])
-				qid = float(gene_subset.iloc[0,14])
-				#qid = 100*(float(gene_subset.iloc[0,3])/float(gene_subset.iloc[0,12])) # original BTyper query coverage value; genome as db and mlst db as query
-				glen = float(gene_subset.iloc[0,3])
-				gstart = int(gene_subset.iloc[0,8])
-				gend = int(gene_subset.iloc[0,9])
-				if gstart < gend:
-					grange = list(range(gstart, gend + 1))
-				elif gend < gstart:
-					grange = list(range(gend, gstart + 1))
+			blast_results_file = self.read_blast(btfile)
+			best_hits = self.best_hits(blast_results_file)
+
+			genes = []
+			for max_gene, sseqid, pid, qid, gstart, gend, max_bits in zip(best_hits[0], best_hits[1], best_hits[2], best_hits[14], best_hits[8], best_hits[9], best_hits[11]):
+				pid = float(pid)
+				qid = float(qid)
+				#qid = 100*(float(length)/float(qlen)) # original BTyper query coverage value; genome as db and mlst db as query
+				gstart = int(gstart)
+				gend = int(gend)
+				if gstart > gend:
+					gstart, gend = gend, gstart
 				if pid >= pthresh and qid >= qthresh:
-					rangedict[max_gene] = grange
-					bitdict[max_gene] = float(gene_subset.iloc[0,11])
-
+					genes.append((sseqid, gstart, gend, float(max_bits), max_gene))
+
+			# sweep the hits of each contig in order of start coordinate, keeping
+			# the hits that may still overlap the current one; key2 overlaps key
+			# when their intersection covers more than the overlap proportion of key2
+			overlaps = {gene[4]: [] for gene in genes}
+			active = []
+			for contig, gstart, gend, bits, key in sorted(genes):
+				active = [hit for hit in active if hit[0] == contig and hit[2] >= gstart]
+				for _, ostart, oend, obits, okey in active:
+					inter = float(min(gend, oend) - gstart + 1)
+					if inter / (oend - ostart + 1) > overlap:
+						overlaps[key].append((obits, okey))
+					if inter / (gend - gstart + 1) > overlap:
+						overlaps[okey].append((bits, key))
+				active.append((contig, gstart, gend, bits, key))
 
 			bt = []
-			#comparisons = []
-			for key, val in rangedict.items():
-				overlap_dict = {}
-				test_bits = bitdict[key]
-				grange = val
-				for key2, val2 in rangedict.items():
-					if key != key2: #and key + "VS" + key2 not in comparisons and key2 + "VS" + key not in comparisons:
-						#comparisons.append(key + "VS" + key2)
-						#comparisons.append(key2 + "VS" + key)
-						test_overlap = float(len(list(set(grange) & set(val2))))/float(len(val2))
-						og_bits = bitdict[key2]
-						if test_overlap > overlap: #and test_bits  > og_bits:
-							if key not in overlap_dict.keys():
-								overlap_dict[key] = test_bits
-							overlap_dict[key2] = og_bits
-				if len(overlap_dict.keys()) > 0:
-					maxbits = 0
-					max_gene = []
-					for okey in overlap_dict.keys():
-						oval = overlap_dict[okey]
-						if oval > maxbits:
-							maxbits = oval
-							max_gene = [okey]
-						elif oval == maxbits:
-							max_gene.append(okey)
+			for contig, gstart, gend, bits, key in genes:
+				if len(overlaps[key]) > 0:
+					candidates = overlaps[key] + [(bits, key)]
+					maxbits = max(candidates)[0]
+					max_gene = [okey for obits, okey in candidates if obits == maxbits]
 				else:
 					max_gene = [key]
 				max_gene = sorted(max_gene)
@@ -234,30 +375,25 @@ class Blast:
 
 
 	def parse_mlst(self, mlstfile):
+		from pandas.errors import EmptyDataError
 
 		try:
 
-			blast_results_file = pd.read_csv(mlstfile, sep = "\s+", header = None)
-			blast_results_file = blast_results_file.sort_values(by = [0], ascending = True) # genome as query and mlst db as db
-			genes = blast_results_file.iloc[:,0] # genome as db and mlst db as query
+			blast_results_file = self.read_blast(mlstfile)
+
+			# alleles are named <locus>_<allele>, so group hits by locus and
+			# keep every allele tied for the best bitscore of its locus
+			genes = blast_results_file[0].str.split("_").str[0]
+			best_hits = self.best_hits(blast_results_file, genes)
+			max_genes = blast_results_file[blast_results_file[11] == blast_results_file.groupby(genes)[11].transform("max")]
+			max_genes = max_genes[0].groupby(genes[max_genes.index]).unique()
 
 			mlst = []
 			perfect_matches = 0
-
-			genes = genes.str.split("_",expand=True)
-			genes = genes.iloc[:,0]
-			genes = genes.unique()
-			for gene in genes:
-				gene_subset = blast_results_file[blast_results_file[0].str.contains(gene)] # genome as query and mlst db as db
-				gene_subset = gene_subset.sort_values(by = [11], ascending = False)
-				max_bits = gene_subset.iloc[0,11]
-				pid = float(gene_subset.iloc[0,2])
-				qid = float(gene_subset.iloc[0,14])
-				if pid == 100.0 and qid == 100.0:
+			for gene, pid, qid in zip(genes[best_hits.index], best_hits[2], best_hits[14]):
+				if float(pid) == 100.0 and float(qid) == 100.0:
 					perfect_matches += 1
-				max_genes = gene_subset[gene_subset[11]==max_bits]
-				max_genes = max_genes.iloc[:,0]
-				mlst.append([mg.split("_")[-1].strip() for mg in set(max_genes)])
+				mlst.append([mg.split("_")[-1].strip() for mg in max_genes[gene]])
 
 		except EmptyDataError:
 			mlst = []
@@ -269,17 +405,17 @@ class Blast:
 
 
 	def parse_panC(self, panCfile):
+		from pandas.errors import EmptyDataError
 
 		try:
 
-			blast_results_file = pd.read_csv(panCfile, sep = "\s+", header = None)
+			blast_results_file = self.read_blast(panCfile)
 			blast_results_file = blast_results_file.sort_values(by = [11], ascending = False)
 			max_bits = blast_results_file.iloc[0,11]
 			pid = float(blast_results_file.iloc[0,2])
 			qid = float(blast_results_file.iloc[0,14])
 			max_gene = blast_results_file.iloc[0,0]
-			print(pid)
-			print(qid)
+			logger.debug("Best panC hit " + max_gene + ": " + str(pid) + "% identity, " + str(qid) + "% coverage")
 			if pid < 99.0 or qid < 80.0:
 					max_gene = max_gene + "*"
 
@@ -0,0 +1,315 @@
+import contextlib
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from .blast import Blast
+
+logger = logging.getLogger(__name__)
+
+class Cache:
+	"""
+	Store reusable BTyper3 data structures in a user cache directory
+
+	user_cache_dir
+	purpose: get the default location of the BTyper3 cache directory
+	output:
+		$BTYPER3_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/btyper3 (~/.cache/btyper3)
+
+	load
+	purpose: load a previously cached object
+	input:
+		namespace = subdirectory of the cache directory holding the object (e.g., ani)
+		name = name of the cached object (e.g., species)
+		key = hex digest identifying the inputs the object was built from
+	output:
+		cached object, or None if the cache does not contain an up-to-date copy
+
+	dump
+	purpose: atomically write an object to the cache, replacing outdated copies with the same name
+	input:
+		obj = object to cache
+		namespace, name, key = see load
+		required = raise the error if the object can't be written, instead of logging a warning (for objects that are only stored on disk, e.g., index shards)
+
+	fasta_digest
+	purpose: hash the content of a fasta file, independently of its name, line length and case
+	input:
+		fasta = path to the fasta file
+		headers = whether the sequence identifiers are part of the content
+	output:
+		SHA-256 hex digest of the sequences
+
+	genome_digest
+	purpose: hash the sequences of a genome, independently of its file name, sequence identifiers, line length, case and compression
+	input:
+		genome = Genome (see fasta.read_fasta)
+	output:
+		SHA-256 hex digest of the sequences
+
+	parse_size
+	purpose: convert a human-readable size (e.g., 500M, 20G) to a number of bytes
+
+	"""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+
+	@staticmethod
+	def user_cache_dir():
+		path = os.environ.get("BTYPER3_CACHE_DIR")
+		if not path:
+			base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+			path = os.path.join(base, "btyper3")
+		return path
+
+	@staticmethod
+	def digest(*parts):
+		# hash a sequence of strings/bytes into a single hex key
+		h = hashlib.sha256()
+		for part in parts:
+			if isinstance(part, str):
+				part = part.encode("utf-8")
+			h.update(len(part).to_bytes(8, "little"))
+			h.update(part)
+		return h.hexdigest()
+
+	@staticmethod
+	def fasta_digest(fasta, headers = True):
+		h = hashlib.sha256()
+		with open(fasta, "rb") as raw:
+			# gzipped files are hashed by their content, so that a genome gets
+			# the same digest whether it is compressed or not
+			handle = raw
+			if raw.read(2) == b"\x1f\x8b":
+				handle = gzip.GzipFile(fileobj=raw, mode="rb")
+			raw.seek(0)
+			for line in handle:
+				if line.startswith(b">"):
+					h.update(b">")
+					if headers:
+						h.update(line[1:].split(maxsplit=1)[0] if line[1:].strip() else b"")
+					h.update(b"\n")
+				else:
+					h.update(line.strip().upper())
+		return h.hexdigest()
+
+	@staticmethod
+	def genome_digest(genome):
+		h = hashlib.sha256()
+		for seq in genome.sequences:
+			h.update(len(seq).to_bytes(8, "little"))
+			h.update(seq)
+		return h.hexdigest()
+
+	@staticmethod
+	def parse_size(size):
+		units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+		size = str(size).strip().upper().rstrip("B")
+		if size and size[-1] in units:
+			return int(float(size[:-1]) * units[size[-1]])
+		return int(size)
+
+	def path(self, namespace, name, key):
+		return os.path.join(self.cache_dir, namespace, "{}-{}.pkl".format(name, key))
+
+	def load(self, namespace, name, key):
+		path = self.path(namespace, name, key)
+		try:
+			with open(path, "rb") as handle:
+				return pickle.load(handle)
+		except FileNotFoundError:
+			return None
+		except Exception as err:
+			logger.warning("Warning: ignoring unreadable cache file {} ({})".format(path, err))
+			return None
+
+	def dump(self, obj, namespace, name, key, required=False):
+		path = self.path(namespace, name, key)
+		directory = os.path.dirname(path)
+		try:
+			os.makedirs(directory, exist_ok=True)
+			# write to a temporary file first so that concurrent runs never
+			# see a partially written cache entry
+			fd, tmp = tempfile.mkstemp(dir=directory, prefix=".{}-".format(name), suffix=".tmp")
+			try:
+				with os.fdopen(fd, "wb") as handle:
+					pickle.dump(obj, handle, protocol=pickle.HIGHEST_PROTOCOL)
+				os.replace(tmp, path)
+			except BaseException:
+				with contextlib.suppress(OSError):
+					os.remove(tmp)
+				raise
+		except Exception as err:
+			if required:
+				raise
+			# the cache is optional, failing to write it never stops a run
+			logger.warning("Warning: could not write cache file {} ({})".format(path, err))
+			return
+		# remove entries built from outdated inputs
+		for entry in os.listdir(directory):
+			if entry.startswith(name + "-") and entry.endswith(".pkl") and os.path.join(directory, entry) != path:
+				with contextlib.suppress(OSError):
+					os.remove(os.path.join(directory, entry))
+
+
+class BlastDbCache:
+	"""
+	Content-addressed cache of genome blast databases
+
+	Databases are stored under the SHA-256 of the sequences (and sequence
+	identifiers) of the genome they were built from, so that a genome typed
+	again, even under another file name, reuses its database. The cache is
+	bounded in size: the least recently used databases are removed once the
+	total size of the cache exceeds max_size. Databases used in the last
+	min_age seconds are never removed, so that a concurrent run doesn't remove
+	a database that another run is about to search.
+
+	get_blast_db
+	purpose: get the blast database of a genome, building it if it is not cached yet
+	input:
+		dbseqs = blast database fasta file
+	output:
+		path to the blast database, to pass to blast with -db
+
+	evict
+	purpose: remove the least recently used databases until the cache fits in max_size
+
+	"""
+
+	# minimum time since the last use of a database before it can be removed
+	min_age = 900
+
+	def __init__(self, cache_dir, max_size):
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+
+	def get_blast_db(self, dbseqs):
+		key = Cache.fasta_digest(dbseqs)
+		entry = os.path.join(self.cache_dir, key)
+		blastdb = os.path.join(entry, "blastdb")
+
+		if os.path.isdir(entry):
+			# mark the database as recently used
+			with contextlib.suppress(OSError):
+				os.utime(entry)
+			return blastdb
+
+		# build the database in a temporary directory first, and move it in
+		# place so that concurrent runs never use a partial database
+		os.makedirs(self.cache_dir, exist_ok=True)
+		tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix=".{}-".format(key[:16]))
+		try:
+			Blast.make_blast_db(dbseqs, os.path.join(tmp, "blastdb"))
+			os.rename(tmp, entry)
+		except OSError:
+			# another run cached the same genome in the meantime
+			shutil.rmtree(tmp, ignore_errors=True)
+			if not os.path.isdir(entry):
+				raise
+		except BaseException:
+			shutil.rmtree(tmp, ignore_errors=True)
+			raise
+
+		self.evict()
+		return blastdb
+
+	def evict(self):
+		entries = []
+		total = 0
+		with os.scandir(self.cache_dir) as it:
+			for dirent in it:
+				if dirent.name.startswith(".") or not dirent.is_dir():
+					continue
+				try:
+					size = sum(f.stat().st_size for f in os.scandir(dirent.path) if f.is_file())
+					entries.append((dirent.stat().st_mtime, size, dirent.path))
+				except FileNotFoundError:
+					continue
+				total += size
+
+		# databases used recently may still be searched by a concurrent run
+		cutoff = time.time() - self.min_age
+		entries = sorted(entry for entry in entries if entry[0] < cutoff)
+		while total > self.max_size and entries:
+			mtime, size, path = entries.pop(0)
+			shutil.rmtree(path, ignore_errors=True)
+			total -= size
+
+
+class ResultCache:
+	"""
+	Store the final results of genomes in a SQLite database, to reuse them when a genome is typed again
+
+	Results are stored under a key combining the content of the genome (see
+	Cache.genome_digest) and the fingerprint of the run that typed it (BTyper3
+	version, database checksums and typing options; see Pipeline.fingerprint),
+	so that a genome submitted again, even under another file name, gets its
+	results back as long as the databases and the options are unchanged. The
+	database can be shared by concurrent runs and threads.
+
+	input:
+		path = path to the SQLite database file
+
+	key
+	purpose: get the key of the results of a genome
+	input:
+		digest = digest of the genome sequences (see Cache.genome_digest)
+		fingerprint = fingerprint of the run (see Pipeline.fingerprint)
+	output:
+		hex key
+
+	get
+	purpose: get cached results
+	input:
+		key = key of the results
+	output:
+		dictionary of results stored with put, or None if the results are not cached
+
+	put
+	purpose: store the results of a genome
+	input:
+		key = key of the results
+		results = dictionary of results, serializable to JSON
+
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, results TEXT NOT NULL, created TEXT NOT NULL)")
+
+	@staticmethod
+	def key(digest, fingerprint):
+		return Cache.digest(digest, json.dumps(fingerprint, sort_keys=True))
+
+	def get(self, key):
+		with self.lock:
+			row = self.db.execute("SELECT results FROM results WHERE key = ?", (key,)).fetchone()
+		return json.loads(row[0]) if row is not None else None
+
+	def put(self, key, results):
+		try:
+			with self.lock:
+				self.db.execute(
+					"INSERT OR REPLACE INTO results (key, results, created) VALUES (?, ?, ?)",
+					(key, json.dumps(results), datetime.datetime.now().isoformat(timespec="seconds")),
+				)
+		except sqlite3.Error as err:
+			logger.warning("Warning: could not store results in {} ({})".format(self.path, err))
+
+	def close(self):
+		with self.lock:
+			self.db.close()
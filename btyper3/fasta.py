@@ -0,0 +1,106 @@
+import contextlib
+import gzip
+import mmap
+import os
+
+# upper case the sequences while removing line breaks and spaces
+_UPPER = bytes.maketrans(b"abcdefghijklmnopqrstuvwxyz", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_WHITESPACE = b" \t\r\n\v\f"
+
+
+class Genome:
+	"""
+	Sequences of a FASTA file, loaded once and shared by all typing stages
+
+	Each contig is stored as a single upper case bytes buffer, without line
+	breaks. Consumers get memoryviews of the buffers (views), which can be
+	passed to pyfastani without copying, or the buffers themselves (sequences)
+	for byte-level processing.
+
+	attributes:
+		path = path to the FASTA file
+		ids = identifier of each contig (first word of the header)
+		sequences = upper case sequence of each contig (bytes)
+
+	views
+	purpose: get read-only views of the contig sequences
+	output:
+		list of memoryviews of the contig sequences
+
+	lengths
+	purpose: get the length of each contig
+	output:
+		list of contig lengths
+
+	"""
+
+	def __init__(self, path, ids, sequences):
+		self.path = path
+		self.ids = ids
+		self.sequences = sequences
+
+	def __len__(self):
+		return len(self.sequences)
+
+	def __iter__(self):
+		return zip(self.ids, self.sequences)
+
+	def views(self):
+		return [memoryview(seq) for seq in self.sequences]
+
+	def lengths(self):
+		return [len(seq) for seq in self.sequences]
+
+
+def parse_fasta(data):
+	"""
+	parse the content of a FASTA file
+
+	input:
+		data = content of the FASTA file (bytes, mmap, or any object supporting find and slicing)
+	output:
+		list of contig identifiers, and list of upper case contig sequences (bytes)
+	"""
+	ids = []
+	sequences = []
+	start = data.find(b">")
+	while start != -1:
+		header_end = data.find(b"\n", start)
+		if header_end == -1:
+			header_end = len(data)
+		header = bytes(data[start + 1:header_end]).split(maxsplit = 1)
+		end = data.find(b"\n>", header_end)
+		seq_end = len(data) if end == -1 else end
+		ids.append(header[0].decode("utf-8", "replace") if header else "")
+		sequences.append(bytes(data[header_end:seq_end]).translate(_UPPER, _WHITESPACE))
+		start = -1 if end == -1 else end + 1
+	return ids, sequences
+
+
+def read_fasta(path):
+	"""
+	load a FASTA file, gzipped or not
+
+	Plain files are memory-mapped rather than read, so that only the parsed
+	sequences are held in memory.
+
+	input:
+		path = path to the FASTA file, or a binary file object
+	output:
+		Genome
+	"""
+	if not isinstance(path, (str, bytes, os.PathLike)):
+		data = path.read()
+		if data[:2] == b"\x1f\x8b":
+			data = gzip.decompress(data)
+		return Genome(getattr(path, "name", None), *parse_fasta(data))
+
+	with open(path, "rb") as handle:
+		if handle.read(2) == b"\x1f\x8b":
+			handle.seek(0)
+			with gzip.GzipFile(fileobj = handle, mode = "rb") as gz:
+				return Genome(path, *parse_fasta(gz.read()))
+		if os.fstat(handle.fileno()).st_size == 0:
+			return Genome(path, [], [])
+		with contextlib.closing(mmap.mmap(handle.fileno(), 0, access = mmap.ACCESS_READ)) as data:
+			return Genome(path, *parse_fasta(data))
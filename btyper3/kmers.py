@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+
+# length of the k-mers used to anchor reference sequences in a genome, chosen
+# so that a 2-bit encoded k-mer fits in 32 bits
+KMER_LENGTH = 16
+
+# default blastn (megablast) scoring, used to report the bit score of hits
+# found without blast: reward 1, penalty -2, lambda 1.28, K 0.46
+BLASTN_REWARD = 1
+BLASTN_PENALTY = -2
+BLASTN_LAMBDA = 1.28
+BLASTN_K = 0.46
+
+_COMPLEMENT = bytes.maketrans(b"ACGTRYKMBDHVN", b"TGCAYRMKVHDBN")
+_DIGITS = bytes.maketrans(b"ACGT", b"0123")
+_CODES = np.zeros(256, dtype = np.uint32)
+_VALID = np.zeros(256, dtype = np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+	_CODES[_base] = _code
+	_VALID[_base] = 1
+
+
+def reverse_complement(seq):
+	"""
+	get the reverse complement of an upper case nucleotide sequence (bytes)
+	"""
+	return seq[::-1].translate(_COMPLEMENT)
+
+
+def kmer(seq):
+	"""
+	get the 2-bit encoded k-mer of the first KMER_LENGTH bases of a sequence (bytes) made of A, C, G and T
+	"""
+	return int(seq[:KMER_LENGTH].translate(_DIGITS), 4)
+
+
+def kmers(seq, k = KMER_LENGTH):
+	"""
+	get the 2-bit encoded k-mer starting at every position of an upper case nucleotide sequence (bytes)
+
+	Bases other than A, C, G and T are encoded as A, so matches must be checked
+	against the sequence. k-mers are stored on 32 bits for k <= 16, and on 64
+	bits for k <= 32.
+	"""
+	dtype = np.uint32 if k <= 16 else np.uint64
+	n = len(seq) - k + 1
+	if n <= 0:
+		return np.zeros(0, dtype = dtype)
+	codes = _CODES[np.frombuffer(seq, dtype = np.uint8)].astype(dtype)
+	array = np.zeros(n, dtype = dtype)
+	for i in range(k):
+		array = (array << dtype(2)) | codes[i:i + n]
+	return array
+
+
+def canonical_kmers(seq, k):
+	"""
+	get the canonical (smallest of both strands) 2-bit encoded k-mers of an upper case nucleotide sequence (bytes),
+	skipping k-mers that contain bases other than A, C, G and T
+	"""
+	forward = kmers(seq, k)
+	if len(forward) == 0:
+		return forward
+	reverse = kmers(reverse_complement(seq), k)[::-1]
+	invalid = np.concatenate(([0], np.cumsum(_VALID[np.frombuffer(seq, dtype = np.uint8)] == 0)))
+	valid = invalid[k:] == invalid[:-k]
+	return np.minimum(forward, reverse)[valid]
+
+
+def hash64(values):
+	"""
+	hash 64-bit integers with the splitmix64 finalizer
+	"""
+	with np.errstate(over = "ignore"):
+		values = values.astype(np.uint64)
+		values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+		values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+		return values ^ (values >> np.uint64(31))
+
+
+def minhash(sequences, size, k):
+	"""
+	compute the bottom-k MinHash sketch of a genome
+
+	input:
+		sequences = iterable of upper case nucleotide sequences (bytes)
+		size = number of hashes kept in the sketch
+		k = k-mer length (at most 32)
+	output:
+		sorted array of the size smallest distinct canonical k-mer hashes of the genome
+	"""
+	sketch = np.zeros(0, dtype = np.uint64)
+	for seq in sequences:
+		# duplicates are removed before keeping the smallest hashes of a
+		# contig, so that repeated k-mers don't take the place of distinct ones
+		hashes = np.unique(hash64(canonical_kmers(seq, k)))[:size]
+		sketch = np.union1d(sketch, hashes)[:size]
+	return sketch
+
+
+def mash_distance(sketch1, sketch2, size, k):
+	"""
+	estimate the Mash distance between two genomes from their bottom-k MinHash sketches
+	"""
+	union = np.union1d(sketch1, sketch2)[:size]
+	if len(union) == 0:
+		return 1.0
+	shared = np.intersect1d(np.intersect1d(sketch1, sketch2, assume_unique = True), union, assume_unique = True)
+	jaccard = len(shared) / len(union)
+	if jaccard == 0:
+		return 1.0
+	return -math.log(2 * jaccard / (1 + jaccard)) / k
+
+
+def blastn_bits(score):
+	"""
+	convert a raw blastn alignment score to a bit score
+	"""
+	return (BLASTN_LAMBDA * score - math.log(BLASTN_K)) / math.log(2)
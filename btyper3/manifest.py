@@ -0,0 +1,120 @@
+import dataclasses
+import datetime
+import json
+import os
+
+from .cache import Cache
+from .pack import file_sha256
+from .typer import TypingResult
+
+
+class Manifest:
+	"""
+	Append-only record of the genomes of a batch that were typed to completion
+
+	The manifest is a JSON Lines file. Each run appends a "run" record with
+	its fingerprint (BTyper3 version, database checksums and typing
+	parameters), and then one "genome" record per genome as soon as it is
+	typed, with the path, size, modification time and SHA-256 of the input
+	file and its final results. Each record is appended with a single write
+	and synced to disk, so a run interrupted at any point leaves at most one
+	truncated last line, which is ignored.
+
+	A genome is completed if the manifest has a record for the same input file
+	(same path, size and modification time), typed by a run with the same
+	fingerprint; checking a genome only takes a stat of its input file.
+
+	input:
+		path = path to the manifest file
+		fingerprint = dictionary with the version, database checksums, and parameters of the run (see Pipeline.fingerprint)
+
+	completed
+	purpose: get the results of the genomes already typed by a run with the same fingerprint
+	input:
+		genomes = paths to the genomes of the batch
+	output:
+		dictionary mapping each completed genome to its TypingResult
+
+	record
+	purpose: record a typed genome
+	input:
+		infile = path to the genome
+		result = FinalResults or TypingResult of the genome
+
+	"""
+
+	def __init__(self, path, fingerprint):
+		self.path = path
+		self.fingerprint = fingerprint
+		self.run = Cache.digest(json.dumps(fingerprint, sort_keys = True))
+		self.fd = None
+
+	@staticmethod
+	def stat(infile):
+		stat = os.stat(infile)
+		return (os.path.abspath(infile), stat.st_size, stat.st_mtime_ns)
+
+	def read(self):
+		records = {}
+		if not os.path.exists(self.path):
+			return records
+		with open(self.path, "rb") as handle:
+			for line in handle:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					# truncated by an interrupted run
+					continue
+				if record.get("type") == "genome" and record.get("run") == self.run:
+					records[(record["input"], record["size"], record["mtime_ns"])] = record
+		return records
+
+	def completed(self, genomes):
+		records = self.read()
+		completed = {}
+		for infile in genomes:
+			record = records.get(self.stat(infile))
+			if record is not None:
+				completed[infile] = TypingResult(**record["results"])
+		return completed
+
+	def append(self, record):
+		if self.fd is None:
+			self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+			# terminate the truncated last line of an interrupted run
+			size = os.fstat(self.fd).st_size
+			if size > 0:
+				with open(self.path, "rb") as handle:
+					handle.seek(size - 1)
+					if handle.read(1) != b"\n":
+						os.write(self.fd, b"\n")
+			self.append(dict(type = "run", run = self.run, started = datetime.datetime.now().isoformat(timespec = "seconds"), **self.fingerprint))
+		os.write(self.fd, (json.dumps(record, separators = (",", ":")) + "\n").encode("utf-8"))
+		os.fsync(self.fd)
+
+	def record(self, infile, result):
+		if not isinstance(result, TypingResult):
+			result = TypingResult.from_final_results(result)
+		path, size, mtime_ns = self.stat(infile)
+		self.append({
+			"type": "genome",
+			"run": self.run,
+			"input": path,
+			"size": size,
+			"mtime_ns": mtime_ns,
+			"sha256": file_sha256(infile),
+			"completed": datetime.datetime.now().isoformat(timespec = "seconds"),
+			"results": dataclasses.asdict(result),
+		})
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
@@ -4,6 +4,60 @@ import numpy as np
 from pandas.errors import EmptyDataError
 import itertools
 
+class ProfileIndex:
+	"""
+	Compiled PubMLST allelic profiles, for exact and nearest ST lookup
+
+	The profiles are compiled once into a dictionary mapping each allele
+	combination to its ST and clonal complex, and into an integer matrix with
+	one row per ST and one column per locus, which is compared against novel
+	allele combinations to find the closest known STs.
+
+	lookup
+	purpose: get the ST of an allele combination
+	input:
+		alleles = allele numbers of the seven loci, ordered alphabetically by locus
+	output:
+		(ST, clonal complex) tuple, or None if the combination is not in the profiles
+
+	nearest
+	purpose: find the known STs sharing the most alleles with any of several allele combinations
+	input:
+		combinations = list of allele combinations, ordered alphabetically by locus
+	output:
+		sorted list of (ST, clonal complex) tuples of the closest profiles, and the number of loci matching them
+
+	"""
+
+	loci = ("glp", "gmk", "ilv", "pta", "pur", "pyc", "tpi")
+
+	def __init__(self, profiles):
+
+		profiles = profiles.dropna(subset = ["ST"] + list(self.loci))
+		self.st = [str(st) for st in profiles["ST"]]
+		self.cc = ["No clonal complex" if str(cc) == "nan" else str(cc) for cc in profiles["clonal_complex"]]
+		self.matrix = profiles[list(self.loci)].to_numpy(dtype = np.int64)
+
+		# keep the first profile of a combination listed several times
+		self.sts = {}
+		for i, row in enumerate(map(tuple, self.matrix.tolist())):
+			self.sts.setdefault(row, (self.st[i], self.cc[i]))
+
+	def lookup(self, alleles):
+
+		return self.sts.get(tuple(int(a) for a in alleles))
+
+	def nearest(self, combinations):
+
+		if self.matrix.shape[0] == 0:
+			return([], 0)
+		combinations = np.array([[int(a) for a in c] for c in combinations], dtype = np.int64)
+		matches = (combinations[:, None, :] == self.matrix[None, :, :]).sum(axis = 2).max(axis = 0)
+		best = int(matches.max())
+		closest = sorted({(self.st[i], self.cc[i]) for i in np.flatnonzero(matches == best)}, key = lambda x: (len(x[0]), x[0]))
+		return(closest, best)
+
+
 class Mlst:
 	"""
 	Use multi-locus sequence typing (MLST) to assign genome to sequence type (ST)
@@ -12,15 +66,26 @@ class Mlst:
 	purpose: selects most likely ST from a list of allelic types (ATs)
 	input:
 		alleles = list of detected best-matching alleles, ordered alphabetically
-		profiles = file containing profiles for each gene and the resulting ST
+		profiles = file containing profiles for each gene and the resulting ST, or ProfileIndex returned by load_profiles
 		perfect_matches = number of alleles which perfectly matched database (produced by parse_mlst in blast.py)
 		final_results_directory = path to BTyper3 final results directory
 		prefix = genome prefix to use for output files
 	output:
-		predicted ST corresponding to best-matching alleles
+		predicted ST corresponding to best-matching alleles; for allele combinations missing from the profiles,
+		the closest known ST(s) and the number of loci they share with the genome
+
+	load_profiles
+	purpose: read and compile the PubMLST profiles file once so that it can be shared by several calls to at2st
+	input:
+		profiles = file containing profiles for each gene and the resulting ST
+	output:
+		ProfileIndex, which can be passed to at2st instead of the file
 	
 	"""
 
+	# maximum number of closest STs reported for an unknown ST
+	max_closest = 5
+
 
 	def __init__(self, alleles, profiles, perfect_matches, final_results_directory, prefix):
 
@@ -35,21 +100,32 @@ class Mlst:
 
 		if len(alleles) == 7:
 			final = []	
-			profiles = pd.read_csv(profiles, sep = "\t", header = 0)	
+			if isinstance(profiles, pd.DataFrame):
+				profiles = ProfileIndex(profiles)
+			elif not isinstance(profiles, ProfileIndex):
+				profiles = self.load_profiles(profiles)
 			alleles = list(itertools.product(*alleles))
 			for allele in alleles:
-				st_rows = profiles[(profiles.glp == int(allele[0])) & (profiles.gmk == int(allele[1])) & (profiles.ilv == int(allele[2])) & (profiles.pta == int(allele[3])) & (profiles.pur == int(allele[4])) & (profiles.pyc == int(allele[5])) & (profiles.tpi == int(allele[6]))]	
-				if st_rows.shape[0] > 0:
-					if str(st_rows["clonal_complex"].iloc[0]) == "nan":
-						cc = "No clonal complex"
-					else:
-						cc = str(st_rows["clonal_complex"].iloc[0])
-					final.append(str(st_rows["ST"].iloc[0]) + "[" + cc + "](" + str(perfect_matches) + "/7)")
+				st = profiles.lookup(allele)
+				if st is not None:
+					final.append(st[0] + "[" + st[1] + "](" + str(perfect_matches) + "/7)")
 			if len(final) > 0:
 				final = final
 			else:
-				final = ["Unknown(unknown ST)"]
+				closest, matches = profiles.nearest(alleles)
+				if len(closest) > 0 and matches > 0:
+					closest_sts = ",".join(st + "[" + cc + "]" for st, cc in closest[:self.max_closest])
+					if len(closest) > self.max_closest:
+						closest_sts += ",..."
+					final = ["Unknown(unknown ST, closest ST " + closest_sts + " shares " + str(matches) + "/7 alleles)"]
+				else:
+					final = ["Unknown(unknown ST)"]
 		else:
 			final = ["Unknown(missing alleles)"]
 
 		return(";".join(final))
+
+	@staticmethod
+	def load_profiles(profiles):
+
+		return ProfileIndex(pd.read_csv(profiles, sep = "\t", header = 0))
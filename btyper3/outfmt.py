@@ -0,0 +1,10 @@
+# format of the blast hits shared by blast and the stages reporting hits
+# found without blast (exact MLST alleles, panC), kept apart from blast.py
+# so that these stages don't import pandas
+
+# separator between the BTyper3 task and the original id of merged queries
+QUERY_TAG = "__"
+
+# blast tabular output format used by all tasks, and the type of each column
+OUTFMT = "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen qcovs qcovhsp"
+COLUMN_TYPES = (str, str, float, int, int, int, int, int, int, int, float, float, int, int, float, float)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+from .fasta import Genome
+
+# packed reference files start with this magic number, followed by the size
+# of the index (little-endian unsigned 64-bit integer), the JSON index, and
+# the 2-bit encoded sequences aligned on 8 bytes
+MAGIC = b"BT3PACK1"
+PACK_NAME = "references.pack"
+
+# number of bases encoded at once when packing
+CHUNK_SIZE = 1 << 16
+
+_DIGITS = bytes.maketrans(b"ACGT", b"0123")
+_INVALID = re.compile(rb"[^ACGT]+")
+_NON_DIGITS = re.compile(rb"[^0-3]")
+
+
+def encode(seq):
+	"""
+	2-bit encode an upper case nucleotide sequence (bytes), 4 bases per byte with the first base in the high bits
+
+	input:
+		seq = sequence to encode
+	output:
+		packed sequence, and list of [start, bases] runs of bases other than A, C, G and T, which are stored as is
+	"""
+	exceptions = [[m.start(), m.group().decode("ascii")] for m in _INVALID.finditer(seq)]
+	digits = _NON_DIGITS.sub(b"0", seq.translate(_DIGITS))
+	packed = bytearray()
+	for i in range(0, len(digits), CHUNK_SIZE):
+		chunk = digits[i:i + CHUNK_SIZE]
+		chunk += b"0" * (-len(chunk) % 4)
+		packed += int(chunk, 4).to_bytes(len(chunk) // 4, "big")
+	return bytes(packed), exceptions
+
+
+def write_pack(path, genomes):
+	"""
+	write reference genomes to a packed reference file
+
+	input:
+		path = path to the packed reference file
+		genomes = iterable of (genome id, Genome, SHA-256 hex digest of the original genome file) tuples
+	"""
+	index = {"version": 1, "genomes": {}}
+	blocks = []
+	offset = 0
+	for genome_id, genome, digest in genomes:
+		contigs = []
+		for name, seq in genome:
+			packed, exceptions = encode(seq)
+			contigs.append([name, len(seq), offset, exceptions])
+			blocks.append(packed)
+			offset += len(packed)
+		index["genomes"][genome_id] = {"sha256": digest, "contigs": contigs}
+
+	header = json.dumps(index, separators = (",", ":")).encode("utf-8")
+	header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as handle:
+		handle.write(MAGIC)
+		handle.write(struct.pack("<Q", len(header)))
+		handle.write(header)
+		for block in blocks:
+			handle.write(block)
+	os.replace(tmp, path)
+
+
+class ReferencePack:
+	"""
+	Memory-mapped packed reference file, holding the genomes of an ANI database
+
+	The pack is a context manager, and unmaps the file on exit.
+
+	input:
+		path = path to the packed reference file (see write_pack)
+
+	read
+	purpose: decode a reference genome
+	input:
+		genome_id = genome identifier (file name of the original genome in the database)
+	output:
+		Genome
+
+	sha256
+	purpose: get the SHA-256 of the original genome file, used to key cached indexes
+	input:
+		genome_id = genome identifier
+	output:
+		hex digest
+
+	close
+	purpose: unmap the packed reference file
+
+	"""
+
+	def __init__(self, path):
+		self.path = os.fspath(path)
+		with open(self.path, "rb") as handle:
+			self.data = mmap.mmap(handle.fileno(), 0, access = mmap.ACCESS_READ)
+		if self.data[:len(MAGIC)] != MAGIC:
+			raise ValueError("{!r} is not a BTyper3 packed reference file".format(self.path))
+		size, = struct.unpack_from("<Q", self.data, len(MAGIC))
+		start = len(MAGIC) + 8
+		self.index = json.loads(self.data[start:start + size].decode("utf-8"))
+		self.offset = start + size
+		self.genomes = self.index["genomes"]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
+
+	def close(self):
+		self.data.close()
+
+	def __contains__(self, genome_id):
+		return genome_id in self.genomes
+
+	def sha256(self, genome_id):
+		return self.genomes[genome_id]["sha256"]
+
+	def read(self, genome_id):
+		import numpy as np
+
+		ids = []
+		sequences = []
+		for name, length, offset, exceptions in self.genomes[genome_id]["contigs"]:
+			packed = np.frombuffer(self.data, dtype = np.uint8, count = (length + 3) // 4, offset = self.offset + offset)
+			codes = np.empty((len(packed), 4), dtype = np.uint8)
+			for i, shift in enumerate((6, 4, 2, 0)):
+				codes[:, i] = (packed >> shift) & 3
+			seq = bytearray(np.frombuffer(b"ACGT", dtype = np.uint8)[codes.reshape(-1)[:length]].tobytes())
+			for start, bases in exceptions:
+				seq[start:start + len(bases)] = bases.encode("ascii")
+			ids.append(name)
+			sequences.append(bytes(seq))
+		return Genome("{}:{}".format(self.path, genome_id), ids, sequences)
+
+	def __getstate__(self):
+		return {"path": self.path}
+
+	def __setstate__(self, state):
+		self.__init__(state["path"])
+
+
+def file_sha256(path):
+	"""
+	hash the content of a file
+	"""
+	h = hashlib.sha256()
+	with open(path, "rb") as handle:
+		for block in iter(lambda: handle.read(1 << 20), b""):
+			h.update(block)
+	return h.hexdigest()
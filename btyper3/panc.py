@@ -0,0 +1,132 @@
+import numpy as np
+
+from .outfmt import QUERY_TAG
+from .fasta import Genome, read_fasta
+from .kmers import BLASTN_PENALTY, BLASTN_REWARD, blastn_bits, kmers, reverse_complement
+
+# identity and coverage under which a panC hit is flagged with a *, as in
+# Blast.parse_panC
+PANC_IDENTITY = 99.0
+PANC_COVERAGE = 80.0
+
+
+class PanCIndex:
+	"""
+	Locate the panC gene of a genome and find its closest panC reference without blast
+
+	The k-mers of the panC reference sequences are indexed on both strands. A
+	genome is scanned once, and each k-mer shared with a reference votes for an
+	alignment diagonal (the offset between the reference and the genome). The
+	most supported diagonals locate panC, and each reference is then aligned
+	ungapped along its diagonal and scored with the blastn scoring scheme.
+
+	The closest reference is only reported when the result is unambiguous: a
+	single panC group has the best score, the best reference is aligned over
+	its full length with at least 99% identity, and no reference of another
+	group shares as many k-mers with the genome. Otherwise, the genome is left
+	to blastn, which also handles indels and divergent panC sequences.
+
+	find_panC
+	purpose: find the closest panC reference of a genome
+	input:
+		fasta = path to the genome in FASTA format, or Genome returned by read_fasta
+	output:
+		list containing the best hit, formatted as a tagged blast output line (see Blast.split_blast), or None if the result is ambiguous
+
+	"""
+
+	def __init__(self, references):
+
+		self.names = []
+		self.sequences = []
+		ref_kmers = []
+		for i, (name, seq) in enumerate(read_fasta(references)):
+			self.names.append(name)
+			self.sequences.append(seq)
+			for strand, strand_seq in enumerate((seq, reverse_complement(seq))):
+				array = kmers(strand_seq)
+				ref_kmers.append((array, np.full(len(array), 2 * i + strand, dtype = np.int64), np.arange(len(array), dtype = np.int64)))
+
+		# reference k-mers sorted by value, with the reference/strand and the
+		# offset of each k-mer
+		if ref_kmers:
+			values, targets, offsets = (np.concatenate(arrays) for arrays in zip(*ref_kmers))
+		else:
+			values, targets, offsets = np.zeros(0, dtype = np.uint32), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+		order = np.argsort(values, kind = "stable")
+		self.kmer_values = values[order]
+		self.kmer_targets = targets[order]
+		self.kmer_offsets = offsets[order]
+
+	def group(self, reference):
+		return self.names[reference]
+
+	def align(self, seq, reference, strand, diagonal):
+		# best ungapped local alignment of a reference along a diagonal of a
+		# contig, as (score, matches, length, reference start, genome start)
+		ref = self.sequences[reference]
+		if strand:
+			ref = reverse_complement(ref)
+		start = max(0, -diagonal)
+		end = min(len(ref), len(seq) - diagonal)
+		if end <= start:
+			return (0, 0, 0, 0, 0)
+		matches = np.frombuffer(ref[start:end], dtype = np.uint8) == np.frombuffer(seq[diagonal + start:diagonal + end], dtype = np.uint8)
+		scores = np.where(matches, BLASTN_REWARD, BLASTN_PENALTY)
+		prefix = np.concatenate(([0], np.cumsum(scores)))
+		lowest = np.minimum.accumulate(prefix)
+		stop = int(np.argmax(prefix - lowest))
+		first = int(np.flatnonzero(prefix[:stop + 1] == lowest[stop])[-1])
+		return (int(prefix[stop] - prefix[first]), int(matches[first:stop].sum()), stop - first, start + first, diagonal + start + first)
+
+	def find_panC(self, fasta):
+
+		genome = fasta if isinstance(fasta, Genome) else read_fasta(fasta)
+		candidates = []
+		for contig, seq in genome:
+			contig_kmers = kmers(seq)
+			left = np.searchsorted(self.kmer_values, contig_kmers, side = "left")
+			right = np.searchsorted(self.kmer_values, contig_kmers, side = "right")
+			counts = right - left
+			if not counts.any():
+				continue
+
+			# every shared k-mer votes for the diagonal of each reference it occurs in
+			positions = np.repeat(np.arange(len(contig_kmers)), counts)
+			hits = np.concatenate([np.arange(l, r) for l, r in zip(left[counts > 0].tolist(), right[counts > 0].tolist())])
+			targets = self.kmer_targets[hits]
+			diagonals = positions - self.kmer_offsets[hits]
+			(targets, diagonals), votes = np.unique(np.stack([targets, diagonals]), axis = 1, return_counts = True)
+
+			# keep the best diagonal of each reference/strand
+			order = np.lexsort((-votes, targets))
+			first = np.concatenate(([True], targets[order][1:] != targets[order][:-1]))
+			for target, diagonal, vote in zip(targets[order][first].tolist(), diagonals[order][first].tolist(), votes[order][first].tolist()):
+				reference, strand = divmod(target, 2)
+				candidates.append((self.align(seq, reference, strand, diagonal), vote, reference, strand, contig, len(seq)))
+
+		if not candidates:
+			return None
+
+		candidates.sort(key = lambda c: c[0][0], reverse = True)
+		(score, matches, length, ref_start, genome_start), vote, reference, strand, contig, slen = candidates[0]
+		qlen = len(self.sequences[reference])
+		pid = 100.0 * matches / length if length else 0.0
+		qcov = 100.0 * length / qlen
+		if pid < PANC_IDENTITY or length < qlen:
+			return None
+		for other in candidates[1:]:
+			if self.group(other[2]) != self.group(reference) and (other[0][0] >= score or other[1] >= vote):
+				return None
+
+		if strand:
+			qstart, qend = qlen - ref_start - length + 1, qlen - ref_start
+			sstart, send = genome_start + length, genome_start + 1
+		else:
+			qstart, qend = ref_start + 1, ref_start + length
+			sstart, send = genome_start + 1, genome_start + length
+		return ["\t".join([
+			"panC" + QUERY_TAG + self.names[reference], contig, "{:.3f}".format(pid), str(length), str(length - matches), "0",
+			str(qstart), str(qend), str(sstart), str(send), "0.0", str(round(blastn_bits(score))),
+			str(qlen), str(slen), str(round(qcov)), str(round(qcov)),
+		]) + "\n"]
@@ -0,0 +1,893 @@
+import concurrent.futures
+import contextlib
+import datetime
+import glob
+import itertools
+import json
+import importlib.resources
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import urllib.request
+import xml.etree.ElementTree as etree
+
+from .blast import Blast
+from .cache import BlastDbCache, Cache, ResultCache
+from .fasta import read_fasta
+from .pack import file_sha256
+from .print_final_results import FinalResults
+from .timings import StageTimer, summarize, timed
+
+logger = logging.getLogger(__name__)
+
+# the modules of the typing stages (and their dependencies, e.g., pyfastani)
+# are only imported when the stage is selected
+
+# file extensions of the genomes picked up when the input is a directory
+FASTA_EXTENSIONS = (".fasta", ".fa", ".fna", ".fas", ".fsa")
+
+# options that change the typing results of a genome (see Pipeline.fingerprint)
+RESULT_OPTIONS = (
+	"ani_species", "ani_subspecies", "ani_geneflow", "ani_typestrains", "ani_prescreen", "ani_custom",
+	"virulence", "bt", "mlst", "panC", "virulence_db", "virulence_identity", "virulence_coverage",
+	"bt_identity", "bt_coverage", "bt_overlap", "evalue", "download_mlst_latest",
+)
+
+# attributes of FinalResults stored in the result cache; the file name and
+# prefix are those of the genome the results are returned for
+RESULT_FIELDS = (
+	"species", "subspecies", "geneflow", "typestrains", "custom", "anthracis", "emetic", "nhe", "hbl",
+	"cytK", "sph", "cap", "has", "bps", "bt_final", "mlst_final", "panC_final",
+)
+
+
+# pipeline shared with the worker processes forked by Pipeline.map
+_PIPELINE = None
+
+
+def _type_genome(infile):
+	return _PIPELINE.run_genome(infile)
+
+
+def find_genomes(path):
+	"""
+	list the genomes to type from a BTyper3 input argument
+
+	input:
+		path = a FASTA file, a directory containing FASTA files, a glob pattern
+		matching FASTA files, or a manifest file listing one FASTA file per line
+	output:
+		list of paths to the FASTA files, in input order
+	"""
+
+	if os.path.isdir(path):
+		genomes = [
+			os.path.join(path, name)
+			for name in sorted(os.listdir(path))
+			if name.endswith(FASTA_EXTENSIONS) and os.path.isfile(os.path.join(path, name))
+		]
+	elif os.path.isfile(path):
+		# a FASTA file starts with a header line, anything else is a manifest
+		with open(path) as handle:
+			first = next((line for line in handle if line.strip()), "")
+		if first.startswith(">") or not first:
+			return [path]
+		genomes = []
+		with open(path) as handle:
+			for line in handle:
+				line = line.strip()
+				if line and not line.startswith("#"):
+					genome = line.split("\t")[0].strip()
+					genomes.append(os.path.join(os.path.dirname(path), genome))
+	elif any(char in path for char in "*?["):
+		genomes = [genome for genome in sorted(glob.glob(path)) if os.path.isfile(genome)]
+	else:
+		raise FileNotFoundError("No such file or directory: {!r}".format(path))
+
+	if not genomes:
+		raise FileNotFoundError("No genomes found in {!r}".format(path))
+	return genomes
+
+
+def genome_prefix(infile):
+	"""
+	get the prefix used for the output files of a genome
+	"""
+	prefix = infile.split("/")[-1].strip()
+	return ".".join(prefix.split(".")[0:-1])
+
+
+class Pipeline:
+	"""
+	Type genomes with BTyper3, loading databases once for all genomes
+
+	The pipeline is a context manager: the reference databases, the ANI index
+	and the MLST profiles are resolved and loaded when entering it, and are then
+	shared by every call to type_genome.
+
+	input:
+		args = parsed BTyper3 command line arguments
+		final_results_directory = path to BTyper3 final results directory, or None to not write the intermediate results of each genome
+
+	type_genome
+	purpose: run all selected typing methods on a genome, or get its results from the result cache
+	input:
+		infile = path to the genome in FASTA format
+		genome = genome already loaded with fasta.read_fasta (optional; read from infile otherwise)
+		prefix = prefix of the output files of the genome (optional; the file name of infile without its extension otherwise), e.g., to keep genomes typed concurrently under the same file name apart
+	output:
+		FinalResults for the genome
+
+	run_genome
+	purpose: run all selected typing methods on a genome, without the result cache
+	input:
+		same as type_genome
+	output:
+		FinalResults for the genome
+
+	With the result cache (--result_cache True), the final results of each
+	genome are stored in the cache directory under a key made of the content
+	of the genome (its sequences, whatever the file name, sequence identifiers
+	or line length) and the fingerprint of the pipeline, and a genome typed
+	again gets its results back without running ANI or blast; its
+	intermediate results are then not written again.
+
+	The queries of the blast-based stages (virulence, Bt, MLST, and panC) are
+	merged into a single search per blast program. The ANI query and the blast
+	searches of a genome run concurrently in threads, and the thread budget of
+	the genome is split between PyFastANI and blast. MLST loci with an exact,
+	full-length allele match in the genome are typed without blast, and only
+	the alleles of the remaining loci are searched with blastn. Likewise, panC
+	is only searched with blastn when its closest reference can't be found
+	unambiguously by k-mer matching.
+
+	With timings (--timings True), the wall time, CPU time, peak memory and
+	child process resource usage of each stage (e.g., ANI indexing and
+	querying, makeblastdb, each blast search, and each parser) are recorded
+	with a StageTimer (see timings.StageTimer), and written to
+	timings/<prefix>_timings.json in the final results directory for each
+	genome, and to timings/btyper3_load_timings.json for the loading of the
+	databases. With --profile True, the stages are also profiled with cProfile.
+
+	fingerprint
+	purpose: identify the typing results produced by this pipeline, e.g., to check whether previous results can be reused
+	output:
+		dictionary with the BTyper3 version, the SHA-256 checksums of the databases, and the options that change the typing results
+
+	write_timings_summary
+	purpose: write the summary of the stage timings of the genomes typed with map to timings/btyper3_batch_timings.json (see timings.summarize)
+
+	map
+	purpose: type several genomes, possibly in parallel worker processes
+	input:
+		genomes = list of paths to genomes in FASTA format
+		jobs = number of worker processes; the workers are forked once the databases are loaded, so the ANI index and the MLST profiles are shared copy-on-write rather than loaded by each worker
+	output:
+		iterator over the FinalResults of each genome, in input order; with the result cache, genomes with identical sequences are only typed once
+
+	"""
+
+	def __init__(self, args, final_results_directory, jobs = 1):
+
+		self.final_results_directory = final_results_directory
+		self.jobs = jobs
+
+		# split the thread budget of the run between the worker processes
+		threads = int(args.threads) if args.threads is not None else (os.cpu_count() or 1)
+		self.threads = max(1, threads // max(1, jobs))
+
+		# blast databases are built in a scratch directory rather than next
+		# to the input genomes
+		self.tmpdir = args.tmpdir
+		self.blast_output = args.blast_output
+
+		# blast databases can also be kept between runs in a size-bounded cache
+		self.blastdb_cache = None
+		if args.blastdb_cache is not None:
+			self.blastdb_cache = BlastDbCache(args.blastdb_cache, Cache.parse_size(args.blastdb_cache_size))
+
+		# get arguments
+		# evalue is stored as a string because it gets passed to blast command as a string
+		self.ani_species = args.ani_species
+		self.ani_subspecies = args.ani_subspecies
+		self.ani_geneflow = args.ani_geneflow
+		self.ani_typestrains = args.ani_typestrains
+		self.ani_prescreen = int(args.ani_prescreen)
+		self.ani_custom = args.ani_custom
+		self.ani_custom_memory = Cache.parse_size(args.ani_custom_memory)
+		self.virulence = args.virulence
+		self.bt = args.bt
+		self.mlst = args.mlst
+		self.panC = args.panC
+		self.vdb = args.virulence_db
+		self.vpthresh = int(args.virulence_identity)
+		self.vqthresh = int(args.virulence_coverage)
+		self.bpthresh = int(args.bt_identity)
+		self.bqthresh = int(args.bt_coverage)
+		self.overlap = float(args.bt_overlap)
+		self.evalue = str(args.evalue)
+		self.download_mlst_latest = args.download_mlst_latest
+		self.cache_dir = args.cache_dir
+		if self.cache_dir is None:
+			self.cache_dir = Cache.user_cache_dir()
+		elif self.cache_dir == "False":
+			self.cache_dir = None
+		self.use_result_cache = args.result_cache == "True"
+		if self.use_result_cache and self.cache_dir is None:
+			logger.warning("Warning: the result cache is stored in the cache directory, which was disabled with --cache_dir False; results will not be cached")
+			self.use_result_cache = False
+
+		# taxa assigned with ANI, all queried against one combined index
+		self.taxa = []
+		if self.ani_species == "True":
+			self.taxa.append("species")
+		if self.ani_subspecies == "True":
+			self.taxa.append("subspecies")
+		if self.ani_geneflow == "True":
+			self.taxa.append("geneflow")
+		if self.ani_typestrains == "True":
+			self.taxa.append("typestrains")
+
+		self.parameters = {option: str(getattr(args, option)) for option in RESULT_OPTIONS}
+
+		# stage timings and profiles are written to the final results
+		# directory; profiling implies timings
+		self.timings_directory = None
+		self.profile_directory = None
+		if final_results_directory is not None and "True" in (args.timings, args.profile):
+			self.timings_directory = os.path.join(final_results_directory, "timings", "")
+			if args.profile == "True":
+				self.profile_directory = os.path.join(self.timings_directory, "profiles")
+		self.genome_timings = []
+
+		self._ctx = None
+		self._fingerprint = None
+
+	def __enter__(self):
+		self._ctx = contextlib.ExitStack()
+		try:
+			self.load_databases(self._ctx)
+		except BaseException:
+			self._ctx.close()
+			raise
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._ctx.close()
+		return False
+
+	def load_databases(self, ctx):
+		now = datetime.datetime.now
+
+		# record the loading stages of the run
+		self.load_timer = None
+		if self.timings_directory is not None:
+			self.load_timer = StageTimer("btyper3_load", self.profile_directory)
+
+		# create the scratch directory of the run, removed on exit even if
+		# typing fails
+		self.scratch_directory = ctx.enter_context(tempfile.TemporaryDirectory(prefix = "btyper3_", dir = self.tmpdir))
+
+		# build the ANI index of all selected databases
+		self.ani_index = None
+		if self.taxa:
+			logger.info("Loading ANI database(s) for " + ", ".join(self.taxa) + " at " + now().strftime("%Y-%m-%d %H:%M"))
+			from .ani import AniIndex
+			self.ani_index = AniIndex(self.taxa, cache_dir = self.cache_dir, prescreen = self.ani_prescreen, timer = self.load_timer)
+			ctx.callback(self.ani_index.close)
+
+		# index the user-supplied ANI database in shards, stored in the cache
+		# directory (or in the scratch directory if caching is disabled or the
+		# cache directory can't be written)
+		self.ani_shards = None
+		if self.ani_custom is not None:
+			logger.info("Loading custom ANI database " + self.ani_custom + " at " + now().strftime("%Y-%m-%d %H:%M"))
+			from .ani import AniShards
+			with timed(self.load_timer, "custom_ani_index"):
+				self.ani_shards = AniShards(self.ani_custom, self.ani_custom_memory, self.cache_dir or self.scratch_directory, prescreen = self.ani_prescreen, scratch = self.scratch_directory)
+
+		# resolve the paths to the virulence and Bt databases
+		if self.virulence == "True":
+			if self.vdb == "aa":
+				vdb_name = "btyper3_virulence_sequences.faa"
+				self.vdb_task = "tblastn"
+			elif self.vdb == "nuc":
+				vdb_name = "btyper3_virulence_sequences.ffn"
+				self.vdb_task = "blastn"
+			self.vdb_path = ctx.enter_context(importlib.resources.path("btyper3.seq_virulence_db", vdb_name))
+
+		if self.bt == "True":
+			self.bt_path = ctx.enter_context(importlib.resources.path("btyper3.seq_bt_db", "btyper3_bt_sequences.faa"))
+
+		# get the PubMLST database and load the allelic profiles
+		if self.mlst == "True":
+
+			if self.download_mlst_latest == "True":
+
+				logger.info("Downloading most recent PubMLST datbase at " + now().strftime("%Y-%m-%d %H:%M"))
+				with urllib.request.urlopen("https://pubmlst.org/data/dbases.xml") as req:
+					tree = etree.parse(req)
+					parent = next(e for e in tree.iter("species") if e.text.strip() == "Bacillus cereus")
+					urls = (e.text for e in parent.iter("url"))
+
+				mlst_file = ctx.enter_context(tempfile.NamedTemporaryFile(suffix=".fas", mode="wb", buffering=0))
+				bcereus_file = ctx.enter_context(tempfile.NamedTemporaryFile(suffix=".txt", mode="wb", buffering=0))
+				self.mlst_path = mlst_file.name
+				self.bcereus_path = bcereus_file.name
+
+				for url in urls:
+					if "alleles_fasta" in url:
+						with urllib.request.urlopen(url) as req:
+							shutil.copyfileobj(req, mlst_file)
+					elif "profiles_csv" in url:
+						with urllib.request.urlopen(url) as req:
+							shutil.copyfileobj(req, bcereus_file)
+
+				logger.info("Finished downloading most recent PubMLST datbase at " + now().strftime("%Y-%m-%d %H:%M"))
+
+			else:
+
+				db_time = importlib.resources.read_text("btyper3.seq_mlst_db", "timestamp.txt").strip()
+				logger.info("Using local PubMLST database (downloaded at {})".format(db_time))
+
+				self.mlst_path = ctx.enter_context(importlib.resources.path("btyper3.seq_mlst_db", "mlst.fas"))
+				self.bcereus_path = ctx.enter_context(importlib.resources.path("btyper3.seq_mlst_db", "bcereus.txt"))
+
+			from .alleles import AlleleIndex
+			from .mlst import Mlst
+			with timed(self.load_timer, "mlst_profiles"):
+				self.profiles = Mlst.load_profiles(self.bcereus_path)
+
+			# index the alleles to type loci with exact matches without blast
+			with timed(self.load_timer, "mlst_allele_index"):
+				self.allele_index = AlleleIndex(self.mlst_path)
+
+		if self.panC == "True":
+			self.panC_path = ctx.enter_context(importlib.resources.path("btyper3.seq_panC_db", "panC.fna"))
+			from .panc import PanCIndex
+			with timed(self.load_timer, "panC_index"):
+				self.panC_index = PanCIndex(self.panC_path)
+
+		# the query sequences of all stages using the same blast program are
+		# concatenated, so that each genome database is only searched once
+		# per program
+		queries = {"tblastn": [], "blastn": []}
+		if self.virulence == "True":
+			queries[self.vdb_task].append(("virulence", self.vdb_path))
+		if self.bt == "True":
+			queries["tblastn"].append(("bt", self.bt_path))
+		if self.mlst == "True":
+			queries["blastn"].append(("mlst", self.mlst_path))
+		if self.panC == "True":
+			queries["blastn"].append(("panC", self.panC_path))
+
+		self.queries = queries
+		self.searches = {}
+		for task, task_queries in queries.items():
+			if task_queries:
+				query_path = os.path.join(self.scratch_directory, "{}_queries.fasta".format(task))
+				Blast.merge_queries(task_queries, query_path)
+				self.searches[task] = (query_path, [suffix for suffix, _ in task_queries])
+
+		# open the result cache once the databases are known, since cached
+		# results are keyed by their checksums
+		self.result_cache = None
+		if self.use_result_cache:
+			self.result_cache = ResultCache(os.path.join(self.cache_dir, "results.sqlite"))
+			ctx.callback(self.result_cache.close)
+			self.fingerprint()
+
+		if self.load_timer is not None:
+			self.load_timer.write(self.timings_directory + "btyper3_load_timings.json")
+
+	def fingerprint(self):
+		from . import __version__
+
+		if self._fingerprint is not None:
+			return self._fingerprint
+
+		# the databases are identified by their content: the ANI database
+		# tables, the custom ANI database and its reference genome files, and
+		# the query sequences and profiles of the other stages
+		databases = {}
+		for taxon in self.taxa:
+			databases["ani_" + taxon] = Cache.digest(self.ani_index.tsvs[taxon])
+		if self.ani_shards is not None:
+			databases["ani_custom"] = self.ani_shards.digest
+		if self.virulence == "True":
+			databases["virulence"] = file_sha256(self.vdb_path)
+		if self.bt == "True":
+			databases["bt"] = file_sha256(self.bt_path)
+		if self.mlst == "True":
+			databases["mlst"] = file_sha256(self.mlst_path)
+			databases["mlst_profiles"] = file_sha256(self.bcereus_path)
+		if self.panC == "True":
+			databases["panC"] = file_sha256(self.panC_path)
+
+		self._fingerprint = {"version": __version__, "databases": databases, "parameters": self.parameters}
+		return self._fingerprint
+
+	def result_key(self, genome):
+		return ResultCache.key(Cache.genome_digest(genome), self.fingerprint())
+
+	@staticmethod
+	def cached_results(infile, results, prefix = None):
+		final_results = FinalResults(
+			final_results_directory = None,
+			infile = infile,
+			prefix = prefix or genome_prefix(infile),
+			**results)
+		final_results.timings = None
+		return final_results
+
+	def map(self, genomes, jobs = 1):
+
+		if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+			logger.warning("Warning: parallel typing requires the fork start method, which is not available on this platform; typing genomes sequentially")
+			jobs = 1
+
+		if self.result_cache is None:
+			for final_results in self.map_genomes(genomes, jobs):
+				self.genome_timings.append(final_results.timings)
+				yield final_results
+			return
+
+		# look up the results of every genome before typing, and only type the
+		# first genome of each group of genomes with identical sequences
+		keys = [self.result_key(read_fasta(infile)) for infile in genomes]
+		results = {}
+		for key in set(keys):
+			cached = self.result_cache.get(key)
+			if cached is not None:
+				results[key] = cached
+		first = {}
+		for infile, key in zip(genomes, keys):
+			if key not in results:
+				first.setdefault(key, infile)
+		logger.info("Found the results of " + str(sum(key in results for key in keys)) + "/" + str(len(genomes)) + " genomes in the result cache; typing " + str(len(first)) + " genomes")
+
+		typed = self.map_genomes(list(first.values()), jobs)
+		for infile, key in zip(genomes, keys):
+			if key not in results:
+				final_results = next(typed)
+				self.genome_timings.append(final_results.timings)
+				results[key] = {field: getattr(final_results, field) for field in RESULT_FIELDS}
+				self.result_cache.put(key, results[key])
+				yield final_results
+			else:
+				yield self.cached_results(infile, results[key])
+
+	def write_timings_summary(self):
+		if self.timings_directory is None:
+			return
+		summary = summarize([records for records in self.genome_timings if records is not None], self.load_timer.records)
+		summary["wall"] = self.load_timer.elapsed()
+		with open(self.timings_directory + "btyper3_batch_timings.json", "w") as handle:
+			json.dump(summary, handle, indent = 1)
+
+	def map_genomes(self, genomes, jobs):
+		global _PIPELINE
+
+		if jobs <= 1:
+			for infile in genomes:
+				yield self.run_genome(infile)
+			return
+
+		# workers are forked after the databases were loaded, and `imap`
+		# returns the results in input order whichever worker finishes first
+		_PIPELINE = self
+		try:
+			with multiprocessing.get_context("fork").Pool(jobs) as pool:
+				yield from pool.imap(_type_genome, genomes)
+		finally:
+			_PIPELINE = None
+
+	def type_genome(self, infile, genome = None, prefix = None):
+
+		if self.result_cache is None:
+			return self.run_genome(infile, genome, prefix)
+
+		if genome is None:
+			genome = read_fasta(infile)
+		key = self.result_key(genome)
+		results = self.result_cache.get(key)
+		if results is not None:
+			logger.info("Found the results of " + (prefix or genome_prefix(infile)) + " in the result cache")
+			return self.cached_results(infile, results, prefix)
+
+		final_results = self.run_genome(infile, genome, prefix)
+		self.result_cache.put(key, {field: getattr(final_results, field) for field in RESULT_FIELDS})
+		return final_results
+
+	def run_genome(self, infile, genome = None, prefix = None):
+
+		final_results_directory = self.final_results_directory
+		if prefix is None:
+			prefix = genome_prefix(infile)
+
+		# each genome gets its own scratch directory, since several genomes
+		# may share a prefix or be typed at the same time
+		scratch = tempfile.mkdtemp(prefix = "{}_".format(prefix), dir = self.scratch_directory)
+		blastdb = os.path.join(scratch, "blastdb")
+		timer = None
+		if self.timings_directory is not None:
+			timer = StageTimer(prefix, self.profile_directory)
+
+		try:
+			# the genome is parsed once, and shared by every stage that reads it
+			if genome is None:
+				with timed(timer, "read_fasta"):
+					genome = read_fasta(infile)
+			genome_searches = self.genome_searches(infile, prefix, scratch, genome, timer)
+
+			# stages to run for this genome, in order of decreasing cost so that
+			# they get the remaining threads of the budget first
+			stages = []
+			if self.taxa:
+				stages.append("ani")
+			if self.ani_shards is not None:
+				stages.append("custom")
+			stages.extend(genome_searches)
+			threads = self.share_threads(self.threads, stages)
+
+			with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, min(len(stages), self.threads))) as executor:
+
+				ani = executor.submit(self.run_ani, infile, prefix, threads.get("ani", 1), genome, timer)
+				custom = executor.submit(self.run_custom_ani, infile, prefix, threads.get("custom", 1), genome, timer)
+
+				# the blast searches all use the same genome database, so
+				# build it once before starting them
+				if any(query_path is not None for query_path, _, _ in genome_searches.values()):
+					with timed(timer, "makeblastdb", cache = self.blastdb_cache is not None):
+						if self.blastdb_cache is not None:
+							blastdb = self.blastdb_cache.get_blast_db(infile)
+						else:
+							Blast.make_blast_db(infile, blastdb)
+
+				searches = [
+					executor.submit(self.run_search, task, infile, prefix, threads[task], blastdb, search, timer)
+					for task, search in genome_searches.items()
+				]
+
+				blast_results = {}
+				for search in searches:
+					blast_results.update(search.result())
+				final_species, final_subspecies, final_geneflow, final_typestrains = ani.result()
+				final_custom = custom.result()
+
+			anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps = self.run_virulence(infile, prefix, blast_results.get("virulence"), timer)
+			bt_final = self.run_bt(infile, prefix, blast_results.get("bt"), timer)
+			mlst_final = self.run_mlst(infile, prefix, blast_results.get("mlst"), timer)
+			panC_final = self.run_panC(infile, prefix, blast_results.get("panC"), timer)
+		finally:
+			shutil.rmtree(scratch, ignore_errors = True)
+
+		if timer is not None:
+			timer.write(self.timings_directory + prefix + "_timings.json", genome = infile)
+
+		final_results = FinalResults(
+			final_results_directory = final_results_directory,
+			infile = infile,
+			prefix = prefix,
+			species = final_species,
+			subspecies = final_subspecies,
+			geneflow = final_geneflow,
+			typestrains = final_typestrains,
+			custom = final_custom,
+			anthracis = anthracis,
+			emetic = emetic,
+			nhe = nhe,
+			hbl = hbl,
+			cytK = cytK,
+			sph = sph,
+			cap = cap,
+			has = has,
+			bps = bps,
+			bt_final = bt_final,
+			mlst_final = mlst_final,
+			panC_final = panC_final)
+
+		# stage records are returned with the results, since genomes may be
+		# typed in worker processes
+		final_results.timings = timer.records if timer is not None else None
+		return final_results
+
+	def run_ani(self, infile, prefix, threads = 1, genome = None, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+
+		# perform species and/or supspecies assignment
+		if not self.taxa:
+			return (
+				"(Species assignment not performed)",
+				"(Subspecies assignment not performed)",
+				"(Pseudo-gene flow unit assignment not performed)",
+				"(Type strain-based taxonomic assignment not performed)",
+			)
+
+		if self.ani_species == "True":
+			logger.info("Using PyFastANI to assign " + prefix + " to a species at " + now().strftime("%Y-%m-%d %H:%M"))
+		if self.ani_subspecies == "True":
+			logger.info("Using PyFastANI to assign " + prefix + " to a subspecies (if applicable) at " + now().strftime("%Y-%m-%d %H:%M"))
+		if self.ani_geneflow == "True":
+			logger.info("Using PyFastANI to assign " + prefix + " to a pseudo-gene flow unit at " + now().strftime("%Y-%m-%d %H:%M"))
+		if self.ani_typestrains == "True":
+			logger.info("Using PyFastANI to compare " + prefix + " to B. cereus s.l. species type strain genomes at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		from .ani import Ani
+		get_ani = Ani(
+			taxon = self.taxa,
+			fasta = infile,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			cache_dir = self.cache_dir,
+			prescreen = self.ani_prescreen,
+			index = self.ani_index,
+			threads = threads,
+			timer = timer)
+
+		final_ani = get_ani.query_fastani(self.taxa, infile, final_results_directory, prefix, genome)
+
+		if self.ani_species == "True":
+			final_species = final_ani["species"]
+			logger.info("Finished species assignment of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+		else:
+			final_species = "(Species assignment not performed)"
+
+		if self.ani_subspecies == "True":
+			final_subspecies = final_ani["subspecies"]
+			logger.info("Finished subspecies assignment of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+		else:
+			final_subspecies = "(Subspecies assignment not performed)"
+
+		if self.ani_geneflow == "True":
+			final_geneflow = final_ani["geneflow"]
+			logger.info("Finished pseudo-gene flow unit assignment of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+		else:
+			final_geneflow = "(Pseudo-gene flow unit assignment not performed)"
+
+		if self.ani_typestrains == "True":
+			final_typestrains = final_ani["typestrains"]
+			logger.info("Finished B. cereus s.l. species type strain comparison of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+		else:
+			final_typestrains = "(Type strain-based taxonomic assignment not performed)"
+
+		return final_species, final_subspecies, final_geneflow, final_typestrains
+
+	def run_custom_ani(self, infile, prefix, threads = 1, genome = None, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+
+		# compare the genome to the user-supplied ANI database, if any
+		if self.ani_shards is None:
+			return None
+
+		logger.info("Using PyFastANI to compare " + prefix + " to the custom ANI database at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		from .ani import Ani
+		get_ani = Ani(
+			taxon = "custom",
+			fasta = infile,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			cache_dir = self.cache_dir,
+			threads = threads,
+			timer = timer)
+
+		final_custom = get_ani.query_custom(self.ani_shards, infile, final_results_directory, prefix, genome)
+		logger.info("Finished custom ANI database comparison of " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		return final_custom
+
+	@staticmethod
+	def share_threads(threads, stages):
+		# give every stage an equal share of the budget, and the remaining
+		# threads to the first stages
+		if not stages:
+			return {}
+		share, remainder = divmod(threads, len(stages))
+		return {
+			stage: max(1, share + (i < remainder))
+			for i, stage in enumerate(stages)
+		}
+
+	def genome_searches(self, infile, prefix, scratch, genome = None, timer = None):
+		now = datetime.datetime.now
+
+		# (query file, stage suffixes, hits found without blast) of each
+		# search of the genome
+		searches = {task: (query_path, suffixes, []) for task, (query_path, suffixes) in self.searches.items()}
+
+		# loci with an exact allele match and unambiguous panC hits don't need
+		# to be searched with blastn, their hits are passed on to the parsers
+		# as if found by blast
+		exact_hits = {}
+		if self.mlst == "True":
+			with timed(timer, "mlst_exact_alleles"):
+				exact_hits = self.allele_index.find_alleles(infile if genome is None else genome)
+			if exact_hits:
+				logger.info("Found exact allele matches for " + str(len(exact_hits)) + "/" + str(len(self.allele_index.loci)) + " seven-gene MLST loci in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+		panC_hits = None
+		if self.panC == "True":
+			with timed(timer, "panC_kmer_search"):
+				panC_hits = self.panC_index.find_panC(infile if genome is None else genome)
+			if panC_hits is not None:
+				logger.info("Found panC in " + prefix + " without blastn at " + now().strftime("%Y-%m-%d %H:%M"))
+		if not exact_hits and panC_hits is None:
+			return searches
+
+		queries = []
+		for suffix, fasta in self.queries["blastn"]:
+			if suffix == "mlst" and exact_hits:
+				loci = [locus for locus in self.allele_index.loci if locus not in exact_hits]
+				if not loci:
+					continue
+				fasta = os.path.join(scratch, "mlst_alleles.fasta")
+				self.allele_index.write_alleles(loci, fasta)
+			elif suffix == "panC" and panC_hits is not None:
+				continue
+			queries.append((suffix, fasta))
+
+		query_path = None
+		if queries:
+			query_path = os.path.join(scratch, "blastn_queries.fasta")
+			Blast.merge_queries(queries, query_path)
+		hits = list(itertools.chain.from_iterable(exact_hits.values()))
+		hits.extend(panC_hits or [])
+		searches["blastn"] = (query_path, searches["blastn"][1], hits)
+		return searches
+
+	def run_search(self, task, infile, prefix, threads, blastdb, search, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+		query_path, suffixes, hits = search
+
+		messages = {
+			"virulence": "potential virulence factors",
+			"bt": "potential Bt genes",
+			"mlst": "potential seven-gene MLST genes",
+			"panC": "panC",
+		}
+		if query_path is not None:
+			for suffix in suffixes:
+				logger.info("Using " + task + " to identify " + messages[suffix] + " in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		get_search = Blast(
+			task = task,
+			dbseqs = infile,
+			fasta = query_path,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			suffix = task,
+			pthresh = 0,
+			qthresh = 0,
+			overlap = self.overlap,
+			evalue = self.evalue,
+			threads = threads,
+			blastdb = blastdb)
+
+		# run a single search, and split the hits back to each stage as they
+		# are read from blast, after the hits found without blast
+		search_results = hits
+		if query_path is not None:
+			search_results = itertools.chain(hits, get_search.stream_blast(task, infile, query_path, self.evalue))
+		with timed(timer, "blast" if query_path is not None else "split_hits", task = task, stages = ",".join(suffixes), threads = threads):
+			return get_search.split_blast(search_results, final_results_directory, prefix, suffixes, self.blast_output)
+
+	def run_virulence(self, infile, prefix, vir, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+
+		# perform virulence-associated biovar assignment
+		if self.virulence != "True":
+			return ("(Virulence factor detection not performed)",) * 9
+
+		get_virulence = Blast(
+			task = self.vdb_task,
+			dbseqs = infile,
+			fasta = self.vdb_path,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			suffix = "virulence",
+			pthresh = self.vpthresh,
+			qthresh = self.vqthresh,
+			overlap = self.overlap,
+			evalue = self.evalue)
+
+		with timed(timer, "parse_virulence"):
+			virulence_final = get_virulence.parse_virulence(vir, self.vpthresh, self.vqthresh)
+
+		logger.info("Finished virulence factor detection in " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		return virulence_final
+
+	def run_bt(self, infile, prefix, bt_results, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+
+		# perform Thuringiensis biovar assignment
+		if self.bt != "True":
+			return "(Bt toxin gene detection not performed)"
+
+		get_bt = Blast(
+			task = "tblastn",
+			dbseqs = infile,
+			fasta = self.bt_path,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			suffix = "bt",
+			pthresh = self.bpthresh,
+			qthresh = self.bqthresh,
+			overlap = self.overlap,
+			evalue = self.evalue)
+
+		with timed(timer, "parse_bt"):
+			bt_final = get_bt.parse_bt(bt_results, self.bpthresh, self.bqthresh, self.overlap)
+
+		logger.info("Finished Bt toxin gene detection for " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		return bt_final
+
+	def run_mlst(self, infile, prefix, mlst_results, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+
+		# perform multi-locus sequence typing (MLST) using PubMLST's seven-gene scheme for Bacillus cereus
+		if self.mlst != "True":
+			return "(Seven-gene MLST not performed)"
+
+		get_mlst = Blast(
+			task = "blastn",
+			dbseqs = infile,
+			fasta = self.mlst_path,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			suffix = "mlst",
+			pthresh = 0,
+			qthresh = 0,
+			overlap = self.overlap,
+			evalue = self.evalue)
+
+		with timed(timer, "parse_mlst"):
+			mlst_alleles, perfect_matches = get_mlst.parse_mlst(mlst_results)
+
+		logger.info("Finished seven-gene MLST gene detection for " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		from .mlst import Mlst
+		get_st = Mlst(
+			alleles = mlst_alleles,
+			profiles = self.profiles,
+			perfect_matches = perfect_matches,
+			final_results_directory = final_results_directory,
+			prefix = prefix)
+
+		with timed(timer, "mlst_st"):
+			return get_st.at2st(mlst_alleles, self.profiles, perfect_matches, final_results_directory, prefix)
+
+	def run_panC(self, infile, prefix, panC_results, timer = None):
+		final_results_directory = self.final_results_directory
+		now = datetime.datetime.now
+
+		# perform panC phylogenetic group assignment using the adjusted, eight-group panC group assignment scheme
+		if self.panC != "True":
+			return "(panC group assignment not performed)"
+
+		get_panC = Blast(
+			task = "blastn",
+			dbseqs = infile,
+			fasta = self.panC_path,
+			final_results_directory = final_results_directory,
+			prefix = prefix,
+			suffix = "panC",
+			pthresh = 0,
+			qthresh = 0,
+			overlap = self.overlap,
+			evalue = self.evalue)
+
+		with timed(timer, "parse_panC"):
+			panC_final = get_panC.parse_panC(panC_results)
+		logger.info("Finished panC gene detection for " + prefix + " at " + now().strftime("%Y-%m-%d %H:%M"))
+
+		return panC_final
@@ -1,3 +1,5 @@
+import os
+
 class FinalResults:
 	"""
 	Print final results file
@@ -24,15 +26,29 @@ class FinalResults:
 		bt_final = list of Bt toxin genes detected in genome (bt produced by parse_bt)
 		mlst_final = list of prediced STs/clonal complexes (mlst_final produced by at2st)
 		panC_final = predicted panC group (panC_final produced by parse_panC)
+		custom = final_custom string output by query_custom in ani.py, or None if no custom ANI database was used (the column is then omitted)
 	output: 
 		prints final results file for query genome
+
+	format_final_results
+	purpose: format the final results of a genome without printing them
+	input:
+		same as print_final_results, without final_results_directory
+	output:
+		header and values of the final results line, as two lists of strings
+
+	get_final_results
+	purpose: format the final results stored in this object (see format_final_results)
+
+	as_dict
+	purpose: get the final results stored in this object as a dictionary mapping each final results column (without the leading #) to its value
 		
 	"""
 
-	def __init__(self, final_results_directory, infile, prefix, species, subspecies, geneflow, typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final):
+	def __init__(self, final_results_directory, infile, prefix, species, subspecies, geneflow, typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final, custom = None):
 
 		self.final_results_directory = final_results_directory
-		self.infile = infile,
+		self.infile = infile
 		self.prefix = prefix
 		self.species = species
 		self.subspecies = subspecies
@@ -50,8 +66,34 @@ class FinalResults:
 		self.bt_final = bt_final
 		self.mlst_final = mlst_final
 		self.panC_final = panC_final
+		self.custom = custom
+
+	def print_final_results(self, final_results_directory, infile, prefix, species, subspecies, geneflow, typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final, custom = None):
+
+		header, final_line = self.format_final_results(infile, prefix, species, subspecies, geneflow, typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final, custom)
+
+		# results of later runs are appended to the file, under the same header
+		final_results_file = final_results_directory + prefix + "_final_results.txt"
+		previous_header = None
+		if os.path.exists(final_results_file):
+			with open(final_results_file) as infile:
+				previous_header = infile.readline().rstrip("\n")
 
-	def print_final_results(self, final_results_directory, infile, prefix, species, subspecies, geneflow, typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final):
+		with open(final_results_file, "a") as outfile:
+			if previous_header != "\t".join(header):
+				print("\t".join(header), file = outfile)
+			print("\t".join(final_line), file = outfile)
+
+	def get_final_results(self):
+
+		return self.format_final_results(self.infile, self.prefix, self.species, self.subspecies, self.geneflow, self.typestrains, self.anthracis, self.emetic, self.nhe, self.hbl, self.cytK, self.sph, self.cap, self.has, self.bps, self.bt_final, self.mlst_final, self.panC_final, self.custom)
+
+	def as_dict(self):
+
+		header, final_line = self.get_final_results()
+		return dict(zip([column.lstrip("#") for column in header], final_line))
+
+	def format_final_results(self, infile, prefix, species, subspecies, geneflow, typestrains, anthracis, emetic, nhe, hbl, cytK, sph, cap, has, bps, bt_final, mlst_final, panC_final, custom = None):
 
 		header = ["#filename", "prefix", "species(ANI)", "subspecies(ANI)", "Pseudo_Gene_Flow_Unit(ANI)", "Closest_Type_Strain(ANI)", "anthrax_toxin(genes)", "emetic_toxin_cereulide(genes)", "diarrheal_toxin_Nhe(genes)", "diarrheal_toxin_Hbl(genes)", "diarrheal_toxin_CytK(top_hit)", "sphingomyelinase_Sph(gene)", "capsule_Cap(genes)", "capsule_Has(genes)", "capsule_Bps(genes)", "Bt(genes)", "PubMLST_ST[clonal_complex](perfect_matches)", "Adjusted_panC_Group(predicted_species)", "final_taxon_names"]
 
@@ -131,6 +173,9 @@ class FinalResults:
 
 		final_line = [infile, prefix, species, subspecies, geneflow, typestrains, Anthracis, Emeticus, Nhe, Hbl, CytK, Sph, Cap, Has, Bps, Thuringiensis, mlst_final, panC_final, final_taxon]
 
-		with open(final_results_directory + prefix + "_final_results.txt", "a") as outfile:
-			print("\t".join(header), file = outfile)
-			print("\t".join(final_line), file = outfile)
+		# the custom ANI database column is only reported when one was used
+		if custom is not None:
+			header.insert(6, "Custom_Database(ANI)")
+			final_line.insert(6, custom)
+
+		return header, final_line
@@ -0,0 +1,197 @@
+import json
+import re
+import sys
+
+from .typer import COLUMNS, TypingResult
+
+# output formats of ResultsWriter, and the extension of their files
+FORMATS = {"tsv": ".txt", "jsonl": ".jsonl", "parquet": ".parquet"}
+
+# columns holding an ANI assignment, e.g., "toyonensis(96.16)"
+ANI_COLUMNS = ("species", "subspecies", "geneflow", "typestrains", "custom")
+
+# columns holding a number of detected genes, e.g., "2/3(cya;pagA)" or "3(Cry1Aa1;Cry2Aa1;Cyt1Aa1)"
+GENE_COLUMNS = ("anthrax_toxin", "emetic_toxin", "nhe", "hbl", "cytK", "sph", "cap", "has", "bps", "bt")
+
+_ANI = re.compile(r"^(.*)\(([0-9.]+(?:[eE][-+]?[0-9]+)?)\)$")
+_GENE_COUNT = re.compile(r"^([0-9]+)[/(]")
+_ST = re.compile(r"^([0-9]+)\[([^\]]*)\]\(([0-9]+)/7\)$")
+
+
+def typed_schema(custom = False):
+	"""
+	get the columns of the typed results, as (column, type) pairs
+
+	ANI assignments are split into the assigned name (with a * if the ANI value
+	is below the threshold) and the ANI value, gene columns get the number of
+	detected genes, and MLST gets the ST, the clonal complex and the number of
+	perfect allele matches, when a single ST was assigned. Types are "string",
+	"float64" or "int64"; values that don't apply (e.g., stages that were not
+	performed) are null.
+
+	input:
+		custom = whether the results include the custom ANI database column
+	output:
+		list of (column, type) pairs
+	"""
+	schema = []
+	for attribute, _ in COLUMNS:
+		if attribute == "custom" and not custom:
+			continue
+		schema.append((attribute, "string"))
+		if attribute in ANI_COLUMNS:
+			schema.append((attribute + "_ani", "float64"))
+		elif attribute in GENE_COLUMNS:
+			schema.append((attribute + "_count", "int64"))
+		elif attribute == "mlst":
+			schema.extend([("st", "int64"), ("clonal_complex", "string"), ("mlst_perfect_matches", "int64")])
+	return schema
+
+
+def typed_row(result, custom = False):
+	"""
+	convert the results of a genome to typed values (see typed_schema)
+
+	input:
+		result = TypingResult of the genome
+		custom = whether the results include the custom ANI database column
+	output:
+		dictionary mapping each column of the typed schema to its value
+	"""
+	row = {}
+	for attribute, _ in COLUMNS:
+		if attribute == "custom" and not custom:
+			continue
+		value = getattr(result, attribute)
+		if attribute in ANI_COLUMNS:
+			match = _ANI.match(value or "")
+			row[attribute] = match.group(1) if match else value
+			row[attribute + "_ani"] = float(match.group(2)) if match else None
+		elif attribute in GENE_COLUMNS:
+			match = _GENE_COUNT.match(value or "")
+			row[attribute] = value
+			row[attribute + "_count"] = int(match.group(1)) if match else None
+		elif attribute == "mlst":
+			match = _ST.match(value or "")
+			row[attribute] = value
+			row["st"] = int(match.group(1)) if match else None
+			row["clonal_complex"] = match.group(2) if match else None
+			row["mlst_perfect_matches"] = int(match.group(3)) if match else None
+		else:
+			row[attribute] = value
+	return row
+
+
+class ResultsWriter:
+	"""
+	Write the final results of many genomes to a single results file
+
+	The file has a single header, and rows are written through a buffer
+	rather than flushed one by one. Three formats are supported:
+		tsv = the final results columns, as in the final results file of a single genome
+		jsonl = one JSON object per genome, with typed values (see typed_schema); can be streamed to the standard output
+		parquet = typed columns (see typed_schema), written in row groups; requires pyarrow (pip install btyper3[parquet])
+
+	The writer is a context manager, and closes the file on exit. Whether the
+	custom ANI database column is written is decided by the first result.
+
+	input:
+		path = path to the results file, or "-" to write to the standard output (tsv and jsonl only)
+		format = "tsv", "jsonl", or "parquet"
+
+	write
+	purpose: write the results of a genome
+	input:
+		result = TypingResult (see typer.TypingResult) or FinalResults of the genome
+
+	close
+	purpose: write the buffered rows and close the results file
+
+	"""
+
+	# size of the output buffer of text formats, and number of rows per
+	# Parquet row group
+	buffer_size = 1 << 20
+	row_group_size = 10000
+
+	def __init__(self, path, format = "tsv"):
+		if format not in FORMATS:
+			raise ValueError("Unknown results format {!r}, expected one of {}".format(format, ", ".join(FORMATS)))
+		if format == "parquet" and path == "-":
+			raise ValueError("Parquet results can't be written to the standard output")
+
+		self.path = path
+		self.format = format
+		self.custom = None
+		self.rows = []
+		self.handle = None
+		self.parquet = None
+		self.closed = False
+
+		if format == "parquet":
+			try:
+				import pyarrow
+				import pyarrow.parquet
+			except ImportError:
+				raise ImportError("pyarrow is required to write Parquet results, install it with `pip install btyper3[parquet]`") from None
+			self.pyarrow = pyarrow
+		elif path == "-":
+			self.handle = sys.stdout
+		else:
+			self.handle = open(path, "w", buffering = self.buffer_size)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
+
+	def write(self, result):
+		if not isinstance(result, TypingResult):
+			result = TypingResult.from_final_results(result)
+
+		# the columns are set by the first result
+		first = self.custom is None
+		if first:
+			self.custom = result.custom is not None
+
+		if self.format == "tsv":
+			columns = [(attribute, column) for attribute, column in COLUMNS if attribute != "custom" or self.custom]
+			if first:
+				print("\t".join(column for _, column in columns), file = self.handle)
+			print("\t".join(str(getattr(result, attribute)) for attribute, _ in columns), file = self.handle)
+		elif self.format == "jsonl":
+			print(json.dumps(typed_row(result, self.custom)), file = self.handle)
+		else:
+			self.rows.append(typed_row(result, self.custom))
+			if len(self.rows) >= self.row_group_size:
+				self.write_row_group()
+
+		# rows are streamed to the standard output as soon as they are typed
+		if self.handle is sys.stdout:
+			self.handle.flush()
+
+	def write_row_group(self):
+		pa = self.pyarrow
+		types = {"string": pa.string(), "float64": pa.float64(), "int64": pa.int64()}
+		schema = pa.schema([(column, types[kind]) for column, kind in typed_schema(bool(self.custom))])
+		if self.parquet is None:
+			self.parquet = pa.parquet.ParquetWriter(self.path, schema)
+		table = pa.Table.from_pydict({column: [row[column] for row in self.rows] for column in schema.names}, schema = schema)
+		self.parquet.write_table(table)
+		self.rows = []
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		if self.format == "parquet":
+			if self.rows or self.parquet is None:
+				self.write_row_group()
+			self.parquet.close()
+		elif self.handle is sys.stdout:
+			self.handle.flush()
+		elif self.handle is not None:
+			self.handle.close()
+		self.handle = None
@@ -0,0 +1,234 @@
+import concurrent.futures
+import contextlib
+import http.server
+import json
+import logging
+import os
+import queue
+import re
+import socketserver
+import tempfile
+import threading
+import urllib.parse
+
+from . import __version__
+from .pipeline import genome_prefix
+
+logger = logging.getLogger(__name__)
+
+# maximum size of a genome uploaded in the body of a request
+MAX_UPLOAD_SIZE = 1 << 30
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+
+	server_version = "BTyper3/" + __version__
+
+	def address_string(self):
+		# clients of a Unix socket have no address
+		if isinstance(self.client_address, tuple) and self.client_address:
+			return str(self.client_address[0])
+		return "unix"
+
+	def log_message(self, format, *args):
+		logger.debug("%s - %s", self.address_string(), format % args)
+
+	def send_json(self, status, body):
+		data = json.dumps(body).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		if status == 503:
+			self.send_header("Retry-After", "1")
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		url = urllib.parse.urlsplit(self.path)
+		if url.path != "/status":
+			return self.send_json(404, {"error": "Unknown endpoint {!r}".format(url.path)})
+		self.send_json(200, self.server.typing_server.status())
+
+	def do_POST(self):
+		url = urllib.parse.urlsplit(self.path)
+		if url.path != "/type":
+			return self.send_json(404, {"error": "Unknown endpoint {!r}".format(url.path)})
+		try:
+			job = self.read_job(url)
+		except ValueError as err:
+			return self.send_json(400, {"error": str(err)})
+
+		try:
+			future = self.server.typing_server.submit(*job)
+		except queue.Full:
+			return self.send_json(503, {"error": "Typing queue is full, retry later"})
+
+		try:
+			results = future.result()
+		except Exception as err:
+			logger.exception("Typing of " + job[0] + " failed")
+			return self.send_json(500, {"error": "{}: {}".format(type(err).__name__, err)})
+		self.send_json(200, results)
+
+	def read_job(self, url):
+		# a job is either a JSON object giving the path to a genome readable
+		# by the server, or a genome uploaded in FASTA format
+		length = int(self.headers.get("Content-Length") or 0)
+		if length <= 0:
+			raise ValueError("Empty request body")
+		if length > MAX_UPLOAD_SIZE:
+			raise ValueError("Request body larger than {} bytes".format(MAX_UPLOAD_SIZE))
+		body = self.rfile.read(length)
+
+		if body.lstrip().startswith(b">"):
+			params = urllib.parse.parse_qs(url.query)
+			name = params.get("name", ["genome.fasta"])[0]
+			name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(name)) or "genome.fasta"
+			if "." not in name:
+				name += ".fasta"
+			return (name, body)
+
+		try:
+			request = json.loads(body)
+		except ValueError:
+			raise ValueError("Request body is neither a FASTA file nor a JSON object")
+		if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+			raise ValueError("JSON request has no \"path\" to a genome")
+		if not os.path.isfile(request["path"]):
+			raise ValueError("No such file: {!r}".format(request["path"]))
+		return (request["path"], None)
+
+
+class TypingServer:
+	"""
+	Serve BTyper3 typing jobs from a long-running process, with the databases loaded once
+
+	The server holds a loaded Pipeline (ANI index, PubMLST profiles, allele and
+	panC indexes, and database paths), and types genomes with it in a pool of
+	worker threads. Requests are accepted concurrently over HTTP, on a local
+	TCP port or a Unix socket, and wait in a bounded queue for a worker; when
+	the queue is full, requests are rejected with HTTP status 503 so that
+	clients can retry later. The intermediate results of each request are
+	written under a unique prefix, made of the file name of the genome and a
+	request id (e.g., assembly_k2x8l1ab), which is returned in the prefix
+	column of the results.
+
+	API:
+		POST /type with a JSON body {"path": "/path/to/genome.fasta"} types a genome readable by the server; POST /type?name=<file name> with a FASTA body types an uploaded genome. Both return the final results of the genome as a JSON object mapping each final results column to its value.
+		GET /status returns the version of BTyper3, the number of workers and the number of queued jobs.
+
+	input:
+		pipeline = loaded Pipeline (see pipeline.Pipeline)
+		workers = number of genomes typed concurrently
+		queue_size = maximum number of jobs waiting for a worker
+
+	submit
+	purpose: queue a typing job
+	input:
+		name = path to the genome, or file name of an uploaded genome
+		data = content of an uploaded genome in FASTA format, or None to read the genome from name
+	output:
+		concurrent.futures.Future resolved with the final results of the genome as a dictionary; raises queue.Full if the queue is full
+
+	serve
+	purpose: accept requests until the server is shut down
+	input:
+		host, port = address to listen on (ignored when socket_path is given)
+		socket_path = path to a Unix socket to listen on
+
+	shutdown
+	purpose: stop accepting requests and stop the workers once the queued jobs are done
+
+	"""
+
+	def __init__(self, pipeline, workers = 1, queue_size = 16):
+		self.pipeline = pipeline
+		self.workers = max(1, int(workers))
+		self.queue_size = max(1, int(queue_size))
+		self.jobs = queue.Queue(self.queue_size)
+		self.httpd = None
+		self.threads = [threading.Thread(target = self.work, name = "btyper3-worker-{}".format(i), daemon = True) for i in range(self.workers)]
+		for thread in self.threads:
+			thread.start()
+
+	def status(self):
+		return {"version": __version__, "workers": self.workers, "queue_size": self.queue_size, "queued": self.jobs.qsize()}
+
+	def submit(self, name, data = None):
+		future = concurrent.futures.Future()
+		self.jobs.put_nowait((future, name, data))
+		return future
+
+	def work(self):
+		while True:
+			job = self.jobs.get()
+			if job is None:
+				return
+			future, name, data = job
+			if future.set_running_or_notify_cancel():
+				try:
+					future.set_result(self.type_genome(name, data))
+				except BaseException as err:
+					future.set_exception(err)
+
+	def type_genome(self, name, data):
+		# each request gets its own directory in the scratch directory of the
+		# run, whose unique name is appended to the prefix of the output files
+		# of the genome, since concurrent requests often type genomes with the
+		# same file name (e.g., assembly.fasta)
+		directory = tempfile.mkdtemp(prefix = "request_", dir = self.pipeline.scratch_directory)
+		prefix = "{}_{}".format(genome_prefix(name), os.path.basename(directory)[len("request_"):])
+		infile = None
+		try:
+			if data is None:
+				return self.pipeline.type_genome(name, prefix = prefix).as_dict()
+
+			# uploaded genomes are written to the request directory
+			infile = os.path.join(directory, name)
+			with open(infile, "wb") as handle:
+				handle.write(data)
+			results = self.pipeline.type_genome(infile, prefix = prefix).as_dict()
+			results["filename"] = name
+			return results
+		finally:
+			if infile is not None:
+				with contextlib.suppress(OSError):
+					os.remove(infile)
+			with contextlib.suppress(OSError):
+				os.rmdir(directory)
+
+	def serve(self, host = "127.0.0.1", port = 8765, socket_path = None):
+		if socket_path is not None:
+			# replace the socket left by a previous server
+			if os.path.exists(socket_path) and not os.path.isfile(socket_path):
+				os.remove(socket_path)
+			self.httpd = _UnixHTTPServer(socket_path, _RequestHandler)
+			address = socket_path
+		else:
+			self.httpd = http.server.ThreadingHTTPServer((host, int(port)), _RequestHandler)
+			address = "http://{}:{}".format(*self.httpd.server_address[:2])
+		self.httpd.typing_server = self
+
+		logger.info("BTyper3 is serving typing requests on " + address + " with " + str(self.workers) + " worker(s)")
+		try:
+			self.httpd.serve_forever()
+		finally:
+			self.httpd.server_close()
+			if socket_path is not None:
+				with contextlib.suppress(OSError):
+					os.remove(socket_path)
+			self.stop_workers()
+
+	def shutdown(self):
+		if self.httpd is not None:
+			self.httpd.shutdown()
+
+	def stop_workers(self):
+		for thread in self.threads:
+			self.jobs.put(None)
+		for thread in self.threads:
+			thread.join()
@@ -0,0 +1,179 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+try:
+	import resource
+except ImportError:
+	# not available on Windows, where memory and child process usage are not recorded
+	resource = None
+
+logger = logging.getLogger(__name__)
+
+# characters replaced in the file names of profile dumps
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.,-]")
+
+
+def _rusage():
+	if resource is None:
+		return None
+	# ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+	scale = 1 if sys.platform == "darwin" else 1024
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return usage.ru_maxrss * scale, children.ru_utime, children.ru_stime, children.ru_maxrss * scale
+
+
+def timed(timer, stage, **details):
+	"""
+	time a stage with a StageTimer, or do nothing if no timer is given (see StageTimer.stage)
+	"""
+	if timer is None:
+		return contextlib.nullcontext()
+	return timer.stage(stage, **details)
+
+
+class StageTimer:
+	"""
+	Record the wall time, CPU time, peak memory and child process resource usage of typing stages
+
+	Each stage gets one record, with:
+		stage = name of the stage (e.g., ani_query, makeblastdb, blast, parse_mlst), and details such as the blast program
+		start = start of the stage, in seconds since the timer was created
+		wall = wall time of the stage, in seconds
+		cpu = CPU time of the thread running the stage, in seconds (excludes the threads started by PyFastANI)
+		process_cpu = CPU time of the whole process during the stage, in seconds
+		peak_rss = peak resident set size of the process at the end of the stage, in bytes
+		children_user, children_system = CPU time of the child processes (e.g., blast) that exited during the stage, in seconds
+		children_peak_rss = peak resident set size of the largest child process so far, in bytes
+
+	Stages of a genome may run concurrently in threads, in which case the
+	process-wide values (process_cpu and children usage) of overlapping stages
+	include each other. Memory and child process usage are not recorded on
+	platforms without the resource module.
+
+	With a profile directory, each stage that is not nested in another stage
+	of the same thread is also profiled with cProfile, and its statistics are
+	dumped to <profile directory>/<prefix>_<stage>_<details>_<unique id>.prof
+	(e.g., query_blast_tblastn_virulence,bt_1_x8k2l1ab.prof), to be read with
+	pstats or snakeviz. The unique id keeps stages that run several times
+	(e.g., one blast search per program) and genomes sharing a prefix from
+	overwriting each other; the path of the dump is stored in the record of
+	the stage as profile.
+
+	input:
+		prefix = prefix of the genome, or of the run for database loading stages
+		profile_directory = directory where cProfile dumps are written, or None to not profile stages
+
+	stage
+	purpose: context manager recording a stage
+	input:
+		stage = name of the stage
+		details = additional values stored in the record (e.g., task = "blastn")
+
+	write
+	purpose: write the records to a JSON file
+	input:
+		path = path to the JSON file
+		extra = additional values stored in the file (e.g., path of the genome)
+
+	"""
+
+	def __init__(self, prefix, profile_directory = None):
+		self.prefix = prefix
+		self.profile_directory = profile_directory
+		self.started = time.perf_counter()
+		self.records = []
+		self.lock = threading.Lock()
+		self.local = threading.local()
+
+	@contextlib.contextmanager
+	def stage(self, stage, **details):
+		profiler = None
+		depth = getattr(self.local, "depth", 0)
+		if self.profile_directory is not None and depth == 0:
+			import cProfile
+			profiler = cProfile.Profile()
+			try:
+				profiler.enable()
+			except ValueError:
+				# Python >= 3.12 can't profile concurrent threads
+				logger.debug("Could not profile stage " + stage + " of " + self.prefix + ", another stage is being profiled")
+				profiler = None
+
+		self.local.depth = depth + 1
+		usage = _rusage()
+		start = time.perf_counter()
+		cpu = time.thread_time()
+		process_cpu = time.process_time()
+		try:
+			yield
+		finally:
+			record = dict(stage = stage, **details)
+			record["start"] = round(start - self.started, 6)
+			record["wall"] = round(time.perf_counter() - start, 6)
+			record["cpu"] = round(time.thread_time() - cpu, 6)
+			record["process_cpu"] = round(time.process_time() - process_cpu, 6)
+			if usage is not None:
+				end = _rusage()
+				record["peak_rss"] = end[0]
+				record["children_user"] = round(end[1] - usage[1], 6)
+				record["children_system"] = round(end[2] - usage[2], 6)
+				record["children_peak_rss"] = end[3]
+			self.local.depth = depth
+
+			if profiler is not None:
+				profiler.disable()
+				os.makedirs(self.profile_directory, exist_ok = True)
+				name = "_".join([self.prefix, stage] + [str(value) for value in details.values()])
+				fd, path = tempfile.mkstemp(prefix = _UNSAFE.sub("_", name) + "_", suffix = ".prof", dir = self.profile_directory)
+				os.close(fd)
+				profiler.dump_stats(path)
+				record["profile"] = path
+
+			with self.lock:
+				self.records.append(record)
+
+	def elapsed(self):
+		return round(time.perf_counter() - self.started, 6)
+
+	def write(self, path, **extra):
+		os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+		with open(path, "w") as handle:
+			json.dump(dict(prefix = self.prefix, wall = self.elapsed(), **extra, stages = self.records), handle, indent = 1)
+
+
+def summarize(genomes, load = None):
+	"""
+	summarize the stage records of the genomes of a batch
+
+	input:
+		genomes = list of stage records of each genome (see StageTimer)
+		load = stage records of the database loading stages of the run (optional)
+	output:
+		dictionary with the number of genomes, the loading stages, and for each stage the number of records and the total, mean and maximum wall time, the total CPU time, the total child process CPU time and the maximum peak resident set size
+	"""
+	stages = {}
+	for records in genomes:
+		for record in records:
+			stages.setdefault(record["stage"], []).append(record)
+
+	summary = {}
+	for stage, records in stages.items():
+		walls = [record["wall"] for record in records]
+		summary[stage] = {
+			"count": len(records),
+			"wall_total": round(sum(walls), 6),
+			"wall_mean": round(sum(walls) / len(walls), 6),
+			"wall_max": max(walls),
+			"cpu_total": round(sum(record["cpu"] for record in records), 6),
+			"children_cpu_total": round(sum(record.get("children_user", 0) + record.get("children_system", 0) for record in records), 6),
+			"peak_rss_max": max(record.get("peak_rss", 0) for record in records),
+		}
+	return {"genomes": len(genomes), "load": load or [], "stages": summary}
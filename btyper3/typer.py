@@ -0,0 +1,193 @@
+import argparse
+import contextlib
+import dataclasses
+import os
+import re
+import tempfile
+import typing
+
+from .fasta import Genome
+
+# attribute of TypingResult holding each final results column
+COLUMNS = (
+	("filename", "#filename"),
+	("prefix", "prefix"),
+	("species", "species(ANI)"),
+	("subspecies", "subspecies(ANI)"),
+	("geneflow", "Pseudo_Gene_Flow_Unit(ANI)"),
+	("typestrains", "Closest_Type_Strain(ANI)"),
+	("custom", "Custom_Database(ANI)"),
+	("anthrax_toxin", "anthrax_toxin(genes)"),
+	("emetic_toxin", "emetic_toxin_cereulide(genes)"),
+	("nhe", "diarrheal_toxin_Nhe(genes)"),
+	("hbl", "diarrheal_toxin_Hbl(genes)"),
+	("cytK", "diarrheal_toxin_CytK(top_hit)"),
+	("sph", "sphingomyelinase_Sph(gene)"),
+	("cap", "capsule_Cap(genes)"),
+	("has", "capsule_Has(genes)"),
+	("bps", "capsule_Bps(genes)"),
+	("bt", "Bt(genes)"),
+	("mlst", "PubMLST_ST[clonal_complex](perfect_matches)"),
+	("panC", "Adjusted_panC_Group(predicted_species)"),
+	("final_taxon_names", "final_taxon_names"),
+)
+
+
+@dataclasses.dataclass(frozen = True)
+class TypingResult:
+	"""
+	Final results of a genome, with one attribute per final results column
+
+	Values are formatted as in the final results file (e.g., "toyonensis(96.16)"
+	for species). custom is None when no custom ANI database was used.
+
+	from_final_results
+	purpose: build the result of a genome from its FinalResults
+	input:
+		final_results = FinalResults returned by Pipeline.type_genome
+	output:
+		TypingResult
+
+	as_dict
+	purpose: get the final results as a dictionary mapping each final results column (without the leading #) to its value
+	"""
+
+	filename: str
+	prefix: str
+	species: str
+	subspecies: str
+	geneflow: str
+	typestrains: str
+	custom: typing.Optional[str]
+	anthrax_toxin: str
+	emetic_toxin: str
+	nhe: str
+	hbl: str
+	cytK: str
+	sph: str
+	cap: str
+	has: str
+	bps: str
+	bt: str
+	mlst: str
+	panC: str
+	final_taxon_names: str
+
+	@classmethod
+	def from_final_results(cls, final_results):
+		header, final_line = final_results.get_final_results()
+		values = dict(zip(header, final_line))
+		return cls(**{attribute: values.get(column) for attribute, column in COLUMNS})
+
+	def as_dict(self):
+		return {
+			column.lstrip("#"): getattr(self, attribute)
+			for attribute, column in COLUMNS
+			if attribute != "custom" or self.custom is not None
+		}
+
+
+class Typer:
+	"""
+	Type genomes from Python, with the databases loaded once for all genomes
+
+	The typer loads the databases when it is created (see pipeline.Pipeline),
+	and reuses them for every call to type_genome, so that typing many genomes
+	in one process adds no per-genome setup cost. Intermediate results (raw
+	FastANI and blast results) are only written when an output directory is
+	given. BTyper3 logs to the "btyper3" logger, which is left for the
+	application to configure.
+
+	The typer is a context manager, and releases the databases and its scratch
+	directory on exit (or with close).
+
+	input:
+		output = directory where the intermediate results of each genome are written, or None to not write any file
+		options = typing options, named as the command line options (e.g., ani_geneflow = True, virulence_db = "nuc", threads = 4); True/False values can be given as booleans
+
+	type_genome
+	purpose: run all selected typing methods on a genome
+	input:
+		genome = path to the genome in FASTA format, a Genome (see fasta.read_fasta), a dictionary mapping contig names to sequences, or a list of (contig name, sequence) pairs; sequences can be str or bytes
+		name = file name of the genome reported in the results, for genomes not read from a file (default: genome.fasta)
+	output:
+		TypingResult
+
+	close
+	purpose: release the databases and remove the scratch directory
+
+	"""
+
+	def __init__(self, output = None, **options):
+
+		# local import, to avoid a circular import with the package
+		from . import add_typing_arguments
+		from .pipeline import Pipeline
+
+		# start from the defaults of the command line
+		parser = argparse.ArgumentParser()
+		add_typing_arguments(parser)
+		args = parser.parse_args([])
+		for option, value in options.items():
+			if not hasattr(args, option):
+				raise TypeError("Unknown typing option {!r}".format(option))
+			if isinstance(value, bool):
+				value = str(value)
+			setattr(args, option, value)
+
+		final_results_directory = None
+		if output is not None:
+			final_results_directory = os.path.join(output, "btyper3_final_results", "")
+			os.makedirs(final_results_directory, exist_ok = True)
+
+		self.pipeline = Pipeline(args, final_results_directory)
+		self.pipeline.__enter__()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
+
+	def close(self):
+		if self.pipeline is not None:
+			self.pipeline.__exit__(None, None, None)
+			self.pipeline = None
+
+	def type_genome(self, genome, name = None):
+		if self.pipeline is None:
+			raise ValueError("Typer is closed")
+
+		if isinstance(genome, (str, bytes, os.PathLike)):
+			return TypingResult.from_final_results(self.pipeline.type_genome(os.fsdecode(genome)))
+
+		# in-memory genomes are written to the scratch directory, since blast
+		# reads the genome from a file
+		if not isinstance(genome, Genome):
+			if isinstance(genome, dict):
+				genome = genome.items()
+			ids, sequences = [], []
+			for contig, seq in genome:
+				ids.append(str(contig))
+				sequences.append((seq.encode("ascii") if isinstance(seq, str) else bytes(seq)).upper())
+			genome = Genome(None, ids, sequences)
+
+		name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(name or "genome.fasta"))
+		if "." not in name:
+			name += ".fasta"
+		directory = tempfile.mkdtemp(prefix = "genome_", dir = self.pipeline.scratch_directory)
+		infile = os.path.join(directory, name)
+		try:
+			with open(infile, "wb") as handle:
+				for contig, seq in genome:
+					handle.write(b">" + contig.encode("utf-8") + b"\n" + seq + b"\n")
+			final_results = self.pipeline.type_genome(infile, genome)
+		finally:
+			with contextlib.suppress(OSError):
+				os.remove(infile)
+			with contextlib.suppress(OSError):
+				os.rmdir(directory)
+
+		final_results.infile = name
+		return TypingResult.from_final_results(final_results)
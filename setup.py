@@ -4,6 +4,7 @@ import collections
 import csv
 import datetime
 import gzip
+import importlib
 import os
 import shutil
 import sys
@@ -28,10 +29,12 @@ class build_py(_build_py):
         # download NCBI PubMLST database
         self.download_pubmlst(btyper3_path)
 
-        # download genome files for each databases
+        # download genome files for each databases, and pack them into a
+        # single memory-mappable file per database
         for subset in ("species", "subspecies", "geneflow", "typestrains"):
             db = os.path.join(btyper3_path, "seq_ani_db", subset, "{}.tsv".format(subset))
             self.download_genomes(btyper3_path, db, subset)
+            self.pack_genomes(btyper3_path, db, subset)
 
     def download(self, url, dest, append=False, decompress=False):
         print("downloading {!r} to {!r}".format(url, dest))
@@ -65,7 +68,7 @@ class build_py(_build_py):
             elif "profiles_csv" in url:
                 self.download(url, os.path.join(btyper3_path, "seq_mlst_db", "bcereus.txt"))
 
-    def download_genomes(self, btyper3_path, genome_list, ani_directory):
+    def read_genome_list(self, genome_list):
         with open(genome_list) as genomes:
             reader = csv.reader(genomes, dialect="excel-tab")
 
@@ -73,10 +76,49 @@ class build_py(_build_py):
             id_col = header.index("id")
             url_col = header.index("url")
 
-            for row in reader:
-                gfile = os.path.join(btyper3_path, "seq_ani_db", ani_directory, row[id_col])
-                if not os.path.isfile(gfile):
-                    self.download(url=row[url_col], dest=gfile)
+            return [(row[id_col], row[url_col]) for row in reader]
+
+    def import_build_module(self, name):
+        # modules are imported from the build directory, since the package
+        # may not be installed yet
+        sys.path.insert(0, self.build_lib)
+        try:
+            return importlib.import_module(name)
+        finally:
+            sys.path.remove(self.build_lib)
+
+    def is_packed(self, btyper3_path, genome_list, ani_directory):
+        pack = self.import_build_module("btyper3.pack")
+        path = os.path.join(btyper3_path, "seq_ani_db", ani_directory, pack.PACK_NAME)
+        if not os.path.isfile(path):
+            return False
+        genome_ids = set(genome_id for genome_id, _ in self.read_genome_list(genome_list))
+        return genome_ids <= set(pack.ReferencePack(path).genomes)
+
+    def download_genomes(self, btyper3_path, genome_list, ani_directory):
+        if self.is_packed(btyper3_path, genome_list, ani_directory):
+            return
+        for genome_id, url in self.read_genome_list(genome_list):
+            gfile = os.path.join(btyper3_path, "seq_ani_db", ani_directory, genome_id)
+            if not os.path.isfile(gfile):
+                self.download(url=url, dest=gfile)
+
+    def pack_genomes(self, btyper3_path, genome_list, ani_directory):
+        if self.is_packed(btyper3_path, genome_list, ani_directory):
+            return
+        fasta = self.import_build_module("btyper3.fasta")
+        pack = self.import_build_module("btyper3.pack")
+
+        directory = os.path.join(btyper3_path, "seq_ani_db", ani_directory)
+        dest = os.path.join(directory, pack.PACK_NAME)
+        genome_ids = [genome_id for genome_id, _ in self.read_genome_list(genome_list)]
+        paths = [os.path.join(directory, genome_id) for genome_id in genome_ids]
+        print("packing {} genomes to {!r}".format(len(genome_ids), dest))
+        pack.write_pack(dest, ((genome_id, fasta.read_fasta(path), pack.file_sha256(path)) for genome_id, path in zip(genome_ids, paths)))
+
+        # the genomes are only read from the pack at runtime
+        for path in paths:
+            os.remove(path)
 
 
 setuptools.setup(cmdclass={"build_py": build_py})
@@ -0,0 +1,59 @@
+import os
+import stat
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+# stand-ins for BLAST+: makeblastdb reports its progress on the standard
+# output like the real one, and records the genome it was run on in
+# makeblastdb.calls; the searches find no hits
+MAKEBLASTDB = """#!{python}
+import os, sys
+args = sys.argv[1:]
+out = args[args.index("-out") + 1] if "-out" in args else args[args.index("-in") + 1]
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "makeblastdb.calls"), "a") as calls:
+	calls.write(os.path.basename(args[args.index("-in") + 1]) + "\\n")
+print("Building a new DB, current time: 01/01/2024 00:00:00")
+print("New DB name:   " + out)
+for ext in ("nsq", "nin", "nhr"):
+	open(out + "." + ext, "w").close()
+"""
+
+SEARCH = """#!{python}
+import sys
+args = sys.argv[1:]
+if "-out" in args:
+	open(args[args.index("-out") + 1], "w").close()
+"""
+
+
+# typing options of runs only assigning the panC group, with the database
+# shipped in the repository
+PANC_ONLY = ["--ani_species", "False", "--ani_subspecies", "False", "--ani_geneflow", "False", "--ani_typestrains", "False", "--virulence", "False", "--bt", "False", "--mlst", "False"]
+
+
+@pytest.fixture
+def fake_blast(tmp_path, monkeypatch):
+	bin_directory = tmp_path / "bin"
+	bin_directory.mkdir()
+	for name, script in [("makeblastdb", MAKEBLASTDB), ("blastn", SEARCH), ("tblastn", SEARCH)]:
+		path = bin_directory / name
+		path.write_text(script.format(python = sys.executable))
+		path.chmod(path.stat().st_mode | stat.S_IXUSR)
+	monkeypatch.setenv("PATH", str(bin_directory) + os.pathsep + os.environ["PATH"])
+	return bin_directory
+
+
+def random_genome(path, lengths, seed = 0):
+	rng = np.random.default_rng(seed)
+	with open(path, "w") as handle:
+		for i, length in enumerate(lengths):
+			handle.write(">contig_{}\n{}\n".format(i + 1, rng.choice(np.frombuffer(b"ACGT", dtype = np.uint8), length).tobytes().decode()))
+	return str(path)
+
+
+def run_btyper3(args, cache_dir):
+	env = dict(os.environ, BTYPER3_CACHE_DIR = str(cache_dir))
+	return subprocess.run([sys.executable, "-m", "btyper3"] + [str(arg) for arg in args], stdout = subprocess.PIPE, universal_newlines = True, env = env, check = True)
@@ -0,0 +1,79 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from btyper3.alleles import AlleleIndex
+from btyper3.blast import Blast
+from btyper3.kmers import reverse_complement
+
+BASES = np.frombuffer(b"ACGT", dtype = np.uint8)
+
+
+def random_seq(rng, length):
+	return rng.choice(BASES, length).tobytes()
+
+
+@pytest.fixture
+def alleles(tmp_path):
+	# two loci with alleles differing by a few substitutions; the last glp
+	# allele is shorter than the others
+	rng = np.random.default_rng(0)
+	sequences = {}
+	for locus, length in (("glp", 372), ("gmk", 504)):
+		base = bytearray(random_seq(rng, length))
+		for allele in range(1, 5):
+			seq = bytearray(base)
+			seq[allele * 50] = b"ACGT"[(b"ACGT".index(seq[allele * 50]) + 1) % 4]
+			sequences["{}_{}".format(locus, allele)] = bytes(seq)
+	sequences["glp_5"] = sequences["glp_1"][:-30]
+	path = tmp_path / "mlst.fas"
+	path.write_text("".join(">{}\n{}\n".format(allele, seq.decode()) for allele, seq in sequences.items()))
+	return str(path), sequences
+
+
+@pytest.fixture
+def genome(tmp_path, alleles):
+	# glp_2 on the plus strand of a contig, gmk_3 on the minus strand of another
+	rng = np.random.default_rng(1)
+	_, sequences = alleles
+	contigs = [
+		random_seq(rng, 1000) + sequences["glp_2"] + random_seq(rng, 2000),
+		random_seq(rng, 700) + reverse_complement(sequences["gmk_3"]) + random_seq(rng, 300),
+	]
+	path = tmp_path / "genome.fasta"
+	path.write_text("".join(">contig_{}\n{}\n".format(i + 1, seq.decode()) for i, seq in enumerate(contigs)))
+	return str(path)
+
+
+def hit_columns(lines):
+	return sorted(tuple(line.rstrip("\n").split("\t")[i] for i in (0, 1, 2, 3, 8, 9)) for line in lines)
+
+
+def test_exact_alleles_are_found_on_both_strands(alleles, genome):
+	index = AlleleIndex(alleles[0])
+	hits = index.find_alleles(genome)
+	assert sorted(hits) == ["glp", "gmk"]
+	assert hit_columns(hits["glp"]) == [("mlst__glp_2", "contig_1", "100.000", "372", "1001", "1372")]
+	assert hit_columns(hits["gmk"]) == [("mlst__gmk_3", "contig_2", "100.000", "504", "1204", "701")]
+
+	blast = Blast("blastn", None, None, None, None, None, 0, 0, 0.7, "1e-5")
+	split = blast.split_blast(iter(hits["glp"] + hits["gmk"]), None, "genome", ["mlst"], "off")
+	assert blast.parse_mlst(split["mlst"]) == ([["2"], ["3"]], 2)
+
+
+@pytest.mark.skipif(shutil.which("blastn") is None, reason = "requires BLAST+")
+def test_exact_alleles_match_blastn(alleles, genome, tmp_path):
+	index = AlleleIndex(alleles[0])
+	exact = index.find_alleles(genome)
+
+	blast = Blast("blastn", None, None, None, None, None, 0, 0, 0.7, "1e-5", blastdb = str(tmp_path / "blastdb"))
+	query = str(tmp_path / "queries.fasta")
+	Blast.merge_queries([("mlst", alleles[0])], query)
+	results = blast.split_blast(blast.stream_blast("blastn", genome, query, "1e-5"), None, "genome", ["mlst"], "off")
+	assert blast.parse_mlst(results["mlst"]) == blast.parse_mlst(blast.split_blast(iter(exact["glp"] + exact["gmk"]), None, "genome", ["mlst"], "off")["mlst"])
+
+	# the exact matches are the full-length, 100% identity blastn hits
+	full = [row for row in results["mlst"].itertuples(index = False) if row[2] == 100.0 and row[3] == row[12]]
+	assert sorted((row[0], row[1], row[8], row[9]) for row in full if row[3] == 372 or row[3] == 504) == \
+		sorted((allele[len("mlst__"):], contig, int(sstart), int(send)) for allele, contig, _, _, sstart, send in hit_columns(exact["glp"] + exact["gmk"]))
@@ -0,0 +1,178 @@
+import os
+import shutil
+
+import numpy as np
+import pandas
+import pytest
+
+import btyper3.ani
+from btyper3.ani import Ani, AniShards
+from btyper3.fasta import read_fasta
+
+
+def mutate(rng, seq, rate):
+	seq = seq.copy()
+	positions = rng.random(len(seq)) < rate
+	seq[positions] = rng.choice(np.frombuffer(b"ACGT", dtype = np.uint8), positions.sum())
+	return seq
+
+
+@pytest.fixture(scope = "module")
+def custom_database(tmp_path_factory):
+	directory = tmp_path_factory.mktemp("custom")
+	rng = np.random.default_rng(0)
+	base = rng.choice(np.frombuffer(b"ACGT", dtype = np.uint8), 60000)
+	lines = ["id\tthreshold"]
+	for i, rate in enumerate([0.01, 0.03, 0.05, 0.08]):
+		with open(directory / "ref{}.fna".format(i), "w") as handle:
+			handle.write(">ref{}\n{}\n".format(i, mutate(rng, base, rate).tobytes().decode()))
+		lines.append("ref{}.fna\t95".format(i))
+	(directory / "database.tsv").write_text("\n".join(lines) + "\n")
+	with open(directory / "query.fna", "w") as handle:
+		handle.write(">query\n{}\n".format(mutate(rng, base, 0.02).tobytes().decode()))
+	return directory
+
+
+@pytest.fixture(scope = "module")
+def ani_databases(tmp_path_factory):
+	# a data package with species and type strain databases sharing some of
+	# their reference genomes, as the built-in ANI databases do
+	root = tmp_path_factory.mktemp("ani")
+	package = root / "synthetic_ani_db"
+	package.mkdir()
+	(package / "__init__.py").write_text("")
+	rng = np.random.default_rng(1)
+	base = rng.choice(np.frombuffer(b"ACGT", dtype = np.uint8), 60000)
+	genomes = {"ref{}.fna".format(i): mutate(rng, base, rate) for i, rate in enumerate([0.01, 0.03, 0.05, 0.08, 0.04])}
+	databases = {
+		"species": ("id\tspecies\tthreshold", ["ref0.fna\talpha\t97", "ref1.fna\tbeta\t95", "ref2.fna\tgamma\t95", "ref3.fna\tdelta\t95"]),
+		"typestrains": ("id\ttypestrain", ["ref1.fna\tbeta", "ref3.fna\tdelta", "ref4.fna\tepsilon"]),
+	}
+	for taxon, (header, rows) in databases.items():
+		directory = package / taxon
+		directory.mkdir()
+		(directory / "__init__.py").write_text("")
+		(directory / "{}.tsv".format(taxon)).write_text("\n".join([header] + rows) + "\n")
+		for row in rows:
+			genome_id = row.split("\t")[0]
+			(directory / genome_id).write_text(">{}\n{}\n".format(genome_id, genomes[genome_id].tobytes().decode()))
+	query = root / "query.fna"
+	query.write_text(">query\n{}\n".format(mutate(rng, base, 0.02).tobytes().decode()))
+	return root, str(query)
+
+
+def test_combined_index_matches_separate_indexes(ani_databases, tmp_path, monkeypatch):
+	root, query = ani_databases
+	monkeypatch.syspath_prepend(str(root))
+	monkeypatch.setattr(btyper3.ani.AniIndex, "data_package", "synthetic_ani_db")
+
+	taxa = ["species", "typestrains"]
+	combined = btyper3.ani.AniIndex(taxa)
+	assert sorted(combined.references) == ["ref{}.fna".format(i) for i in range(5)]
+	results = Ani(taxa, query, None, "query", index = combined).query_fastani(taxa, query, str(tmp_path / "combined"), "query")
+
+	for taxon in taxa:
+		separate = btyper3.ani.AniIndex([taxon])
+		assert Ani([taxon], query, None, "query", index = separate).query_fastani([taxon], query, str(tmp_path / "separate"), "query") == {taxon: results[taxon]}
+		raw = "{}/query_{}_fastani.txt".format(taxon, taxon)
+		assert (tmp_path / "combined" / raw).read_text() == (tmp_path / "separate" / raw).read_text()
+		separate.close()
+	combined.close()
+	assert results["species"].startswith("alpha(") and results["typestrains"].startswith("beta(")
+
+
+def hits(shards, query):
+	return sorted((hit.name, round(hit.identity, 4)) for hit in shards.query(read_fasta(str(query)).views(), threads = 1))
+
+
+def test_shards_give_the_hits_of_a_single_index(custom_database, tmp_path):
+	single = AniShards(str(custom_database / "database.tsv"), 1 << 30, str(tmp_path / "single"))
+	# shards that don't fit in memory together are loaded for each query
+	sharded = AniShards(str(custom_database / "database.tsv"), 100000, str(tmp_path / "sharded"))
+	assert len(single.shards) == 1 and single.mappers is not None
+	assert len(sharded.shards) == 4 and sharded.mappers is None
+	assert hits(sharded, custom_database / "query.fna") == hits(single, custom_database / "query.fna")
+
+
+def test_shards_are_stored_in_scratch_when_the_cache_cannot_be_written(custom_database, tmp_path):
+	# a file where the cache directory should be can't be written to
+	cache = tmp_path / "cache"
+	cache.write_text("")
+	reference = AniShards(str(custom_database / "database.tsv"), 1 << 20, str(tmp_path / "reference"))
+
+	with pytest.raises(OSError):
+		AniShards(str(custom_database / "database.tsv"), 1 << 20, str(cache))
+
+	shards = AniShards(str(custom_database / "database.tsv"), 1 << 20, str(cache), scratch = str(tmp_path / "scratch"))
+	assert shards.store.cache_dir == str(tmp_path / "scratch")
+	assert hits(shards, custom_database / "query.fna") == hits(reference, custom_database / "query.fna")
+
+
+def test_custom_database_is_keyed_by_reference_content(custom_database, tmp_path, monkeypatch):
+	database = tmp_path / "custom"
+	shutil.copytree(custom_database, database)
+	cache = str(tmp_path / "cache")
+	digest = AniShards(str(database / "database.tsv"), 1 << 30, cache).digest
+
+	# a touched but identical reference keeps the key
+	os.utime(database / "ref1.fna", ns = (0, 0))
+	assert AniShards(str(database / "database.tsv"), 1 << 30, cache).digest == digest
+
+	# unchanged references are not hashed again
+	def file_sha256(path):
+		raise AssertionError("hashed " + path)
+	with monkeypatch.context() as patch:
+		patch.setattr(btyper3.ani, "file_sha256", file_sha256)
+		assert AniShards(str(database / "database.tsv"), 1 << 30, cache).digest == digest
+
+	# an edited reference with the same size and modification time changes it
+	stat = os.stat(database / "ref2.fna")
+	with open(database / "ref2.fna", "r+b") as handle:
+		handle.seek(-2, os.SEEK_END)
+		base = handle.read(1)
+		handle.seek(-2, os.SEEK_END)
+		handle.write(b"C" if base == b"A" else b"A")
+	os.utime(database / "ref2.fna", ns = (stat.st_atime_ns, stat.st_mtime_ns))
+	assert AniShards(str(database / "database.tsv"), 1 << 30, cache).digest != digest
+
+
+class FakeMapper:
+	fragment_length = 3000
+
+	def __init__(self, error = None):
+		self.error = error
+
+	def query_draft(self, contigs, threads = 0):
+		if self.error is not None:
+			raise self.error
+		return []
+
+
+class FakeIndex:
+	instances = []
+	error = None
+
+	def __init__(self, taxa, cache_dir = None, prescreen = 0):
+		self.databases = {taxon: pandas.DataFrame(columns = ["id", "threshold", taxon]) for taxon in taxa}
+		self.mapper = FakeMapper(FakeIndex.error)
+		self.closed = False
+		FakeIndex.instances.append(self)
+
+	def close(self):
+		self.closed = True
+
+
+@pytest.mark.parametrize("error", [None, RuntimeError("query failed")])
+def test_index_built_for_one_query_is_closed(custom_database, monkeypatch, error):
+	monkeypatch.setattr(btyper3.ani, "AniIndex", FakeIndex)
+	monkeypatch.setattr(FakeIndex, "instances", [])
+	monkeypatch.setattr(FakeIndex, "error", error)
+	query = str(custom_database / "query.fna")
+	ani = Ani(taxon = ["species"], fasta = query, final_results_directory = None, prefix = "query")
+
+	if error is None:
+		assert ani.query_fastani(["species"], query, None, "query") == {"species": "(Species unknown)"}
+	else:
+		with pytest.raises(RuntimeError):
+			ani.query_fastani(["species"], query, None, "query")
+	assert [index.closed for index in FakeIndex.instances] == [True]
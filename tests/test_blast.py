@@ -0,0 +1,122 @@
+import gzip
+import os
+
+import pytest
+
+from btyper3.blast import Blast
+from btyper3.outfmt import QUERY_TAG
+
+
+def hit(query, contig, pid, sstart, send, bits, qcov):
+	return [query, contig, pid, 500, 0, 0, 1, 500, sstart, send, 0.0, bits, 500, 90000, qcov, qcov]
+
+
+def write_hits(path, hits):
+	with open(path, "w") as handle:
+		for row in hits:
+			handle.write("\t".join(str(value) for value in row) + "\n")
+	return str(path)
+
+
+@pytest.fixture
+def blast():
+	return Blast("tblastn", None, None, None, None, None, 50, 70, 0.7, "1e-5")
+
+
+# the expected results below are those of the parsers of BTyper3 3.4.0
+VIRULENCE_HITS = [
+	hit("cya", "contig_1", 99.1, 100, 2500, 1600.0, 100),
+	hit("cya", "contig_2", 80.0, 100, 2500, 900.0, 100),
+	hit("pagA", "contig_1", 75.0, 5000, 7200, 1100.0, 95),
+	hit("lef", "contig_1", 98.0, 9000, 11000, 1200.0, 60),
+	hit("nheA", "contig_3", 96.0, 300, 1500, 700.0, 99),
+	hit("nheB", "contig_3", 69.9, 1600, 2800, 650.0, 99),
+	hit("nheC", "contig_3", 90.0, 2900, 4000, 640.0, 85),
+	hit("hblA", "contig_4", 88.0, 10, 1200, 600.0, 100),
+	hit("hblD", "contig_4", 91.0, 1300, 2000, 500.0, 100),
+	hit("cytK-1", "contig_5", 85.0, 100, 1100, 560.0, 100),
+	hit("cytK-2", "contig_5", 95.0, 100, 1100, 610.0, 100),
+	hit("sph", "contig_6", 99.0, 800, 100, 650.0, 100),
+	hit("capA", "contig_7", 72.0, 100, 1300, 450.0, 90),
+	hit("hasA", "contig_7", 70.0, 2000, 3000, 300.0, 80),
+	hit("bpsA", "contig_8", 60.0, 100, 900, 200.0, 100),
+]
+
+BT_HITS = [
+	hit("Cry1Aa1", "contig_1", 90.0, 1000, 4500, 2300.0, 100),
+	hit("Cry1Ab1", "contig_1", 88.0, 4400, 1100, 2200.0, 100),
+	hit("Cry1Ac1", "contig_1", 85.0, 1050, 4400, 2300.0, 98),
+	hit("Cry2Aa1", "contig_1", 95.0, 8000, 10000, 1300.0, 100),
+	hit("Cry2Ab1", "contig_1", 60.0, 9900, 12000, 900.0, 100),
+	hit("Cyt1Aa1", "contig_2", 99.0, 500, 1250, 500.0, 100),
+	hit("Cyt1Aa1", "contig_2", 99.0, 7000, 7750, 450.0, 100),
+	hit("Vip3Aa1", "contig_3", 45.0, 100, 2500, 800.0, 100),
+	hit("Vip2Aa1", "contig_3", 80.0, 3000, 4500, 700.0, 65),
+]
+
+MLST_HITS = [
+	hit("glp_1", "contig_1", 100.0, 100, 471, 870.0, 100),
+	hit("glp_7", "contig_1", 99.8, 100, 471, 865.0, 100),
+	hit("gmk_1", "contig_2", 100.0, 100, 604, 1110.0, 100),
+	hit("gmk_3", "contig_2", 100.0, 100, 604, 1110.0, 100),
+	hit("ilv_12", "contig_3", 99.2, 100, 486, 880.0, 100),
+	hit("pta_1", "contig_4", 100.0, 100, 416, 760.0, 100),
+	hit("pur_3", "contig_5", 100.0, 100, 381, 700.0, 100),
+	hit("pyc_2", "contig_6", 100.0, 100, 393, 720.0, 90),
+	hit("tpi_5", "contig_7", 100.0, 100, 436, 805.0, 100),
+	hit("tpi_9", "contig_7", 98.0, 100, 436, 790.0, 100),
+]
+
+
+def test_parse_virulence_matches_baseline(blast, tmp_path):
+	results = blast.parse_virulence(write_hits(tmp_path / "virulence.txt", VIRULENCE_HITS), 70, 80)
+	assert results == (["cya", "pagA"], [], ["nheA", "nheC"], ["hblA", "hblD"], ["cytK-2"], ["sph"], ["capA"], ["hasA"], [])
+
+
+def test_parse_virulence_selects_hits_by_exact_query_id(blast, tmp_path):
+	# hits of genes whose name starts with hblA are not counted as hblA hits
+	hits = [hit("hblA", "contig_1", 60.0, 100, 1300, 400.0, 100), hit("hblAB", "contig_1", 99.0, 100, 1300, 900.0, 100)]
+	assert blast.parse_virulence(write_hits(tmp_path / "virulence.txt", hits), 70, 80)[3] == []
+
+
+def test_parse_bt_matches_baseline(blast, tmp_path):
+	bt = blast.parse_bt(write_hits(tmp_path / "bt.txt", BT_HITS), 50, 70, 0.7)
+	assert bt == ["Cry1Aa1/Cry1Ac1", "Cry2Aa1", "Cry2Ab1", "Cyt1Aa1"]
+
+
+def test_parse_bt_only_resolves_overlaps_on_the_same_contig(blast, tmp_path):
+	hits = [hit("Cry1Aa1", "contig_1", 90.0, 1000, 4500, 2300.0, 100), hit("Cry1Ab1", "contig_2", 90.0, 1000, 4500, 2200.0, 100)]
+	assert blast.parse_bt(write_hits(tmp_path / "bt.txt", hits), 50, 70, 0.7) == ["Cry1Aa1", "Cry1Ab1"]
+
+
+def test_parse_mlst_matches_baseline(blast, tmp_path):
+	mlst, perfect_matches = blast.parse_mlst(write_hits(tmp_path / "mlst.txt", MLST_HITS))
+	assert mlst == [["1"], ["1", "3"], ["12"], ["1"], ["3"], ["2"], ["5"]]
+	assert perfect_matches == 5
+
+
+def test_parsers_handle_empty_results(blast, tmp_path):
+	empty = tmp_path / "empty.txt"
+	empty.write_text("")
+	assert blast.parse_virulence(str(empty), 70, 80) == ([], [], [], [], [], [], [], [], [])
+	assert blast.parse_bt(str(empty), 50, 70, 0.7) == []
+	assert blast.parse_mlst(str(empty)) == ([], 0)
+
+
+@pytest.mark.parametrize("output", ["plain", "gzip", "off"])
+def test_split_blast_stream_gives_the_results_of_each_stage(blast, tmp_path, output):
+	# one merged search, whose query ids are tagged with their stage
+	stages = {"virulence": VIRULENCE_HITS, "bt": BT_HITS}
+	lines = ["{}{}{}\n".format(suffix, QUERY_TAG, "\t".join(str(value) for value in row)) for suffix, hits in stages.items() for row in hits]
+	split = blast.split_blast(iter(lines), str(tmp_path), "genome", list(stages), output)
+
+	assert blast.parse_virulence(split["virulence"], 70, 80) == blast.parse_virulence(write_hits(tmp_path / "virulence.txt", VIRULENCE_HITS), 70, 80)
+	assert blast.parse_bt(split["bt"], 50, 70, 0.7) == blast.parse_bt(write_hits(tmp_path / "bt.txt", BT_HITS), 50, 70, 0.7)
+
+	for suffix, hits in stages.items():
+		raw = os.path.join(str(tmp_path), suffix, "genome_{}.txt".format(suffix))
+		if output == "off":
+			assert not os.path.exists(raw) and not os.path.exists(raw + ".gz")
+		else:
+			with (gzip.open(raw + ".gz", "rt") if output == "gzip" else open(raw)) as handle:
+				assert handle.read() == open(tmp_path / "{}.txt".format(suffix)).read()
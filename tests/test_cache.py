@@ -0,0 +1,41 @@
+import logging
+import pickle
+
+import pytest
+
+from btyper3.cache import Cache
+
+
+def test_cached_objects_are_loaded_back(tmp_path):
+	cache = Cache(str(tmp_path))
+	cache.dump({"contigs": [1, 2, 3]}, "ani", "species", "old")
+	cache.dump({"contigs": [4, 5]}, "ani", "species", "new")
+
+	assert cache.load("ani", "species", "new") == {"contigs": [4, 5]}
+	# the entry built from outdated inputs is removed
+	assert cache.load("ani", "species", "old") is None
+
+
+def test_cache_write_failures_do_not_stop_runs(tmp_path, caplog):
+	# a file in place of the cache directory can't hold any entry
+	blocked = tmp_path / "cache"
+	blocked.write_text("")
+	with caplog.at_level(logging.WARNING, logger = "btyper3.cache"):
+		Cache(str(blocked)).dump([1, 2, 3], "ani", "species", "key")
+		Cache(str(tmp_path)).dump(lambda: None, "ani", "species", "key")
+
+	assert [record.getMessage().startswith("Warning: could not write cache file") for record in caplog.records] == [True, True]
+	assert Cache(str(tmp_path)).load("ani", "species", "key") is None
+	# no temporary file is left behind
+	assert list((tmp_path / "ani").iterdir()) == []
+
+
+def test_required_cache_write_failures_are_raised(tmp_path):
+	blocked = tmp_path / "cache"
+	blocked.write_text("")
+	with pytest.raises(OSError):
+		Cache(str(blocked)).dump([1, 2, 3], "ani", "species", "key", required = True)
+	# older Pythons report unpicklable local objects as AttributeError
+	with pytest.raises((pickle.PicklingError, AttributeError)):
+		Cache(str(tmp_path)).dump(lambda: None, "ani", "species", "key", required = True)
+	assert list((tmp_path / "ani").iterdir()) == []
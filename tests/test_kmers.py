@@ -0,0 +1,16 @@
+import numpy as np
+
+from btyper3.kmers import canonical_kmers, hash64, minhash
+
+
+def test_minhash_keeps_distinct_hashes_of_repetitive_contigs():
+	rng = np.random.default_rng(0)
+	unit = rng.choice(np.frombuffer(b"ACGT", dtype = np.uint8), 3000).tobytes()
+	contigs = [unit * 20, rng.choice(np.frombuffer(b"ACGT", dtype = np.uint8), 500).tobytes() + unit * 5]
+	size, k = 1000, 21
+
+	all_hashes = np.concatenate([hash64(canonical_kmers(seq, k)) for seq in contigs])
+	assert len(all_hashes) > len(np.unique(all_hashes))
+
+	sketch = minhash(contigs, size, k)
+	assert np.array_equal(sketch, np.unique(all_hashes)[:size])
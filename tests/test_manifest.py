@@ -0,0 +1,102 @@
+import dataclasses
+import json
+import os
+
+from btyper3.manifest import Manifest
+from btyper3.typer import TypingResult
+
+from conftest import PANC_ONLY, random_genome, run_btyper3
+
+FINGERPRINT = {"version": "3.4.0", "databases": {"panC": "0" * 64}, "parameters": {"panC": "True"}}
+
+
+def typing_result(filename, **values):
+	fields = {field.name: "(Not Performed)" for field in dataclasses.fields(TypingResult)}
+	fields.update(filename = filename, prefix = os.path.splitext(filename)[0], custom = None, **values)
+	return TypingResult(**fields)
+
+
+def test_recorded_genomes_are_completed(tmp_path):
+	genome = tmp_path / "first.fasta"
+	random_genome(genome, [1000])
+	other = tmp_path / "second.fasta"
+	random_genome(other, [1000], seed = 1)
+	result = typing_result("first.fasta", panC = "Group_IV(tropicus)")
+
+	with Manifest(str(tmp_path / "manifest.jsonl"), FINGERPRINT) as manifest:
+		manifest.record(str(genome), result)
+
+	completed = Manifest(str(tmp_path / "manifest.jsonl"), FINGERPRINT).completed([str(genome), str(other)])
+	assert completed == {str(genome): result}
+
+
+def test_genomes_typed_with_other_parameters_are_not_completed(tmp_path):
+	genome = tmp_path / "first.fasta"
+	random_genome(genome, [1000])
+	with Manifest(str(tmp_path / "manifest.jsonl"), FINGERPRINT) as manifest:
+		manifest.record(str(genome), typing_result("first.fasta"))
+
+	fingerprint = dict(FINGERPRINT, parameters = {"panC": "False"})
+	assert Manifest(str(tmp_path / "manifest.jsonl"), fingerprint).completed([str(genome)]) == {}
+
+
+def test_modified_genomes_are_not_completed(tmp_path):
+	genome = tmp_path / "first.fasta"
+	random_genome(genome, [1000])
+	with Manifest(str(tmp_path / "manifest.jsonl"), FINGERPRINT) as manifest:
+		manifest.record(str(genome), typing_result("first.fasta"))
+
+	stat = os.stat(genome)
+	os.utime(genome, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+	assert Manifest(str(tmp_path / "manifest.jsonl"), FINGERPRINT).completed([str(genome)]) == {}
+
+
+def test_truncated_record_is_ignored(tmp_path):
+	path = tmp_path / "manifest.jsonl"
+	genomes = []
+	for i in range(2):
+		genome = tmp_path / "genome_{}.fasta".format(i)
+		random_genome(genome, [1000], seed = i)
+		genomes.append(str(genome))
+	with Manifest(str(path), FINGERPRINT) as manifest:
+		manifest.record(genomes[0], typing_result("genome_0.fasta"))
+		manifest.record(genomes[1], typing_result("genome_1.fasta"))
+
+	# interrupt the run in the middle of the last record
+	with open(path, "r+b") as handle:
+		handle.truncate(os.path.getsize(path) - 20)
+	assert list(Manifest(str(path), FINGERPRINT).completed(genomes)) == [genomes[0]]
+
+	# the next run starts its records on a new line
+	with Manifest(str(path), FINGERPRINT) as manifest:
+		manifest.record(genomes[1], typing_result("genome_1.fasta"))
+	assert list(Manifest(str(path), FINGERPRINT).completed(genomes)) == genomes
+
+
+def test_resumed_batch_only_types_remaining_genomes(fake_blast, tmp_path):
+	genomes = tmp_path / "genomes"
+	genomes.mkdir()
+	for i in range(3):
+		random_genome(genomes / "genome_{}.fasta".format(i), [3000], seed = i)
+	output = tmp_path / "out"
+	final_results = output / "btyper3_final_results"
+	calls = fake_blast / "makeblastdb.calls"
+
+	run_btyper3(["-i", genomes, "-o", output] + PANC_ONLY, tmp_path / "cache")
+	with open(final_results / "btyper3_final_results.txt") as handle:
+		expected = handle.read()
+	assert sorted(calls.read_text().split()) == ["genome_0.fasta", "genome_1.fasta", "genome_2.fasta"]
+
+	# interrupt the batch while the last genome is recorded
+	manifest = final_results / "btyper3_manifest.jsonl"
+	lines = manifest.read_text().splitlines(True)
+	assert json.loads(lines[-1])["input"] == str(genomes / "genome_2.fasta")
+	manifest.write_text("".join(lines[:-1]) + lines[-1][:40])
+	os.remove(final_results / "btyper3_final_results.txt")
+	calls.write_text("")
+
+	# an empty cache makes sure genomes are skipped through the manifest
+	run_btyper3(["-i", genomes, "-o", output, "--resume", "True"] + PANC_ONLY, tmp_path / "resumed_cache")
+	assert calls.read_text().split() == ["genome_2.fasta"]
+	with open(final_results / "btyper3_final_results.txt") as handle:
+		assert handle.read() == expected
@@ -0,0 +1,15 @@
+from btyper3.fasta import Genome
+from btyper3.pack import ReferencePack, write_pack
+
+
+def test_pack_round_trip_and_close(tmp_path):
+	genome = Genome("ref.fna", ["contig_1", "contig_2"], [b"ACGTNNACGTTGCA", b"GGGRYCCCAT"])
+	path = str(tmp_path / "references.pack")
+	write_pack(path, [("ref.fna", genome, "0" * 64)])
+
+	with ReferencePack(path) as pack:
+		assert "ref.fna" in pack
+		assert pack.sha256("ref.fna") == "0" * 64
+		read = pack.read("ref.fna")
+		assert read.ids == genome.ids and read.sequences == genome.sequences
+	assert pack.data.closed
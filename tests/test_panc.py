@@ -0,0 +1,70 @@
+import importlib.resources
+import shutil
+
+import numpy as np
+import pytest
+
+from btyper3.blast import Blast
+from btyper3.fasta import read_fasta
+from btyper3.kmers import reverse_complement
+from btyper3.panc import PanCIndex
+
+BASES = np.frombuffer(b"ACGT", dtype = np.uint8)
+
+
+@pytest.fixture(scope = "module")
+def panC_path():
+	with importlib.resources.path("btyper3.seq_panC_db", "panC.fna") as path:
+		yield str(path)
+
+
+def write_genome(path, panC, strand, seed = 0):
+	rng = np.random.default_rng(seed)
+	seq = panC if strand == "plus" else reverse_complement(panC)
+	contigs = [rng.choice(BASES, 5000).tobytes(), rng.choice(BASES, 800).tobytes() + seq + rng.choice(BASES, 1200).tobytes()]
+	with open(path, "w") as handle:
+		for i, contig in enumerate(contigs):
+			handle.write(">contig_{}\n{}\n".format(i + 1, contig.decode()))
+	return str(path)
+
+
+def parse(lines):
+	blast = Blast("blastn", None, None, None, None, None, 0, 0, 0.7, "1e-5")
+	return blast.parse_panC(blast.split_blast(iter(lines), None, "genome", ["panC"], "off")["panC"])
+
+
+@pytest.mark.parametrize("strand", ["plus", "minus"])
+def test_panC_group_is_found_without_blast(panC_path, tmp_path, strand):
+	name, panC = next(iter(read_fasta(panC_path)))
+	hits = PanCIndex(panC_path).find_panC(write_genome(tmp_path / "genome.fasta", panC, strand))
+	assert hits is not None and parse(hits) == name
+
+	fields = hits[0].split("\t")
+	assert fields[1:4] == ["contig_2", "100.000", str(len(panC))]
+	start, end = 801, 800 + len(panC)
+	assert (int(fields[8]), int(fields[9])) == ((start, end) if strand == "plus" else (end, start))
+
+
+def test_genomes_without_panC_are_left_to_blast(panC_path, tmp_path):
+	genome = tmp_path / "genome.fasta"
+	genome.write_text(">contig_1\n{}\n".format(np.random.default_rng(0).choice(BASES, 8000).tobytes().decode()))
+	assert PanCIndex(panC_path).find_panC(str(genome)) is None
+
+
+@pytest.mark.skipif(shutil.which("blastn") is None, reason = "requires BLAST+")
+def test_panC_groups_match_blastn(panC_path, tmp_path):
+	index = PanCIndex(panC_path)
+	blast = Blast("blastn", None, None, None, None, None, 0, 0, 0.7, "1e-5")
+	query = str(tmp_path / "queries.fasta")
+	Blast.merge_queries([("panC", panC_path)], query)
+
+	found = 0
+	for i, (name, panC) in enumerate(read_fasta(panC_path)):
+		genome = write_genome(tmp_path / "genome{}.fasta".format(i), panC, "minus" if i % 2 else "plus", seed = i)
+		hits = index.find_panC(genome)
+		if hits is None:
+			continue
+		found += 1
+		blast.blastdb = str(tmp_path / "blastdb{}".format(i))
+		assert parse(hits) == parse(blast.stream_blast("blastn", genome, query, "1e-5")), name
+	assert found > 0
@@ -0,0 +1,15 @@
+import json
+
+from conftest import PANC_ONLY, random_genome, run_btyper3
+
+
+def test_streamed_jsonl_results_parse(fake_blast, tmp_path):
+	genomes = tmp_path / "genomes"
+	genomes.mkdir()
+	random_genome(genomes / "first.fasta", [5000, 2000], seed = 1)
+	random_genome(genomes / "second.fasta", [4000], seed = 2)
+
+	proc = run_btyper3(["-i", genomes, "-o", tmp_path / "out", "--output_format", "jsonl", "--results_file", "-"] + PANC_ONLY, tmp_path / "cache")
+
+	rows = [json.loads(line) for line in proc.stdout.splitlines()]
+	assert len(rows) == 2
@@ -0,0 +1,33 @@
+import argparse
+import concurrent.futures
+import os
+
+from btyper3 import add_typing_arguments
+from btyper3.pipeline import Pipeline
+from btyper3.server import TypingServer
+from conftest import PANC_ONLY, random_genome
+
+
+def panC_pipeline(tmp_path):
+	parser = argparse.ArgumentParser()
+	add_typing_arguments(parser)
+	args = parser.parse_args(PANC_ONLY + ["--cache_dir", str(tmp_path / "cache")])
+	directory = os.path.join(str(tmp_path / "out"), "btyper3_final_results", "")
+	return Pipeline(args, directory, jobs = 2), directory
+
+
+def test_concurrent_uploads_with_the_same_name_get_their_own_output_files(fake_blast, tmp_path):
+	uploads = [open(random_genome(tmp_path / "genome{}.fasta".format(i), [3000], seed = i), "rb").read() for i in range(2)]
+	pipeline, directory = panC_pipeline(tmp_path)
+	with pipeline:
+		server = TypingServer(pipeline, workers = 2)
+		try:
+			with concurrent.futures.ThreadPoolExecutor(2) as executor:
+				results = list(executor.map(lambda data: server.type_genome("assembly.fasta", data), uploads))
+		finally:
+			server.stop_workers()
+
+	prefixes = [result["prefix"] for result in results]
+	assert len(set(prefixes)) == 2 and all(prefix.startswith("assembly_") for prefix in prefixes)
+	assert [result["filename"] for result in results] == ["assembly.fasta"] * 2
+	assert sorted(os.listdir(directory + "panC")) == sorted(prefix + "_panC.txt" for prefix in prefixes)